@@ -1,4 +1,18 @@
-from .gui import ADASScenarioGeneratorGUI
-from .scenario_generator import ScenarioGenerator
-from .category_manager import CategoryManager
-from .exclusion_rules import ExclusionRulesManager
\ No newline at end of file
+import importlib
+
+# tkinter を必要としない用途（コマンドライン実行など）のため、サブモジュールは
+# 実際に参照されたときに読み込む
+_exports = {
+    "ADASScenarioGeneratorGUI": ".gui",
+    "ScenarioGenerator": ".scenario_generator",
+    "CategoryManager": ".category_manager",
+    "ExclusionRulesManager": ".exclusion_rules",
+}
+
+__all__ = list(_exports)
+
+def __getattr__(name):
+    if name in _exports:
+        module = importlib.import_module(_exports[name], __name__)
+        return getattr(module, name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
\ No newline at end of file
@@ -0,0 +1,361 @@
+import datetime
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from .category_manager import CategoryManager
+from .exclusion_rules import CompiledRules, ExclusionRulesManager
+from .scenario import SCENARIO_CATEGORIES
+from .scenario_generator import ScenarioGenerator
+
+# 生成・フィルタ・除外判定・カテゴリJSONの読み書き・結果ビューへの表示の性能を測定する。
+# カテゴリは同梱の categories.json の各サブカテゴリの項目数を scale 倍にした合成データ、
+# ルールは指定件数のランダムな2項目ルールを使い、乱数シードを固定して再現できるようにする。
+# 結果は JSON で保存し、compare_results で別のコミットの結果と比較できる。
+# Treeview を使う測定には画面が必要なので、ディスプレイのない環境では
+# 「xvfb-run -a python -m adas_scenario_generator benchmark ...」のように仮想ディスプレイ上で実行する
+# （画面がない場合は省略し、Tk を使わない行データの作成（result_rows_window）だけを測定する）
+
+BENCHMARK_FORMAT_VERSION = 1
+DEFAULT_SCALES = (0.25, 0.5, 1.0)
+DEFAULT_RULE_COUNTS = (10, 100, 1000, 10000)
+PERCENTILES = (50, 90, 99)
+IMPORT_MODULES = ("adas_scenario_generator", "adas_scenario_generator.category_manager",
+                  "adas_scenario_generator.exclusion_rules", "adas_scenario_generator.scenario_generator",
+                  "adas_scenario_generator.cli")
+IMPORT_RUNS = 5
+IMPORT_MIN_REGRESSION = 0.005  # 読み込み時間の増加をこの秒数未満なら性能低下とみなさない
+RESULT_WINDOW_ROWS = 40  # 結果ビューが1回の描画で作る行数
+
+def scaled_categories(categories, scale):
+    # 各サブカテゴリの項目数を scale 倍にする。元より多い分は「項目名_2」のような項目を追加する
+    scaled = {}
+    for category, subcategories in categories.items():
+        scaled[category] = {}
+        for subcategory, items in subcategories.items():
+            count = max(1, round(len(items) * scale)) if items else 0
+            new_items = list(items[:count])
+            copy = 2
+            while len(new_items) < count:
+                new_items.extend(f"{item}_{copy}" for item in items[:count - len(new_items)])
+                copy += 1
+            scaled[category][subcategory] = new_items
+    return scaled
+
+
+def synthetic_rules(categories, count, seed):
+    # 異なるサブカテゴリの項目を組み合わせたランダムな2項目ルール
+    rng = random.Random(seed)
+    item_lists = [items for category in SCENARIO_CATEGORIES
+                  for items in categories.get(category, {}).values() if items]
+    rules = []
+    for _ in range(count):
+        if len(item_lists) < 2:
+            break
+        first, second = rng.sample(item_lists, 2)
+        rules.append((rng.choice(first), rng.choice(second)))
+    return rules
+
+
+def percentiles(samples):
+    ordered = sorted(samples)
+    if not ordered:
+        return {}
+    result = {f"p{percentile}": ordered[min(len(ordered) - 1, len(ordered) * percentile // 100)]
+              for percentile in PERCENTILES}
+    result["max"] = ordered[-1]
+    return result
+
+
+def measure(func, trace_memory=True):
+    # 実行時間と戻り値を返す。trace_memory=True の場合はもう一度 tracemalloc 下で実行して
+    # ピークメモリ（バイト）も求める（tracemalloc は処理を遅くするので時間の計測とは分ける）
+    start_time = time.perf_counter()
+    result = func()
+    seconds = time.perf_counter() - start_time
+    peak = None
+    if trace_memory:
+        del result
+        tracemalloc.start()
+        try:
+            result = func()
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+    return result, seconds, peak
+
+
+def measure_latency(func, arguments):
+    samples = []
+    for argument in arguments:
+        start_time = time.perf_counter_ns()
+        func(argument)
+        samples.append((time.perf_counter_ns() - start_time) / 1000)
+    return {name: round(value, 3) for name, value in percentiles(samples).items()}
+
+
+def measure_import(module, runs=IMPORT_RUNS):
+    # 新しいインタプリタでモジュールを読み込むまでの時間（インタプリタ自体の起動時間は含めない）の最小値と
+    # ばらつき（最大値 - 最小値）、tkinter / numpy が読み込まれたかどうかを返す。
+    # ディスクキャッシュや他のプロセスの影響は時間を増やす方向にしか働かないので、最小値を使う
+    code = ("import sys, time; start = time.perf_counter(); import " + module +
+            "; print(time.perf_counter() - start, 'tkinter' in sys.modules, 'numpy' in sys.modules)")
+    package_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    environ = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [package_dir, os.environ.get("PYTHONPATH")])))
+    samples = []
+    for _ in range(runs):
+        output = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, env=environ,
+                                check=True, timeout=60).stdout.split()
+        samples.append(float(output[0]))
+    return min(samples), max(samples) - min(samples), output[1] == "True", output[2] == "True"
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(__file__), timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+class ScenarioBenchmark:
+    def __init__(self, category_file, scales=DEFAULT_SCALES, rule_counts=DEFAULT_RULE_COUNTS, seed=0,
+                 samples=2000, trace_memory=True, gui=True, log=None):
+        self.category_file = category_file
+        self.base_categories = CategoryManager.from_file(category_file).categories
+        self.scales = list(scales)
+        self.rule_counts = list(rule_counts)
+        self.seed = seed
+        self.samples = samples
+        self.trace_memory = trace_memory
+        self.gui = gui
+        self.log = log or (lambda message: None)
+        self.results = []
+
+    def add_result(self, name, scale, rules, **values):
+        result = {"name": name, "scale": scale, "rules": rules}
+        result.update(values)
+        self.results.append(result)
+        self.log(" ".join(f"{key}={value}" for key, value in result.items()))
+        return result
+
+    def run(self):
+        self.run_imports()
+        with tempfile.TemporaryDirectory() as work_dir:
+            for scale in self.scales:
+                self.run_scale(scale, work_dir)
+        return {
+            "format": BENCHMARK_FORMAT_VERSION,
+            "meta": {
+                "commit": git_commit(),
+                "created": datetime.datetime.now().isoformat(timespec="seconds"),
+                "python": sys.version.split()[0],
+                "platform": platform.platform(),
+                "seed": self.seed,
+                "scales": self.scales,
+                "rule_counts": self.rule_counts,
+                "samples": self.samples
+            },
+            "results": self.results
+        }
+
+    def run_imports(self):
+        for module in IMPORT_MODULES:
+            seconds, spread, tkinter_loaded, numpy_loaded = measure_import(module)
+            self.add_result("cold_import", 0, 0, module=module, seconds=round(seconds, 6), spread=round(spread, 6),
+                            tkinter=tkinter_loaded, numpy=numpy_loaded)
+
+    def run_scale(self, scale, work_dir):
+        categories = scaled_categories(self.base_categories, scale)
+        category_file = os.path.join(work_dir, f"categories_{scale}.json")
+        category_manager = CategoryManager.from_file(self.category_file)
+        category_manager.categories = categories
+        category_manager.write_categories(category_file)
+
+        # カテゴリJSONの読み込み・保存
+        load_latency = measure_latency(lambda _: CategoryManager.from_file(category_file), range(20))
+        save_latency = measure_latency(lambda _: category_manager.write_categories(category_file), range(20))
+        self.add_result("category_json_load", scale, 0, latency_us=load_latency)
+        self.add_result("category_json_save", scale, 0, latency_us=save_latency)
+
+        category_manager = CategoryManager.from_file(category_file)
+        selected = {category: {subcategory: list(items)
+                               for subcategory, items in category_manager.categories.get(category, {}).items()
+                               if items}
+                    for category in SCENARIO_CATEGORIES}
+
+        # 直積の生成（ルールの件数に依存しない）
+        exclusion_rules_manager = ExclusionRulesManager(category_manager)
+        scenario_generator = ScenarioGenerator(category_manager, exclusion_rules_manager)
+        scenarios, seconds, peak = measure(lambda: scenario_generator.generate_scenarios(selected),
+                                           self.trace_memory)
+        self.add_result("generate_scenarios", scale, 0, scenarios=len(scenarios), seconds=round(seconds, 6),
+                        throughput=round(len(scenarios) / seconds, 1) if seconds else None, peak_bytes=peak)
+
+        rng = random.Random(self.seed)
+        sample = [rng.choice(scenarios) for _ in range(self.samples)] if scenarios else []
+        for rule_count in self.rule_counts:
+            self.run_rules(scale, rule_count, category_manager, scenarios, sample, work_dir)
+
+        if self.gui:
+            self.run_treeview(scale, scenarios, exclusion_rules_manager)
+            self.run_item_selector(scale, category_manager)
+
+    def run_rules(self, scale, rule_count, category_manager, scenarios, sample, work_dir):
+        # 実際に育ったルールファイルと同様に、重複したルールもそのまま含める
+        rules = synthetic_rules(category_manager.categories, rule_count, self.seed)
+        rule_file = os.path.join(work_dir, f"rules_{scale}_{rule_count}.json")
+        with open(rule_file, "w", encoding="utf-8") as file:
+            json.dump({"version": "1.0",
+                       "rules": [{"id": i + 1, "items": list(items), "description": f"Rule {i + 1}"}
+                                 for i, items in enumerate(rules)]}, file, ensure_ascii=False)
+        exclusion_rules_manager = ExclusionRulesManager(category_manager)
+        _, seconds, _ = measure(lambda: exclusion_rules_manager.load_rules_from(rule_file), False)
+        self.add_result("rule_json_load", scale, rule_count, seconds=round(seconds, 6))
+
+        # 読み込み時にコンパイル済みのルールも作られるので、ここでは索引の構築だけを測る
+        _, seconds, _ = measure(lambda: CompiledRules(exclusion_rules_manager.rules), False)
+        self.add_result("rule_compile", scale, rule_count, seconds=round(seconds, 6))
+
+        scenario_generator = ScenarioGenerator(category_manager, exclusion_rules_manager)
+        valid, seconds, peak = measure(lambda: scenario_generator.filter_scenarios(scenarios), self.trace_memory)
+        self.add_result("filter_scenarios", scale, rule_count, scenarios=len(scenarios), valid=len(valid),
+                        seconds=round(seconds, 6),
+                        throughput=round(len(scenarios) / seconds, 1) if seconds else None, peak_bytes=peak)
+        del valid
+
+        self.add_result("is_excluded", scale, rule_count, calls=len(sample),
+                        latency_us=measure_latency(exclusion_rules_manager.is_excluded, sample))
+        self.add_result("is_excluded_with_rules", scale, rule_count, calls=len(sample),
+                        latency_us=measure_latency(exclusion_rules_manager.is_excluded_with_rules, sample))
+        self.run_result_rows(scale, rule_count, scenarios, exclusion_rules_manager)
+
+    def run_result_rows(self, scale, rule_count, scenarios, exclusion_rules_manager):
+        # 結果ビューが1回の描画で行う行データの作成（除外判定と文字列の連結）を Tk を使わずに測る。
+        # 行の値の作り方は GUI の get_result_row_values と同じ
+        def row_values(position, scenario):
+            is_excluded, applied_rules = exclusion_rules_manager.is_excluded_with_rules(scenario)
+            values = tuple(", ".join(scenario[category]) for category in SCENARIO_CATEGORIES)
+            if is_excluded:
+                return values + (f"除外理由: {', '.join(applied_rules)}",), ('excluded',)
+            return values + ("",), ()
+
+        def build_window(first):
+            last = min(len(scenarios), first + RESULT_WINDOW_ROWS)
+            return [row_values(position, scenarios[position]) for position in range(first, last)]
+
+        rng = random.Random(self.seed)
+        firsts = [rng.randrange(max(1, len(scenarios) - RESULT_WINDOW_ROWS + 1)) for _ in range(200)]
+        self.add_result("result_rows_window", scale, rule_count, calls=len(firsts), rows=RESULT_WINDOW_ROWS,
+                        latency_us=measure_latency(build_window, firsts))
+
+    def run_treeview(self, scale, scenarios, exclusion_rules_manager):
+        # 画面がない環境（ディスプレイのないCIなど）では測定を省略する（xvfb-run で実行すれば測定できる）
+        try:
+            import tkinter as tk
+            from tkinter import ttk
+            from .result_view import VirtualScenarioView
+            root = tk.Tk()
+        except Exception as e:
+            self.add_result("treeview_insert", scale, 0, skipped=f"{e}（xvfb-run -a で実行すると測定できます）")
+            return
+
+        try:
+            root.withdraw()
+            columns = SCENARIO_CATEGORIES + ("除外理由",)
+
+            def row_values(position, scenario):
+                return tuple(", ".join(scenario[category]) for category in SCENARIO_CATEGORIES) + ("",), ()
+
+            # 全件を Treeview に挿入する従来の方式（最大1万行）
+            rows = scenarios[:10000]
+            tree = ttk.Treeview(root, columns=columns, show="headings")
+
+            def insert_all():
+                for position, scenario in enumerate(rows):
+                    values, tags = row_values(position, scenario)
+                    tree.insert("", "end", values=values, tags=tags)
+                root.update_idletasks()
+                tree.delete(*tree.get_children())
+
+            _, seconds, _ = measure(insert_all, False)
+            self.add_result("treeview_insert", scale, 0, rows=len(rows), seconds=round(seconds, 6),
+                            throughput=round(len(rows) / seconds, 1) if seconds else None)
+
+            # 仮想化された結果ビュー: 全件を渡したときの表示とスクロールの遅延
+            view = VirtualScenarioView(root, columns, row_values)
+            _, seconds, _ = measure(lambda: view.set_rows(scenarios), False)
+            self.add_result("virtual_view_set_rows", scale, 0, rows=len(scenarios), seconds=round(seconds, 6))
+            rng = random.Random(self.seed)
+            positions = [rng.randrange(max(1, len(scenarios))) for _ in range(200)]
+            self.add_result("virtual_view_scroll", scale, 0, calls=len(positions),
+                            latency_us=measure_latency(view.scroll_to, positions))
+        finally:
+            root.destroy()
+
+    def run_item_selector(self, scale, category_manager):
+        # 項目数の多いカテゴリ用の項目選択リスト: 開く時間と検索の遅延
+        try:
+            import tkinter as tk
+            from .item_selector import VirtualItemSelector
+            root = tk.Tk()
+        except Exception as e:
+            self.add_result("item_selector_open", scale, 0, skipped=f"{e}（xvfb-run -a で実行すると測定できます）")
+            return
+
+        try:
+            root.withdraw()
+            for category, subcategories in category_manager.categories.items():
+                items = sum(len(values) for values in subcategories.values())
+                selection = {subcategory: set() for subcategory in subcategories}
+                selector, seconds, _ = measure(lambda: VirtualItemSelector(root, subcategories, selection), False)
+                self.add_result("item_selector_open", scale, 0, category=category, items=items,
+                                seconds=round(seconds, 6))
+                rng = random.Random(self.seed)
+                all_items = [item for values in subcategories.values() for item in values]
+                queries = [rng.choice(all_items)[:2] for _ in range(50)] if all_items else []
+                self.add_result("item_selector_search", scale, 0, category=category, calls=len(queries),
+                                latency_us=measure_latency(selector.search_var.set, queries))
+        finally:
+            root.destroy()
+
+
+def result_key(result):
+    return (result["name"], result["scale"], result["rules"], result.get("module"), result.get("category"))
+
+
+def compare_results(baseline, current, tolerance=0.1):
+    # スループットの低下、遅延（p50）やピークメモリの増加が tolerance（割合）を超えたものを返す。
+    # モジュールの読み込み時間は数十ミリ秒と短くばらつきが大きいので、増加が tolerance に加えて
+    # IMPORT_MIN_REGRESSION と両方の測定のばらつきを超えた場合だけ性能低下とする
+    baseline_results = {result_key(result): result for result in baseline.get("results", [])}
+    regressions = []
+    for result in current.get("results", []):
+        previous = baseline_results.get(result_key(result))
+        if previous is None:
+            continue
+        checks = [("throughput", result.get("throughput"), previous.get("throughput"), False),
+                  ("peak_bytes", result.get("peak_bytes"), previous.get("peak_bytes"), True),
+                  ("latency_p50_us", (result.get("latency_us") or {}).get("p50"),
+                   (previous.get("latency_us") or {}).get("p50"), True)]
+        if result["name"] == "cold_import":
+            checks.append(("seconds", result.get("seconds"), previous.get("seconds"), True))
+        for metric, value, previous_value, higher_is_worse in checks:
+            if not value or not previous_value:
+                continue
+            if metric == "seconds":
+                noise = max(IMPORT_MIN_REGRESSION, result.get("spread") or 0, previous.get("spread") or 0)
+                if value - previous_value <= noise:
+                    continue
+            change = (value - previous_value) / previous_value
+            if (change > tolerance) if higher_is_worse else (change < -tolerance):
+                regressions.append({"name": result["name"], "scale": result["scale"], "rules": result["rules"],
+                                    "module": result.get("module"), "metric": metric, "baseline": previous_value, "current": value,
+                                    "change": round(change, 4)})
+    return regressions
@@ -1,23 +1,90 @@
 import os
+import sys
 import json
 import codecs
-from tkinter import messagebox, filedialog
+
+from .item_search import ItemSearchIndex
+
+DEFAULT_CATEGORY_FILE = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), 'data', 'categories.json')
 
 class CategoryManager:
-    def __init__(self):
+    def __init__(self, category_file=None):
+        # 項目名とIDの対応表。IDは追加順に割り当て、項目が削除されても再利用しない
+        self.item_names = []
+        self.item_ids = {}
+        # categories の索引。変更用のメソッドがすべて同期させ、変更のたびに version を増やす
+        # （他のコンポーネントは version をキーにして結果をキャッシュできる）
+        self.item_sets = {}  # (カテゴリ, サブカテゴリ) -> 項目の順序付き集合（値が None の dict）
+        self.item_locations = {}  # 項目 -> その項目がある (カテゴリ, サブカテゴリ) のリスト
+        self.version = 0
+        self._stale = set()  # 項目を削除した後、リストをまだ item_sets に合わせていない (カテゴリ, サブカテゴリ)
+        self._all_items = None
+        self._all_items_version = None
+        self._search_indexes = {}
+        self._search_indexes_version = None
         self.categories = {}
-        self.category_file = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), 'data', 'categories.json')
-        self.load_categories()
+        if category_file is None:
+            self.category_file = DEFAULT_CATEGORY_FILE
+            self.load_categories()
+        else:
+            # ファイルを指定した場合はダイアログを使わず、失敗は例外で通知する
+            self.category_file = category_file
+            self.read_categories(category_file)
+
+    @classmethod
+    def from_file(cls, file_path):
+        return cls(file_path)
+
+    def read_categories(self, file_path):
+        with codecs.open(file_path, 'r', 'utf-8') as file:
+            categories = json.load(file)
+        if not isinstance(categories, dict):
+            raise ValueError(f"'{file_path}' はカテゴリ定義の形式ではありません。")
+        self.categories = categories
+
+    @property
+    def categories(self):
+        # remove_item はリストから項目を取り除かずに索引だけを更新するので、参照される時点で
+        # 削除のあったサブカテゴリのリストを item_sets（順序付き）から作り直す。続けて削除しても作り直しは1回で済む
+        if self._stale:
+            for category, subcategory in self._stale:
+                self._categories[category][subcategory] = list(self.item_sets[(category, subcategory)])
+            self._stale.clear()
+        return self._categories
+
+    @categories.setter
+    def categories(self, categories):
+        self._categories = categories
+        self.rebuild_index()
+
+    def rebuild_index(self):
+        # categories の中身を直接書き換えた場合は、これを呼んで索引を作り直す。
+        # 同じサブカテゴリ内で重複している項目は1つにまとめる。渡された辞書やリストは書き換えず、新しく作る
+        self.item_sets = {}
+        self.item_locations = {}
+        self._stale.clear()
+        rebuilt = {}
+        for category, subcategories in self._categories.items():
+            rebuilt[category] = {}
+            for subcategory, items in subcategories.items():
+                item_set = dict.fromkeys(self.item_names[self.intern_item(item)] for item in items)
+                rebuilt[category][subcategory] = list(item_set)
+                self.item_sets[(category, subcategory)] = item_set
+                for item in item_set:
+                    self.item_locations.setdefault(item, []).append((category, subcategory))
+        self._categories = rebuilt
+        self.version += 1
 
     def load_categories(self):
+        from tkinter import messagebox
+
         if not os.path.exists(self.category_file):
             messagebox.showinfo("情報", "categories.jsonファイルが見つかりません。ファイルを選択してください。")
             self.select_category_file()
             return
 
         try:
-            with codecs.open(self.category_file, 'r', 'utf-8') as file:
-                self.categories = json.load(file)
+            self.read_categories(self.category_file)
             print(f"Successfully loaded categories from {self.category_file}")
         except json.JSONDecodeError as e:
             print(f"JSON decode error: {str(e)}")
@@ -29,6 +96,8 @@ class CategoryManager:
             self.select_category_file()
 
     def select_category_file(self):
+        from tkinter import messagebox, filedialog
+
         file_path = filedialog.askopenfilename(filetypes=[("JSON files", "*.json")])
         if file_path:
             self.category_file = file_path
@@ -39,10 +108,15 @@ class CategoryManager:
                 self.categories = {"環境状況": {}, "車両状況": {}}
 
 
+    def write_categories(self, file_path):
+        with codecs.open(file_path, 'w', 'utf-8') as file:
+            json.dump(self.categories, file, ensure_ascii=False, indent=2)
+
     def save_categories(self):
+        from tkinter import messagebox
+
         try:
-            with codecs.open(self.category_file, 'w', 'utf-8') as file:
-                json.dump(self.categories, file, ensure_ascii=False, indent=2)
+            self.write_categories(self.category_file)
             messagebox.showinfo("保存完了", f"カテゴリ情報を '{self.category_file}' に保存しました。")
         except Exception as e:
             messagebox.showerror("エラー", f"カテゴリの保存中にエラーが発生しました: {str(e)}")
@@ -50,25 +124,89 @@ class CategoryManager:
     def add_category(self, category):
         if category not in self.categories:
             self.categories[category] = {}
+            self.version += 1
 
     def add_subcategory(self, category, subcategory):
         if category in self.categories and subcategory not in self.categories[category]:
             self.categories[category][subcategory] = []
+            self.item_sets[(category, subcategory)] = {}
+            self.version += 1
 
     def add_item(self, category, subcategory, item):
-        if category in self.categories and subcategory in self.categories[category]:
-            if item not in self.categories[category][subcategory]:
-                self.categories[category][subcategory].append(item)
+        item_set = self.item_sets.get((category, subcategory))
+        if item_set is not None and item not in item_set:
+            item = self.item_names[self.intern_item(item)]
+            self.categories[category][subcategory].append(item)
+            item_set[item] = None
+            self.item_locations.setdefault(item, []).append((category, subcategory))
+            self.version += 1
+
+    def intern_item(self, item):
+        item_id = self.item_ids.get(item)
+        if item_id is None:
+            item = sys.intern(item)
+            item_id = len(self.item_names)
+            self.item_names.append(item)
+            self.item_ids[item] = item_id
+        return item_id
+
+    def get_item_name(self, item_id):
+        return self.item_names[item_id]
+
+    def get_item_id(self, item):
+        return self.item_ids.get(item)
 
     def remove_item(self, category, subcategory, item):
-        if category in self.categories and subcategory in self.categories[category]:
-            if item in self.categories[category][subcategory]:
-                self.categories[category][subcategory].remove(item)
+        item_set = self.item_sets.get((category, subcategory))
+        if item_set is not None and item in item_set:
+            del item_set[item]
+            self._stale.add((category, subcategory))
+            self._forget_location(item, (category, subcategory))
+            self.version += 1
+
+    def _forget_location(self, item, key):
+        locations = self.item_locations[item]
+        locations.remove(key)
+        if not locations:
+            del self.item_locations[item]
+
+    def _forget_subcategory(self, category, subcategory):
+        key = (category, subcategory)
+        self._stale.discard(key)
+        for item in self.item_sets.pop(key, {}):
+            self._forget_location(item, key)
+
+    def has_item(self, category, subcategory, item):
+        return item in self.item_sets.get((category, subcategory), ())
+
+    def get_item_locations(self, item):
+        # 項目がある (カテゴリ, サブカテゴリ) のリスト（読み込み後に追加したものは末尾に並ぶ）
+        return list(self.item_locations.get(item, []))
+
+    def find_item(self, item):
+        # 項目がある (カテゴリ, サブカテゴリ) の1つ目。見つからなければ None
+        locations = self.item_locations.get(item)
+        return locations[0] if locations else None
 
     def get_all_items(self):
-        return [item for category in self.categories.values() 
-                for subcategory in category.values() 
-                for item in subcategory]
+        # カテゴリが変更されるまで同じリストを返すので、呼び出し側で変更しないこと
+        if self._all_items_version != self.version:
+            self._all_items = [item for category in self.categories.values()
+                               for subcategory in category.values()
+                               for item in subcategory]
+            self._all_items_version = self.version
+        return self._all_items
+
+    def search_index(self, category):
+        # 項目選択の検索に使うカテゴリごとの索引。カテゴリが変更されるまで同じものを返す
+        if self._search_indexes_version != self.version:
+            self._search_indexes = {}
+            self._search_indexes_version = self.version
+        index = self._search_indexes.get(category)
+        if index is None:
+            index = ItemSearchIndex.from_categories(self.categories.get(category, {}))
+            self._search_indexes[category] = index
+        return index
 
     def get_categories(self):
         return list(self.categories.keys())
@@ -81,8 +219,13 @@ class CategoryManager:
     
     def remove_category(self, category):
         if category in self.categories:
+            for subcategory in self.categories[category]:
+                self._forget_subcategory(category, subcategory)
             del self.categories[category]
+            self.version += 1
 
     def remove_subcategory(self, category, subcategory):
         if category in self.categories and subcategory in self.categories[category]:
-            del self.categories[category][subcategory]
\ No newline at end of file
+            self._forget_subcategory(category, subcategory)
+            del self.categories[category][subcategory]
+            self.version += 1
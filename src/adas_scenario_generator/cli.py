@@ -0,0 +1,357 @@
+import argparse
+import itertools
+import json
+import sys
+import time
+
+from .category_manager import CategoryManager, DEFAULT_CATEGORY_FILE
+from .covering_array import benchmark_covering
+from .exclusion_rules import ExclusionRulesManager
+from .instrumentation import instrumentation
+from .result_cache import ScenarioResultCache
+from .scenario_diff import ScenarioDiff, ScenarioSnapshot
+from .scenario_generator import ScenarioGenerator
+from .scenario_writer import WRITER_FORMATS, open_writer
+
+# tkinter を読み込まずにシナリオ生成を行うコマンドラインインターフェース
+
+SCENARIO_CATEGORIES = ("環境状況", "車両状況")
+
+def parse_selection(categories, selections):
+    # 選択指定は「カテゴリ」「カテゴリ/サブカテゴリ」「カテゴリ/サブカテゴリ=項目1,項目2」のいずれか。
+    # 指定がない場合はすべての項目を選択する
+    selected = {category: {} for category in SCENARIO_CATEGORIES}
+    if not selections:
+        for category in SCENARIO_CATEGORIES:
+            for subcategory, items in categories.get(category, {}).items():
+                selected[category][subcategory] = list(items)
+        return selected
+
+    for selection in selections:
+        path, _, item_text = selection.partition("=")
+        category, _, subcategory = path.partition("/")
+        if category not in categories:
+            raise ValueError(f"カテゴリが見つかりません: {category}")
+        subcategories = [subcategory] if subcategory else list(categories[category])
+        for name in subcategories:
+            if name not in categories[category]:
+                raise ValueError(f"サブカテゴリが見つかりません: {category}/{name}")
+            items = categories[category][name]
+            if item_text:
+                requested = [item.strip() for item in item_text.split(",") if item.strip()]
+                unknown = [item for item in requested if item not in items]
+                if unknown:
+                    raise ValueError(f"項目が見つかりません: {category}/{name}: {', '.join(unknown)}")
+                # 定義ファイルの順序を保つ
+                chosen = [item for item in items if item in requested]
+            else:
+                chosen = list(items)
+            current = selected.setdefault(category, {}).setdefault(name, [])
+            current.extend(item for item in chosen if item not in current)
+    return selected
+
+
+def selected_columns(selected):
+    return [(category, subcategory)
+            for category in SCENARIO_CATEGORIES
+            for subcategory in selected[category]
+            if selected[category][subcategory]]
+
+
+def build_generator(args):
+    category_manager = CategoryManager.from_file(args.categories)
+    exclusion_rules_manager = ExclusionRulesManager(category_manager)
+    if args.rules:
+        exclusion_rules_manager.load_rules_from(args.rules)
+    result_cache = ScenarioResultCache(args.cache_dir) if getattr(args, "cache_dir", None) else None
+    scenario_generator = ScenarioGenerator(category_manager, exclusion_rules_manager, result_cache)
+    selected = parse_selection(category_manager.categories, args.select)
+    return scenario_generator, selected
+
+
+def iter_rows(scenario_generator, selected, include_excluded, workers=1, backend="python"):
+    if not include_excluded:
+        if backend == "numpy":
+            engine = scenario_generator.numpy_engine(selected)
+            for _, codes, _ in engine.iter_blocks():
+                yield from engine.decode(codes)
+            return
+        for scenario in scenario_generator.iter_filtered(selected, workers):
+            yield scenario["環境状況"] + scenario["車両状況"]
+        return
+
+    compiled = scenario_generator.exclusion_rules_manager.compile()
+    for scenario in scenario_generator.iter_scenarios(selected):
+        items = scenario["環境状況"] + scenario["車両状況"]
+        yield items + (", ".join(compiled.matching_rules(items)),)
+
+
+def check_generate_options(args):
+    # 組み合わせて使えないオプションは、黙って無視せずにエラーにする
+    if args.workers < 1:
+        raise ValueError("--workers には1以上を指定してください。")
+    python_only = []  # Python 実装の有効なシナリオの生成でだけ使えるオプション
+    if args.workers > 1:
+        python_only.append("--workers")
+    if args.cache_dir:
+        python_only.append("--cache-dir")
+    if args.include_excluded:
+        if args.backend == "numpy":
+            python_only.append("--backend numpy")
+        if python_only:
+            raise ValueError(f"--include-excluded と {', '.join(python_only)} は同時に指定できません。")
+    if args.backend == "numpy" and python_only:
+        raise ValueError(f"--backend numpy と {', '.join(python_only)} は同時に指定できません。")
+
+
+def uses_batches(args):
+    # 1プロセスの Python 実装で有効なシナリオだけを出力する場合は ScenarioBatch 単位で出力する
+    return (not args.include_excluded and args.backend == "python" and args.workers == 1
+            and not args.cache_dir)
+
+
+def run_generate(args):
+    check_generate_options(args)
+    scenario_generator, selected = build_generator(args)
+    columns = selected_columns(selected)
+    if args.include_excluded:
+        columns.append(("除外理由", None))
+
+    start_time = time.perf_counter()
+    written = 0
+    writer = open_writer(args.out, columns, args.format)
+    try:
+        if uses_batches(args):
+            # 項目IDの列（ScenarioBatch）のまま書き出す
+            for batch in scenario_generator.iter_batches(selected, args.batch_size):
+                writer.write_batch(batch)
+                written += len(batch)
+        else:
+            rows = iter_rows(scenario_generator, selected, args.include_excluded, args.workers, args.backend)
+            while True:
+                batch = list(itertools.islice(rows, args.batch_size))
+                if not batch:
+                    break
+                writer.write_rows(batch)
+                written += len(batch)
+    finally:
+        writer.close()
+
+    elapsed = time.perf_counter() - start_time
+    print(f"{written} 件のシナリオを '{args.out}' に出力しました。({elapsed:.2f} 秒)", file=sys.stderr)
+    return 0
+
+
+def run_count(args):
+    scenario_generator, selected = build_generator(args)
+    counts = scenario_generator.count_scenarios(selected, per_rule=args.per_rule)
+    json.dump(counts, sys.stdout, ensure_ascii=False, indent=2)
+    print()
+    return 0
+
+
+def run_cover(args):
+    scenario_generator, selected = build_generator(args)
+    if args.benchmark:
+        results = benchmark_covering(scenario_generator, selected, range(1, args.strength + 1), args.seed)
+        json.dump(results, sys.stdout, ensure_ascii=False, indent=2)
+        print()
+        return 0
+
+    if not args.out:
+        raise ValueError("--out を指定してください。")
+    start_time = time.perf_counter()
+    scenarios = scenario_generator.generate_covering_scenarios(selected, args.strength, args.seed)
+    writer = open_writer(args.out, selected_columns(selected), args.format)
+    try:
+        writer.write_rows(scenario["環境状況"] + scenario["車両状況"] for scenario in scenarios)
+    finally:
+        writer.close()
+
+    elapsed = time.perf_counter() - start_time
+    print(f"{len(scenarios)} 件のシナリオ（{args.strength}-wise）を '{args.out}' に出力しました。({elapsed:.2f} 秒)",
+          file=sys.stderr)
+    return 0
+
+
+def run_analyze(args):
+    scenario_generator, _ = build_generator(args)
+    exclusion_rules_manager = scenario_generator.exclusion_rules_manager
+    report = exclusion_rules_manager.analyze_rules()
+    json.dump(report, sys.stdout, ensure_ascii=False, indent=2)
+    print()
+    if args.minimized_out:
+        exclusion_rules_manager.minimize_rules()
+        exclusion_rules_manager.save_rules_to(args.minimized_out)
+        print(f"{len(report['minimized_rules'])} 件のルールを '{args.minimized_out}' に出力しました。"
+              f"（{report['rule_count'] - len(report['minimized_rules'])} 件削除）", file=sys.stderr)
+    return 0
+
+
+def run_diff(args):
+    # --old-categories / --old-rules の版から --categories / --rules の版への変更を求める
+    snapshots = []
+    for category_file, rule_file in ((args.old_categories or args.categories, args.old_rules),
+                                     (args.categories, args.rules)):
+        category_manager = CategoryManager.from_file(category_file)
+        exclusion_rules_manager = ExclusionRulesManager(category_manager)
+        if rule_file:
+            exclusion_rules_manager.load_rules_from(rule_file)
+        selected = parse_selection(category_manager.categories, args.select)
+        snapshots.append(ScenarioSnapshot(category_manager, exclusion_rules_manager, selected))
+    diff = ScenarioDiff(*snapshots)
+    json.dump(diff.summary(), sys.stdout, ensure_ascii=False, indent=2)
+    print()
+    if not args.out:
+        return 0
+
+    written = 0
+    writer = open_writer(args.out, [("変更", None)] + diff.slots, args.format)
+    try:
+        rows = ((kind,) + tuple("" if item is None else item for item in items)
+                for kind, items in diff.iter_changes())
+        while True:
+            batch = list(itertools.islice(rows, args.batch_size))
+            if not batch:
+                break
+            writer.write_rows(batch)
+            written += len(batch)
+    finally:
+        writer.close()
+    print(f"{written} 件の変更されたシナリオを '{args.out}' に出力しました。", file=sys.stderr)
+    return 0
+
+
+def run_benchmark(args):
+    # 測定用のモジュール（subprocess / tracemalloc など）は他のコマンドの起動を遅くしないよう、ここで読み込む
+    from .benchmark import DEFAULT_RULE_COUNTS, DEFAULT_SCALES, ScenarioBenchmark, compare_results
+
+    benchmark = ScenarioBenchmark(args.categories, args.scales or DEFAULT_SCALES,
+                                  args.rule_counts or DEFAULT_RULE_COUNTS, args.seed, args.samples,
+                                  trace_memory=not args.no_memory, gui=not args.no_gui,
+                                  log=lambda message: print(message, file=sys.stderr))
+    results = benchmark.run()
+    with open(args.out, "w", encoding="utf-8") as file:
+        json.dump(results, file, ensure_ascii=False, indent=2)
+    print(f"ベンチマーク結果を '{args.out}' に出力しました。", file=sys.stderr)
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as file:
+            baseline = json.load(file)
+        regressions = compare_results(baseline, results, args.tolerance)
+        json.dump(regressions, sys.stdout, ensure_ascii=False, indent=2)
+        print()
+        if regressions:
+            print(f"{len(regressions)} 件の性能低下があります（基準: {baseline['meta'].get('commit')}）。",
+                  file=sys.stderr)
+            return 1
+    return 0
+
+
+def add_instrument_arguments(parser):
+    parser.add_argument("--instrument", nargs="?", const="-", metavar="FILE",
+                        help="段階ごとの時間・件数・ルールごとの評価回数を計測し、JSON で出力する（FILE 省略時は標準エラー出力）")
+    parser.add_argument("--profile", action="store_true", help="cProfile の結果を計測レポートに含める")
+    parser.add_argument("--trace-memory", action="store_true", help="tracemalloc の結果を計測レポートに含める")
+
+
+def add_common_arguments(parser):
+    add_instrument_arguments(parser)
+    parser.add_argument("--categories", default=DEFAULT_CATEGORY_FILE, help="カテゴリ定義ファイル (JSON)")
+    parser.add_argument("--rules", help="除外ルールファイル (JSON)")
+    parser.add_argument("--select", action="append", default=[],
+                        help="選択する項目。例: 環境状況/場所=市街地,高速道路 （複数指定可、省略時はすべて）")
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="adas_scenario_generator",
+                                     description="ADAS Scenario Generator")
+    subparsers = parser.add_subparsers(dest="command")
+
+    generate_parser = subparsers.add_parser("generate", help="シナリオを生成してファイルに出力する")
+    add_common_arguments(generate_parser)
+    generate_parser.add_argument("--out", required=True, help="出力ファイル")
+    generate_parser.add_argument("--format", choices=WRITER_FORMATS, help="出力形式（省略時は拡張子から判定）")
+    generate_parser.add_argument("--include-excluded", action="store_true",
+                                 help="除外されたシナリオも除外理由付きで出力する")
+    generate_parser.add_argument("--workers", type=int, default=1,
+                                 help="並列に生成するプロセス数（--include-excluded / --backend numpy とは併用できない）")
+    generate_parser.add_argument("--backend", choices=("python", "numpy"), default="python",
+                                 help="生成と除外判定に使う実装（numpy は NumPy が必要、--include-excluded とは併用できない）")
+    generate_parser.add_argument("--cache-dir",
+                                 help="生成結果をキャッシュするディレクトリ（同じ選択・ルールの再実行を高速化する。"
+                                      "--include-excluded / --backend numpy とは併用できない）")
+    generate_parser.add_argument("--batch-size", type=int, default=10000, help=argparse.SUPPRESS)
+    generate_parser.set_defaults(handler=run_generate)
+
+    count_parser = subparsers.add_parser("count", help="シナリオ数（指定時はルールごとの除外数も）を表示する")
+    add_common_arguments(count_parser)
+    count_parser.add_argument("--per-rule", action="store_true", help="ルールごとの除外数も数える（ルール数が多いと時間がかかる）")
+    count_parser.set_defaults(handler=run_count)
+
+    cover_parser = subparsers.add_parser("cover", help="t-wise 被覆配列（既定はペアワイズ）を生成する")
+    add_common_arguments(cover_parser)
+    cover_parser.add_argument("--out", help="出力ファイル")
+    cover_parser.add_argument("--format", choices=WRITER_FORMATS, help="出力形式（省略時は拡張子から判定）")
+    cover_parser.add_argument("--strength", type=int, default=2, help="被覆強度 t")
+    cover_parser.add_argument("--seed", type=int, help="乱数シード")
+    cover_parser.add_argument("--benchmark", action="store_true",
+                              help="強度 1..t の件数と生成時間を全組み合わせと比較して表示する")
+    cover_parser.set_defaults(handler=run_cover)
+
+    analyze_parser = subparsers.add_parser("analyze-rules",
+                                           help="重複・包含・成立しないルールと到達できない項目を表示する")
+    add_common_arguments(analyze_parser)
+    analyze_parser.add_argument("--minimized-out", help="不要なルールを取り除いたルールファイルの出力先")
+    analyze_parser.set_defaults(handler=run_analyze)
+
+    diff_parser = subparsers.add_parser("diff", help="2つの版のカテゴリ・ルールの間で変化したシナリオを表示する")
+    add_common_arguments(diff_parser)
+    diff_parser.add_argument("--old-categories", help="変更前のカテゴリ定義ファイル（省略時は --categories と同じ）")
+    diff_parser.add_argument("--old-rules", help="変更前の除外ルールファイル")
+    diff_parser.add_argument("--out", help="変化したシナリオの出力先（変更の種類の列付き）")
+    diff_parser.add_argument("--format", choices=WRITER_FORMATS, help="出力形式（省略時は拡張子から判定）")
+    diff_parser.add_argument("--batch-size", type=int, default=10000, help=argparse.SUPPRESS)
+    diff_parser.set_defaults(handler=run_diff)
+
+    benchmark_parser = subparsers.add_parser("benchmark", help="生成・フィルタ・表示の性能を測定して JSON に保存する")
+    add_instrument_arguments(benchmark_parser)
+    benchmark_parser.add_argument("--categories", default=DEFAULT_CATEGORY_FILE,
+                                  help="合成データの元にするカテゴリ定義ファイル (JSON)")
+    benchmark_parser.add_argument("--out", required=True, help="結果の出力先 (JSON)")
+    benchmark_parser.add_argument("--scales", type=float, nargs="+",
+                                  help="サブカテゴリごとの項目数の倍率（既定: 0.25 0.5 1.0）")
+    benchmark_parser.add_argument("--rule-counts", type=int, nargs="+",
+                                  help="合成ルールの件数（既定: 10 100 1000 10000）")
+    benchmark_parser.add_argument("--seed", type=int, default=0, help="乱数シード")
+    benchmark_parser.add_argument("--samples", type=int, default=2000, help="遅延を測定する除外判定の回数")
+    benchmark_parser.add_argument("--no-memory", action="store_true", help="ピークメモリを測定しない")
+    benchmark_parser.add_argument("--no-gui", action="store_true", help="Treeview への表示を測定しない（画面のない環境では xvfb-run -a で実行すると測定できる）")
+    benchmark_parser.add_argument("--compare", help="比較する過去の結果 (JSON)。性能低下があれば終了コード 1")
+    benchmark_parser.add_argument("--tolerance", type=float, default=0.1, help="性能低下とみなす変化の割合")
+    benchmark_parser.set_defaults(handler=run_benchmark)
+
+    return parser
+
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if args.command is None:
+        # サブコマンドなしの場合は従来通りGUIを起動する
+        from .main import main as gui_main
+        gui_main()
+        return 0
+
+    if args.instrument or args.profile or args.trace_memory:
+        instrumentation.configure(True, args.profile, args.trace_memory, args.instrument or instrumentation.output)
+
+    try:
+        with instrumentation.capture(), instrumentation.stage(f"command_{args.command}"):
+            return args.handler(args)
+    except (OSError, ValueError, RuntimeError) as e:
+        print(f"エラー: {e}", file=sys.stderr)
+        return 1
+    finally:
+        if instrumentation.enabled:
+            instrumentation.write_report()
@@ -0,0 +1,158 @@
+import itertools
+import random
+import time
+
+class CoveringArrayBuilder:
+    # IPOG方式でt-wise（既定はペアワイズ）の被覆配列を構築する。
+    # 各行はサブカテゴリごとの項目位置のリストで、None は未決定（don't care）を表す。
+    # 除外ルールに該当する組み合わせや、有効なシナリオに補完できない組み合わせは被覆対象にしない
+    def __init__(self, scenario_generator, item_lists, strength=2, seed=None):
+        compiled = scenario_generator._compiled_rules(item_lists)
+        self.item_lists = item_lists
+        self.sizes = [len(items) for items in item_lists]
+        self.strength = strength
+        self.rng = random.Random(seed)
+
+        available_mask = 0
+        for items in item_lists:
+            available_mask |= compiled.items_mask(items)
+        self.bits = [[compiled.item_bit(item) for item in items] for items in item_lists]
+        self.checks = [[compiled.rule_masks_for(item, available_mask) for item in items] for items in item_lists]
+        self._completions = {}
+
+    def _complete(self, row):
+        # 未決定の位置を埋めて有効な行を1つ求める。見つからない場合は None
+        key = tuple(row)
+        if key in self._completions:
+            return self._completions[key]
+
+        result = None
+        depth = len(row)
+        positions = [0] * depth
+        candidates = [[row[p]] if row[p] is not None else range(self.sizes[p]) for p in range(depth)]
+        stack = [iter(candidates[0])] if depth else []
+        masks = [0]
+        if not depth:
+            result = ()
+        while stack:
+            level = len(stack) - 1
+            for position in stack[-1]:
+                mask = masks[-1] | self.bits[level][position]
+                if any(rule_mask & mask == rule_mask for rule_mask in self.checks[level][position]):
+                    continue
+                positions[level] = position
+                if level + 1 == depth:
+                    result = tuple(positions)
+                    stack = []
+                else:
+                    masks.append(mask)
+                    stack.append(iter(candidates[level + 1]))
+                break
+            else:
+                stack.pop()
+                masks.pop()
+
+        self._completions[key] = result
+        return result
+
+    def _is_feasible(self, row):
+        return self._complete(row) is not None
+
+    def _partial(self, assignments):
+        row = [None] * len(self.sizes)
+        for parameter, position in assignments:
+            row[parameter] = position
+        return row
+
+    def _covered_by(self, row, parameter, combinations):
+        value = row[parameter]
+        if value is None:
+            return
+        for parameters in combinations:
+            values = tuple(row[p] for p in parameters)
+            if None not in values:
+                yield (parameters, values, value)
+
+    def build(self):
+        parameter_count = len(self.sizes)
+        if parameter_count == 0:
+            return [()]
+        strength = max(1, min(self.strength, parameter_count))
+
+        rows = []
+        for values in itertools.product(*(range(size) for size in self.sizes[:strength])):
+            row = list(values) + [None] * (parameter_count - strength)
+            if self._is_feasible(row):
+                rows.append(row)
+
+        for parameter in range(strength, parameter_count):
+            combinations = list(itertools.combinations(range(parameter), strength - 1))
+            uncovered = set()
+            for parameters in combinations:
+                for values in itertools.product(*(range(self.sizes[p]) for p in parameters)):
+                    for value in range(self.sizes[parameter]):
+                        row = self._partial(list(zip(parameters, values)) + [(parameter, value)])
+                        if self._is_feasible(row):
+                            uncovered.add((parameters, values, value))
+
+            # 水平方向の拡張：既存の各行に、未被覆の組を最も多く覆う値を追加する
+            for row in rows:
+                candidates = list(range(self.sizes[parameter]))
+                self.rng.shuffle(candidates)
+                best_value = None
+                best_gain = -1
+                for value in candidates:
+                    row[parameter] = value
+                    if not self._is_feasible(row):
+                        continue
+                    gain = sum(1 for covered in self._covered_by(row, parameter, combinations)
+                               if covered in uncovered)
+                    if gain > best_gain:
+                        best_value = value
+                        best_gain = gain
+                row[parameter] = best_value if best_gain > 0 else None
+                uncovered.difference_update(self._covered_by(row, parameter, combinations))
+
+            # 垂直方向の拡張：残った組を未決定の位置に当てはめるか、新しい行を追加する
+            for parameters, values, value in sorted(uncovered):
+                if (parameters, values, value) not in uncovered:
+                    continue
+                assignments = list(zip(parameters, values)) + [(parameter, value)]
+                for row in rows:
+                    if any(row[p] is not None and row[p] != v for p, v in assignments):
+                        continue
+                    candidate = list(row)
+                    for p, v in assignments:
+                        candidate[p] = v
+                    if self._is_feasible(candidate):
+                        row[:] = candidate
+                        break
+                else:
+                    row = self._partial(assignments)
+                    rows.append(row)
+                uncovered.difference_update(self._covered_by(row, parameter, combinations))
+
+        return [self._complete(row) for row in rows]
+
+    def build_combinations(self):
+        return [tuple(items[position] for items, position in zip(self.item_lists, row))
+                for row in self.build()]
+
+
+def benchmark_covering(scenario_generator, selected, strengths=(2, 3), seed=None):
+    # 被覆配列の件数と生成時間を、全組み合わせの件数と比較する
+    counts = scenario_generator.count_scenarios(selected, per_rule=False)
+    results = []
+    for strength in strengths:
+        start_time = time.perf_counter()
+        scenarios = scenario_generator.generate_covering_scenarios(selected, strength, seed)
+        elapsed = time.perf_counter() - start_time
+        results.append({
+            "strength": strength,
+            "scenarios": len(scenarios),
+            "seconds": elapsed,
+            "product_total": counts["total"],
+            "product_valid": counts["valid"],
+            "reduction": len(scenarios) / counts["valid"] if counts["valid"] else 0.0
+        })
+    return results
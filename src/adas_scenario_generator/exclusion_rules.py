@@ -1,22 +1,276 @@
 import json
 import codecs
-from tkinter import filedialog, messagebox
+import time
+from .instrumentation import instrumentation
+from .rule_compiler import (RuleCompiler, parse_expression, validate_expression, format_expression,
+                            expression_items, needs_categories)
+
+SUPPORTED_RULE_FILE_VERSIONS = ("1.0", "2.0")
+
+class CompiledRules:
+    # ルールを項目の AND 節（ビットマスク）の集合として保持する。
+    # expansions を渡した場合、各ルールはその AND 節のいずれかが成立すると除外になる。
+    # absent_items は NOT の展開で使う仮の項目（rule_compiler.absent_item）-> そのサブカテゴリの項目のリストで、
+    # 仮の項目はシナリオがそのサブカテゴリの項目を1つも含まないときに含まれているものとして扱う
+    def __init__(self, rules, expansions=None, absent_items=None):
+        self.rules = list(rules)
+        if expansions is None:
+            expansions = [[rule.split(" * ")] for rule in self.rules]
+        self.item_ids = {}
+        self.conjunctions = []  # 「項目1 * 項目2」形式の AND 節
+        self.rule_masks = []  # AND 節ごとのビットマスク
+        self.conjunction_rules = []  # AND 節ごとの元のルールの位置
+        self.clauses_by_rule = []  # ルールごとの AND 節の位置のリスト
+        self.rules_by_item = {}
+
+        # 項目を整数IDに変換し、各 AND 節をビットマスクとして保持する
+        # （ルール数が多いファイルの読み込みで使われるので、属性の参照はループの外で済ませる）
+        item_ids = self.item_ids
+        rules_by_item = self.rules_by_item
+        rule_masks = self.rule_masks
+        for rule_index, conjunctions in enumerate(expansions):
+            clauses = []
+            self.clauses_by_rule.append(clauses)
+            for items in conjunctions:
+                index = len(rule_masks)
+                clauses.append(index)
+                mask = 0
+                for item in items:
+                    item_id = item_ids.get(item)
+                    if item_id is None:
+                        item_id = item_ids[item] = len(item_ids)
+                        rules_by_item[item_id] = []
+                    bit = 1 << item_id
+                    if not mask & bit:
+                        rules_by_item[item_id].append(index)
+                        mask |= bit
+                self.conjunctions.append(" * ".join(items))
+                rule_masks.append(mask)
+                self.conjunction_rules.append(rule_index)
+
+        self.absent_items = {}
+        self.absent_masks = []  # (仮の項目, そのサブカテゴリの項目のマスク)
+        for absent, items in (absent_items or {}).items():
+            if absent not in item_ids:
+                continue
+            self.absent_items[absent] = set(items)
+            for item in items:
+                if item not in item_ids:
+                    item_ids[item] = len(item_ids)
+                    rules_by_item[item_ids[item]] = []
+            self.absent_masks.append((absent, self.items_mask(items)))
+        self._restricted_key = None
+        self._restricted = None
+
+    def masks_for_rule(self, rule_index):
+        return [self.rule_masks[index] for index in self.clauses_by_rule[rule_index]]
+
+    def item_bit(self, item):
+        item_id = self.item_ids.get(item)
+        return 0 if item_id is None else 1 << item_id
+
+    def items_mask(self, items):
+        mask = 0
+        for item in items:
+            mask |= self.item_bit(item)
+        return mask
+
+    def with_absent_items(self, items):
+        # シナリオの項目に、項目を1つも含まないサブカテゴリの仮の項目を加え、そのマスクとともに返す
+        mask = self.items_mask(items)
+        if not self.absent_masks:
+            return items, mask
+        absent = [item for item, subcategory_mask in self.absent_masks if not mask & subcategory_mask]
+        return tuple(items) + tuple(absent), mask | self.items_mask(absent)
+
+    def for_item_lists(self, item_lists):
+        # 選択（サブカテゴリごとの項目のリスト）に合わせて仮の項目を定数として畳み込み、
+        # 通常の項目だけからなるルールを返す。生成・計数の各処理はこちらを使う。
+        # サブカテゴリの項目だけからなるリストがなければ、そのサブカテゴリは選択されていない
+        if not self.absent_items:
+            return self
+        absent = frozenset(item for item, items in self.absent_items.items()
+                           if not any(set(slot_items) <= items for slot_items in item_lists))
+        first = tuple(item_lists[0]) if item_lists else ()
+        key = self._restricted_key
+        if key is None or key[0] != absent or key[1] not in (None, first):
+            uses_first = False
+            expansions = []
+            for clauses in self.clauses_by_rule:
+                conjunctions = []
+                for index in clauses:
+                    items = self.conjunctions[index].split(" * ")
+                    if any(item in self.absent_items and item not in absent for item in items):
+                        continue
+                    items = [item for item in items if item not in absent]
+                    if items:
+                        conjunctions.append(items)
+                    else:
+                        # 項目のない節はすべての組み合わせで成立するので、先頭のサブカテゴリの
+                        # 各項目だけからなる節に置き換える（どの組み合わせもいずれかを含む）
+                        conjunctions.extend([item] for item in first)
+                        uses_first = True
+                expansions.append(conjunctions)
+            self._restricted = CompiledRules(self.rules, expansions)
+            self._restricted_key = (absent, first if uses_first else None)
+        return self._restricted
+
+    def rule_masks_for(self, item, available_mask=-1):
+        # available_mask に含まれない項目を持つルールは成立し得ないので除外する
+        item_id = self.item_ids.get(item)
+        if item_id is None:
+            return []
+        return [
+            self.rule_masks[index] for index in self.rules_by_item[item_id]
+            if self.rule_masks[index] & available_mask == self.rule_masks[index]
+        ]
+
+    def matching_rule_indices(self, items):
+        items, mask = self.with_absent_items(items)
+        candidates = set()
+        for item in items:
+            item_id = self.item_ids.get(item)
+            if item_id is not None:
+                candidates.update(self.rules_by_item[item_id])
+        return sorted({self.conjunction_rules[index] for index in candidates
+                       if self.rule_masks[index] & mask == self.rule_masks[index]})
+
+    def is_excluded(self, items):
+        items, mask = self.with_absent_items(items)
+        for item in items:
+            item_id = self.item_ids.get(item)
+            if item_id is None:
+                continue
+            for index in self.rules_by_item[item_id]:
+                if self.rule_masks[index] & mask == self.rule_masks[index]:
+                    return True
+        return False
+
+    def matching_rules(self, items):
+        return [self.rules[index] for index in self.matching_rule_indices(items)]
+
 
 class ExclusionRulesManager:
-    def __init__(self):
+    def __init__(self, category_manager=None):
         self.rules = []
         self.rule_descriptions = {}  # 新しく追加：ルールの説明を保持する辞書
+        self.rule_expressions = {}  # パターンルールの表示名 -> ルール式
+        self.category_manager = category_manager  # NOT やサブカテゴリ指定の展開に使う
+        self.version = 0  # ルールが変更されるたびに増加する
+        self._compiled = None
+        self._compiled_key = None
+        self.listeners = []  # ルール変更時に (イベント, ルール) で呼び出される
+
+    @classmethod
+    def from_file(cls, file_path, category_manager=None):
+        manager = cls(category_manager)
+        manager.load_rules_from(file_path)
+        return manager
+
+    def add_listener(self, callback):
+        if callback not in self.listeners:
+            self.listeners.append(callback)
+
+    def remove_listener(self, callback):
+        if callback in self.listeners:
+            self.listeners.remove(callback)
+
+    def _notify(self, event, rule=None):
+        # イベントは "added"（追加）、"removed"（削除）、"reset"（ファイルからの読み込み）
+        for callback in list(self.listeners):
+            callback(event, rule)
+
+    def _categories_key(self):
+        # カテゴリ情報に依存するパターンルールがある場合だけ、カテゴリの内容をキーに含める
+        if self.category_manager is None:
+            return None
+        if not any(needs_categories(expression) for expression in self.rule_expressions.values()):
+            return None
+        return id(self.category_manager), self.category_manager.version
+
+    def rule_compiler(self):
+        categories = self.category_manager.categories if self.category_manager is not None else None
+        return RuleCompiler(categories)
+
+    def expand_rule(self, rule, compiler=None):
+        # ルールを項目の AND 節のリストに展開する。従来の「項目1 * 項目2」形式はそのまま1節になる
+        expression = self.rule_expressions.get(rule)
+        if expression is None:
+            return [tuple(rule.split(" * "))]
+        return (compiler or self.rule_compiler()).compile(expression)
+
+    def compile(self):
+        # ルールが変更されるまではコンパイル結果を再利用する
+        key = (self.version, id(self.rules), len(self.rules), self._categories_key())
+        if self._compiled is None or self._compiled_key != key:
+            with instrumentation.stage("rules_compile"):
+                if self.rule_expressions:
+                    compiler = self.rule_compiler()
+                    expansions = [self.expand_rule(rule, compiler) for rule in self.rules]
+                    absent_items = {absent: compiler.subcategory_items[key]
+                                    for absent, key in compiler.absent_items.items()}
+                    self._compiled = CompiledRules(self.rules, expansions, absent_items)
+                else:
+                    self._compiled = CompiledRules(self.rules)
+            self._compiled_key = key
+        return self._compiled
 
     def add_rule(self, item1, item2, description=""):
         rule = f"{item1} * {item2}"
         if rule not in self.rules:
             self.rules.append(rule)
             self.rule_descriptions[rule] = description  # 説明を保存
+            self.version += 1
+            self._notify("added", rule)
+
+    def add_pattern_rule(self, expression, description=""):
+        # ルール式（テキストまたは辞書）を追加し、その表示名を返す。
+        # 例: "高速道路 AND (停止 OR 駐車)"、"速度 = 高速 AND 場所 ∈ {駐車場, 市街地}"
+        if isinstance(expression, str):
+            expression = parse_expression(expression)
+        validate_expression(expression)
+        if "item" in expression and not expression.get("subcategory"):
+            raise ValueError("ルールには2つ以上の条件が必要です。")
+        rule = self.rule_name(expression)
+        if self.rule_expressions.get(rule, expression) != expression:
+            raise ValueError(f"同じ表示名の別のルールが既に存在します: {rule}")
+        if rule not in self.rules:
+            self.rule_compiler().compile(expression)  # 展開できないルールはここで例外になる
+            if rule not in self.rule_expressions and not self.is_simple_expression(expression):
+                self.rule_expressions[rule] = expression
+            self.rules.append(rule)
+            self.rule_descriptions[rule] = description
+            self.version += 1
+            self._notify("added", rule)
+        return rule
+
+    def is_simple_expression(self, expression):
+        # 項目の AND だけからなる式は、従来の「項目1 * 項目2」形式で保持する
+        return "and" in expression and all(set(child) == {"item"} for child in expression["and"])
+
+    def rule_name(self, expression):
+        if self.is_simple_expression(expression):
+            return " * ".join(child["item"] for child in expression["and"])
+        return format_expression(expression)
+
+    def get_rule_expression(self, rule):
+        expression = self.rule_expressions.get(rule)
+        if expression is None:
+            return {"and": [{"item": item} for item in rule.split(" * ")]}
+        return expression
+
+    def get_rule_items(self, rule):
+        # ルールが参照している項目の集合
+        return expression_items(self.get_rule_expression(rule))
 
     def remove_rule(self, rule):
         if rule in self.rules:
             self.rules.remove(rule)
             self.rule_descriptions.pop(rule, None)  # 説明も削除
+            if rule not in self.rules:
+                self.rule_expressions.pop(rule, None)
+            self.version += 1
+            self._notify("removed", rule)
 
     def get_rules(self):
         return self.rules
@@ -24,62 +278,167 @@ class ExclusionRulesManager:
     def get_rule_description(self, rule):
         return self.rule_descriptions.get(rule, "")  # ルールの説明を取得
 
+    def analyze_rules(self, category_manager=None):
+        # 重複・包含・成立しないルールと、到達できない項目を調べる（rule_analysis.RuleSetAnalyzer を参照）
+        from .rule_analysis import RuleSetAnalyzer
+
+        return RuleSetAnalyzer(self, category_manager).analyze()
+
+    def minimize_rules(self, category_manager=None):
+        # 分析結果の最小化されたルール集合に置き換え、取り除いたルールの数を返す
+        minimized = self.analyze_rules(category_manager)["minimized_rules"]
+        removed = len(self.rules) - len(minimized)
+        if removed:
+            kept = set(minimized)
+            self.rules = list(minimized)
+            self.rule_descriptions = {rule: description for rule, description in self.rule_descriptions.items()
+                                      if rule in kept}
+            self.rule_expressions = {rule: expression for rule, expression in self.rule_expressions.items()
+                                     if rule in kept}
+            self.version += 1
+            self._notify("reset")
+        return removed
+
     def is_excluded(self, scenario):
         scenario_items = scenario["環境状況"] + scenario["車両状況"]
-        for rule in self.rules:
-            items = rule.split(" * ")
-            if all(item in scenario_items for item in items):
-                return True
-        return False
+        if instrumentation.enabled:
+            return bool(self._matching_rules_instrumented(scenario_items, first_only=True))
+        return self.compile().is_excluded(scenario_items)
 
     def is_excluded_with_rules(self, scenario):
-        scenario_items = set(scenario.get("環境状況", []) + scenario.get("車両状況", []))
-        applied_rules = []
-        for rule in self.rules:
-            items = set(rule.split(" * "))
-            if items.issubset(scenario_items):
-                applied_rules.append(rule)
+        scenario_items = tuple(scenario.get("環境状況", ())) + tuple(scenario.get("車両状況", ()))
+        if instrumentation.enabled:
+            applied_rules = self._matching_rules_instrumented(scenario_items)
+        else:
+            applied_rules = self.compile().matching_rules(scenario_items)
         return len(applied_rules) > 0, applied_rules
 
+    def _matching_rules_instrumented(self, scenario_items, first_only=False):
+        # 計測が有効な場合の除外判定。ルールごとの評価回数・該当数・評価時間を記録する。
+        # 1つのマスクの判定は perf_counter の呼び出しより短いので、項目ごとの AND 節をまとめて判定して
+        # その時間を計り、判定した AND 節の数で按分する。複数の項目を含む AND 節も1回だけ判定して数える
+        compiled = self.compile()
+        rule_masks = compiled.rule_masks
+        scenario_items, mask = compiled.with_absent_items(scenario_items)
+        matched = set()
+        evaluated = set()
+        evaluations = 0
+        for item in scenario_items:
+            item_id = compiled.item_ids.get(item)
+            if item_id is None:
+                continue
+            indices = [index for index in compiled.rules_by_item[item_id] if index not in evaluated]
+            if not indices:
+                continue
+            evaluated.update(indices)
+            start_time = time.perf_counter()
+            hits = [rule_masks[index] & mask == rule_masks[index] for index in indices]
+            seconds = (time.perf_counter() - start_time) / len(hits)
+            if first_only and True in hits:
+                hits = hits[:hits.index(True) + 1]
+            for index, hit in zip(indices, hits):
+                rule_index = compiled.conjunction_rules[index]
+                instrumentation.record_rule(compiled.rules[rule_index], evaluations=1, hits=int(hit),
+                                            seconds=seconds)
+                if hit:
+                    matched.add(rule_index)
+            evaluations += len(hits)
+            if matched and first_only:
+                break
+        instrumentation.count("rule_evaluations", evaluations)
+        instrumentation.count("scenarios_checked")
+        if matched:
+            instrumentation.count("scenarios_excluded")
+        return [compiled.rules[rule_index] for rule_index in sorted(matched)]
+
+    def load_rules_from(self, file_path):
+        # ダイアログを使わずにルールファイルを読み込む。失敗した場合は例外を送出する
+        # バージョン 1.0 は項目の AND（"items"）のみ、2.0 ではルール式（"expression"）も使える
+        # 大きなファイルでも1回の走査でルール・説明・項目のリストをまとめて作り、
+        # パターンルールを含まない場合はそのままコンパイル済みのルール（索引）も作っておく
+        with codecs.open(file_path, 'r', 'utf-8-sig') as file:
+            data = json.load(file)
+        if not isinstance(data, dict) or not isinstance(data.get("rules"), list):
+            raise ValueError(f"'{file_path}' は除外ルールファイルの形式ではありません。")
+        if data.get("version") not in SUPPORTED_RULE_FILE_VERSIONS:
+            raise ValueError(f"サポートされていないファイルバージョンです: {data.get('version')}")
+
+        allow_expressions = data["version"] != "1.0"
+        rules = []
+        rule_descriptions = {}
+        rule_expressions = {}
+        expansions = []
+        for position, rule in enumerate(data["rules"], 1):
+            items = rule.get("items") if isinstance(rule, dict) else None
+            if allow_expressions and isinstance(rule, dict) and "expression" in rule:
+                expression = validate_expression(rule["expression"])
+                rule_str = self.rule_name(expression)
+                if self.is_simple_expression(expression):
+                    items = rule_str.split(" * ")
+                else:
+                    rule_expressions[rule_str] = expression
+            else:
+                try:
+                    rule_str = " * ".join(items) if isinstance(items, list) and items else None
+                except TypeError:
+                    rule_str = None  # 項目が文字列でない
+                if rule_str is None:
+                    raise ValueError(f"{position} 番目のルールの形式が正しくありません: {rule!r}")
+            rules.append(rule_str)
+            rule_descriptions[rule_str] = rule.get("description", "")
+            expansions.append([items])
+
+        self.rules = rules
+        self.rule_descriptions = rule_descriptions
+        self.rule_expressions = rule_expressions
+        self.version += 1
+        if not rule_expressions:
+            with instrumentation.stage("rules_compile"):
+                self._compiled = CompiledRules(rules, expansions)
+            self._compiled_key = (self.version, id(self.rules), len(self.rules), self._categories_key())
+        self._notify("reset")
+
+    def rules_data(self):
+        # 保存用の辞書。項目の AND だけのルールは 1.0 と同じ "items" で書き出す
+        rules = []
+        for i, rule in enumerate(self.rules):
+            entry = {"id": i + 1}
+            if rule in self.rule_expressions:
+                entry["expression"] = self.rule_expressions[rule]
+            else:
+                entry["items"] = rule.split(" * ")
+            entry["description"] = self.rule_descriptions.get(rule, f"Rule {i + 1}")
+            rules.append(entry)
+        return {"version": "2.0", "rules": rules}
+
+    def save_rules_to(self, file_path):
+        with codecs.open(file_path, 'w', 'utf-8') as file:
+            json.dump(self.rules_data(), file, indent=2, ensure_ascii=False)
+
     def load_rules(self):
+        from tkinter import filedialog, messagebox
+
         file_path = filedialog.askopenfilename(filetypes=[("JSON files", "*.json")])
         if file_path:
             try:
-                with codecs.open(file_path, 'r', 'utf-8-sig') as file:
-                    data = json.load(file)
-                    if data.get("version") == "1.0":
-                        self.rules = []
-                        self.rule_descriptions = {}
-                        for rule in data["rules"]:
-                            rule_str = " * ".join(rule["items"])
-                            self.rules.append(rule_str)
-                            self.rule_descriptions[rule_str] = rule["description"]
-                        messagebox.showinfo("成功", "除外ルールを読み込みました。")
-                        return True
-                    else:
-                        messagebox.showerror("エラー", f"サポートされていないファイルバージョンです: {data.get('version')}")
+                self.load_rules_from(file_path)
+                messagebox.showinfo("成功", "除外ルールを読み込みました。")
+                return True
             except json.JSONDecodeError as e:
                 messagebox.showerror("エラー", f"JSONファイルの解析に失敗しました: {str(e)}")
+            except ValueError as e:
+                messagebox.showerror("エラー", str(e))
             except Exception as e:
                 messagebox.showerror("エラー", f"ファイルの読み込み中に予期せぬエラーが発生しました: {str(e)}")
         return False
 
     def save_rules(self):
+        from tkinter import filedialog, messagebox
+
         file_path = filedialog.asksaveasfilename(defaultextension=".json", filetypes=[("JSON files", "*.json")])
         if file_path:
             try:
-                data = {
-                    "version": "1.0",
-                    "rules": [
-                        {
-                            "id": i + 1,
-                            "items": rule.split(" * "),
-                            "description": self.rule_descriptions.get(rule, f"Rule {i + 1}")
-                        } for i, rule in enumerate(self.rules)
-                    ]
-                }
-                with codecs.open(file_path, 'w', 'utf-8') as file:
-                    json.dump(data, file, indent=2, ensure_ascii=False)
+                self.save_rules_to(file_path)
                 messagebox.showinfo("成功", "除外ルールを保存しました。")
             except Exception as e:
                 messagebox.showerror("エラー", f"ファイルの保存中にエラーが発生しました: {str(e)}")
\ No newline at end of file
@@ -0,0 +1,110 @@
+import queue
+import threading
+import time
+from array import array
+from .incremental import IncrementalResultSet, MAX_INCREMENTAL_PRODUCT
+from .instrumentation import instrumentation
+
+class GenerationWorker:
+    # シナリオ生成を別スレッドで実行し、結果をキュー経由でGUIへ少しずつ渡す。
+    # 有効件数の計数は生成と並行して別スレッドで行い、生成の開始を待たせない。
+    # キューには次のメッセージが入る:
+    #   ("total", total)            直積の件数（開始直後に送る）
+    #   ("counts", counts)          件数（total / valid / excluded）。数え終わった時点で送り、計数より先に
+    #                               生成が終わった場合は生成した件数から作って送る（いずれか1回だけ）
+    #   ("batch", indices)          有効なシナリオの通し番号のリスト
+    #   ("result_set", result_set)  ルール変更の差分反映用の索引（IncrementalResultSet）。
+    #                               直積が MAX_INCREMENTAL_PRODUCT を超える場合は送らない
+    #   ("done", elapsed)           完了
+    #   ("cancelled", elapsed)      中断
+    #   ("error", message)          エラー
+    def __init__(self, scenario_generator, selected, batch_size=10000, flush_interval=0.05):
+        self.scenario_generator = scenario_generator
+        self.selected = selected
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.queue = queue.Queue()
+        self.cancel_event = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.counts_lock = threading.Lock()
+        self.counts_sent = False
+
+    def start(self):
+        self.thread.start()
+
+    def cancel(self):
+        self.cancel_event.set()
+
+    def is_running(self):
+        return self.thread.is_alive()
+
+    def run(self):
+        # cProfile はスレッドごとに記録するため、記録の開始と終了はこのスレッドで行う
+        # 完了のメッセージは記録の終了後に送り、GUI側でレポートを書き出せるようにする
+        with instrumentation.capture():
+            message = self.generate()
+        with self.counts_lock:
+            self.counts_sent = True  # 最後のメッセージの後には件数を送らない
+            self.queue.put(message)
+
+    def count_in_background(self):
+        try:
+            counts = self.scenario_generator.count_scenarios(self.selected, per_rule=False)
+        except Exception:
+            return  # 生成側で同じエラーになるか、生成した件数から件数を送る
+        self.send_counts(counts)
+
+    def send_counts(self, counts):
+        with self.counts_lock:
+            if self.counts_sent or self.cancel_event.is_set():
+                return
+            self.counts_sent = True
+            self.queue.put(("counts", counts))
+
+    def generate(self):
+        # 最後に送るメッセージ（done / cancelled / error）を返す
+        start_time = time.perf_counter()
+        try:
+            rules_version = self.scenario_generator.exclusion_rules_manager.version
+            item_lists, _ = self.scenario_generator._scenario_item_lists(self.selected)
+            total = self.scenario_generator._product_size(item_lists)
+            self.queue.put(("total", total))
+            threading.Thread(target=self.count_in_background, daemon=True).start()
+
+            # 差分更新用の索引は、GUIへ送ったのと同じ通し番号から作る（直積全体をもう一度辿らない）
+            keep_indices = total <= MAX_INCREMENTAL_PRODUCT
+            valid_indices = array('Q')
+            valid = 0
+            batch = []
+            last_flush = time.perf_counter()
+            for index in self.scenario_generator.iter_filtered_indices(self.selected):
+                if self.cancel_event.is_set():
+                    return ("cancelled", time.perf_counter() - start_time)
+                batch.append(index)
+                # 最初の結果がすぐ表示されるよう、件数だけでなく経過時間でも送信する
+                if len(batch) >= self.batch_size or (len(batch) % 500 == 0
+                                                     and time.perf_counter() - last_flush >= self.flush_interval):
+                    self.queue.put(("batch", batch))
+                    valid += len(batch)
+                    if keep_indices:
+                        valid_indices.extend(batch)
+                    batch = []
+                    last_flush = time.perf_counter()
+
+            if self.cancel_event.is_set():
+                return ("cancelled", time.perf_counter() - start_time)
+            if batch:
+                self.queue.put(("batch", batch))
+                valid += len(batch)
+                if keep_indices:
+                    valid_indices.extend(batch)
+            self.send_counts({"total": total, "valid": valid, "excluded": total - valid})
+            if keep_indices:
+                with instrumentation.stage("build_result_set"):
+                    result_set = IncrementalResultSet(self.scenario_generator, self.selected, valid_indices)
+                # 生成中にルールが変更された場合、通し番号と索引の内容が一致しないので送らない
+                if result_set.rules_version == rules_version:
+                    self.queue.put(("result_set", result_set))
+            return ("done", time.perf_counter() - start_time)
+        except Exception as e:
+            return ("error", str(e))
@@ -1,5 +1,15 @@
+import queue
+import time
 import tkinter as tk
+from array import array
 from tkinter import ttk, filedialog, messagebox, simpledialog
+from .result_view import VirtualScenarioView
+from .item_selector import VirtualItemSelector
+from .generation_worker import GenerationWorker
+from .incremental import MAX_INCREMENTAL_PRODUCT
+from .instrumentation import instrumentation
+
+LARGE_CATEGORY_ITEMS = 200  # 項目数がこれを超えるカテゴリは、チェックボックスの代わりに検索できる仮想リストで表示する
 
 class ADASScenarioGeneratorGUI:
     def __init__(self, master, category_manager, scenario_generator, exclusion_rules_manager):
@@ -12,39 +22,152 @@ class ADASScenarioGeneratorGUI:
         
         self.selected_items = {}
         self.update_selected_items()
+
+        # 実行タブの状態（タブの中身は初めて表示されたときに作る）
+        self.worker = None
+        self.result_set = None
+        self.last_selected = None
+        self.result_counts = None
+        self.valid_indices = array('Q')
         
         self.create_gui()
+        # ルールが変更されたら、直前の生成結果に差分で反映する
+        self.exclusion_rules_manager.add_listener(self.on_rules_changed)
 
     def update_selected_items(self):
-        self.selected_items = {category: {subcategory: {item: tk.BooleanVar() for item in items} 
-                               for subcategory, items in subcategories.items()} 
-                               for category, subcategories in self.category_manager.categories.items()}
+        # 選択状態はサブカテゴリごとの選択された項目名の集合で持つ（項目ごとの BooleanVar は
+        # 表示中のチェックボックスの分だけ作る）。既存の集合はそのまま使い、削除された項目だけを取り除く
+        categories = self.category_manager.categories
+        for category in [name for name in self.selected_items if name not in categories]:
+            del self.selected_items[category]
+        for category, subcategories in categories.items():
+            selection = self.selected_items.setdefault(category, {})
+            for subcategory in [name for name in selection if name not in subcategories]:
+                del selection[subcategory]
+            for subcategory, items in subcategories.items():
+                selection.setdefault(subcategory, set()).intersection_update(items)
 
     def create_gui(self):
         self.notebook = ttk.Notebook(self.master)
         self.notebook.pack(fill=tk.BOTH, expand=True)
 
-        self.create_category_tabs()
-        self.create_exclusion_tab()
-        self.create_execution_tab()
-        self.create_category_management_tab()
+        # 各タブの中身は初めて表示されたときに作る
+        self.tab_builders = {}
+        self.category_tabs = {}
+        self.category_widgets = {}
+        for category in self.category_manager.categories:
+            self.add_category_tab(category)
+        self.exclusion_frame = self.add_lazy_tab("除外ルール", self.create_exclusion_tab)
+        self.execution_frame = self.add_lazy_tab("実行", self.create_execution_tab)
+        self.management_frame = self.add_lazy_tab("カテゴリ管理", self.create_category_management_tab)
+
+        self.notebook.bind("<<NotebookTabChanged>>", self.on_tab_changed)
+        if self.notebook.select():
+            self.build_tab(self.notebook.select())
+
+    def add_lazy_tab(self, text, builder, index="end"):
+        frame = ttk.Frame(self.notebook)
+        self.notebook.insert(index, frame, text=text)
+        self.tab_builders[str(frame)] = builder
+        return frame
+
+    def on_tab_changed(self, event):
+        self.build_tab(self.notebook.select())
+
+    def build_tab(self, tab):
+        builder = self.tab_builders.pop(str(tab), None)
+        if builder is not None:
+            builder(self.notebook.nametowidget(tab))
+
+    def is_tab_built(self, frame):
+        return str(frame) not in self.tab_builders
+
+    def add_category_tab(self, category):
+        # カテゴリのタブは「除外ルール」タブの前に並べる
+        index = self.notebook.index(self.exclusion_frame) if hasattr(self, "exclusion_frame") else "end"
+        self.category_tabs[category] = self.add_lazy_tab(
+            category, lambda frame: self.create_category_tab(category, frame), index)
+
+    def remove_category_tab(self, category):
+        frame = self.category_tabs.pop(category)
+        self.tab_builders.pop(str(frame), None)
+        self.category_widgets.pop(category, None)
+        self.notebook.forget(frame)
+        frame.destroy()
+
+    def create_category_tab(self, category, frame):
+        subcategories = self.category_manager.categories[category]
+        if sum(len(items) for items in subcategories.values()) > LARGE_CATEGORY_ITEMS:
+            selector = VirtualItemSelector(frame, subcategories, self.selected_items[category],
+                                           lambda: self.category_manager.search_index(category))
+            selector.pack(fill=tk.BOTH, expand=True)
+            self.category_widgets[category] = selector
+            return
+        self.category_widgets[category] = {}
+        self.refresh_category_tab(category)
+
+    def refresh_category_tab(self, category):
+        # 表示中のチェックボックスとカテゴリの内容を比較し、追加・削除された分だけ更新する
+        widgets = self.category_widgets.get(category)
+        if widgets is None:
+            return  # まだ表示されていないタブは、表示するときに最新の内容で作られる
+        frame = self.category_tabs[category]
+        subcategories = self.category_manager.categories[category]
+        large = sum(len(items) for items in subcategories.values()) > LARGE_CATEGORY_ITEMS
+        if large != isinstance(widgets, VirtualItemSelector):
+            # 項目数が閾値をまたいだ場合は表示方法を切り替える
+            for child in frame.winfo_children():
+                child.destroy()
+            self.create_category_tab(category, frame)
+            return
+        if large:
+            widgets.set_data(subcategories, self.selected_items[category],
+                             lambda: self.category_manager.search_index(category))
+            return
 
-    def create_category_tabs(self):
-        for category, subcategories in self.category_manager.categories.items():
-            frame = ttk.Frame(self.notebook)
-            self.notebook.add(frame, text=category)
+        for subcategory in [name for name in widgets if name not in subcategories]:
+            widgets.pop(subcategory)[0].destroy()
 
-            for subcategory, items in subcategories.items():
+        previous_frame = None
+        for subcategory, items in subcategories.items():
+            if subcategory not in widgets:
                 subframe = ttk.LabelFrame(frame, text=subcategory)
-                subframe.pack(fill=tk.X, padx=5, pady=5)
+                self.pack_after(subframe, previous_frame, fill=tk.X, padx=5, pady=5)
+                widgets[subcategory] = (subframe, {})
+            subframe, checkbuttons = widgets[subcategory]
+            previous_frame = subframe
+
+            for item in [name for name in checkbuttons if name not in items]:
+                checkbuttons.pop(item)[0].destroy()
+            selection = self.selected_items[category][subcategory]
+            previous_button = None
+            for item in items:
+                if item not in checkbuttons:
+                    variable = tk.BooleanVar(value=item in selection)
+                    checkbutton = ttk.Checkbutton(subframe, text=item, variable=variable,
+                                                  command=lambda s=selection, i=item, v=variable: self.on_item_toggled(s, i, v))
+                    self.pack_after(checkbutton, previous_button, anchor=tk.W)
+                    checkbuttons[item] = (checkbutton, variable)
+                previous_button = checkbuttons[item][0]
+
+    def on_item_toggled(self, selection, item, variable):
+        if variable.get():
+            selection.add(item)
+        else:
+            selection.discard(item)
 
-                for item in items:
-                    cb = ttk.Checkbutton(subframe, text=item, variable=self.selected_items[category][subcategory][item])
-                    cb.pack(anchor=tk.W)
+    def pack_after(self, widget, previous, **options):
+        # previous の直後（previous がなければ先頭）に配置する
+        if previous is not None:
+            widget.pack(after=previous, **options)
+            return
+        siblings = [child for child in widget.master.pack_slaves() if child is not widget]
+        if siblings:
+            widget.pack(before=siblings[0], **options)
+        else:
+            widget.pack(**options)
 
-    def create_exclusion_tab(self):
-        exclusion_frame = ttk.Frame(self.notebook)
-        self.notebook.add(exclusion_frame, text="除外ルール")
+    def create_exclusion_tab(self, exclusion_frame):
 
         self.exclusion_entry1 = ttk.Combobox(exclusion_frame, values=self.get_all_items())
         self.exclusion_entry1.pack(pady=5)
@@ -57,6 +180,16 @@ class ADASScenarioGeneratorGUI:
         add_button = ttk.Button(exclusion_frame, text="除外ルール追加", command=self.add_exclusion_rule)
         add_button.pack(pady=5)
 
+        # 3項目以上や OR / NOT、サブカテゴリ指定を含むルールは式で入力する
+        # 例: 高速道路 AND (停止 OR 駐車)、速度 = 高速 AND 場所 ∈ {駐車場, 市街地}
+        pattern_frame = ttk.Frame(exclusion_frame)
+        pattern_frame.pack(pady=5)
+        ttk.Label(pattern_frame, text="ルール式:").pack(side=tk.LEFT)
+        self.pattern_entry = ttk.Entry(pattern_frame, width=50)
+        self.pattern_entry.pack(side=tk.LEFT, padx=5)
+        pattern_button = ttk.Button(pattern_frame, text="ルール式を追加", command=self.add_pattern_rule)
+        pattern_button.pack(side=tk.LEFT)
+
         # Treeviewを使用して除外ルールと理由を表示
         self.exclusion_tree = ttk.Treeview(exclusion_frame, columns=('rule', 'reason'), show='headings', height=10)
         self.exclusion_tree.heading('rule', text='除外ルール')
@@ -84,13 +217,13 @@ class ADASScenarioGeneratorGUI:
         save_button = ttk.Button(file_frame, text="ルールを保存", command=self.exclusion_rules_manager.save_rules)
         save_button.pack(side=tk.LEFT, padx=5)
 
-        self.update_exclusion_listbox()
+        analyze_button = ttk.Button(file_frame, text="ルールを分析", command=self.analyze_exclusion_rules)
+        analyze_button.pack(side=tk.LEFT, padx=5)
 
-    def create_category_management_tab(self):
-        management_frame = ttk.Frame(self.notebook)
-        self.notebook.add(management_frame, text="カテゴリ管理")
+        self.update_exclusion_listbox()
 
-        file_button = ttk.Button(management_frame, text="カテゴリファイル選択", command=self.category_manager.select_category_file)
+    def create_category_management_tab(self, management_frame):
+        file_button = ttk.Button(management_frame, text="カテゴリファイル選択", command=self.select_category_file)
         file_button.pack(pady=10)
 
         category_frame = ttk.Frame(management_frame)
@@ -148,7 +281,7 @@ class ADASScenarioGeneratorGUI:
             messagebox.showerror("エラー", "カテゴリを選択してください")
             return
         new_subcategory = simpledialog.askstring("サブカテゴリ追加", "新しいサブカテゴリ名を入力してください:")
-        if new_subcategory and new_subcategory not in self.category_manager.categories[category]:
+        if new_subcategory and new_subcategory not in self.category_manager.get_subcategories(category):
             self.category_manager.add_subcategory(category, new_subcategory)
             self.update_gui()
 
@@ -159,7 +292,7 @@ class ADASScenarioGeneratorGUI:
             messagebox.showerror("エラー", "カテゴリとサブカテゴリを選択してください")
             return
         new_item = simpledialog.askstring("項目追加", "新しい項目名を入力してください:")
-        if new_item and new_item not in self.category_manager.categories[category][subcategory]:
+        if new_item and not self.category_manager.has_item(category, subcategory, new_item):
             self.category_manager.add_item(category, subcategory, new_item)
             self.update_gui()
 
@@ -177,17 +310,55 @@ class ADASScenarioGeneratorGUI:
         self.category_manager.remove_item(category, subcategory, item)
         self.update_gui()
 
-    def update_gui(self):
-        for tab in self.notebook.tabs():
-            self.notebook.forget(tab)
+    def select_category_file(self):
+        self.category_manager.select_category_file()
+        self.update_gui()
 
+    def update_gui(self):
+        # カテゴリの変更を画面に反映する。ウィジェットは作り直さず、変更された分だけ追加・削除する
         self.update_selected_items()
-        self.create_category_tabs()
-        self.create_exclusion_tab()
-        self.create_execution_tab()
-        self.create_category_management_tab()
+
+        categories = self.category_manager.categories
+        for category in [name for name in self.category_tabs if name not in categories]:
+            self.remove_category_tab(category)
+        for category in categories:
+            if category in self.category_tabs:
+                self.refresh_category_tab(category)
+            else:
+                self.add_category_tab(category)
+
+        if self.is_tab_built(self.exclusion_frame):
+            items = self.get_all_items()
+            self.exclusion_entry1['values'] = items
+            self.exclusion_entry2['values'] = items
+        if self.is_tab_built(self.management_frame):
+            self.refresh_management_tab()
+        if self.is_tab_built(self.execution_frame):
+            self.configure_result_columns()
+
+    def refresh_management_tab(self):
+        categories = self.category_manager.categories
+        self.category_combobox['values'] = list(categories.keys())
+        category = self.category_var.get()
+        if category not in categories:
+            self.category_combobox.set('')
+            self.subcategory_combobox['values'] = []
+            self.subcategory_combobox.set('')
+            self.items_listbox.delete(0, tk.END)
+            return
+        self.subcategory_combobox['values'] = list(categories[category].keys())
+        subcategory = self.subcategory_var.get()
+        if subcategory not in categories[category]:
+            self.subcategory_combobox.set('')
+            self.items_listbox.delete(0, tk.END)
+            return
+        items = categories[category][subcategory]
+        if list(self.items_listbox.get(0, tk.END)) != items:
+            self.items_listbox.delete(0, tk.END)
+            self.items_listbox.insert(tk.END, *items)
 
     def get_all_items(self):
+        # CategoryManager がカテゴリの version ごとにキャッシュしている
         return self.category_manager.get_all_items()
 
     def add_exclusion_rule(self):
@@ -211,6 +382,26 @@ class ADASScenarioGeneratorGUI:
         else:
             messagebox.showerror("エラー", "2つの異なる項目を選択してください。")
 
+    def add_pattern_rule(self):
+        expression = self.pattern_entry.get().strip()
+        description = self.exclusion_description.get("1.0", tk.END).strip()
+        if not expression:
+            messagebox.showerror("エラー", "ルール式を入力してください。")
+            return
+        try:
+            rule_count = len(self.exclusion_rules_manager.get_rules())
+            self.exclusion_rules_manager.add_pattern_rule(expression, description)
+        except ValueError as e:
+            messagebox.showerror("エラー", str(e))
+            return
+        if len(self.exclusion_rules_manager.get_rules()) == rule_count:
+            messagebox.showwarning("重複", "このルールは既に存在します。")
+            return
+        self.update_exclusion_listbox()
+        self.pattern_entry.delete(0, tk.END)
+        self.exclusion_description.delete("1.0", tk.END)
+        messagebox.showinfo("追加成功", "新しい除外ルールが追加されました。")
+
     def remove_exclusion_rule(self):
         selection = self.exclusion_tree.selection()
         if selection:
@@ -223,6 +414,25 @@ class ADASScenarioGeneratorGUI:
         if self.exclusion_rules_manager.load_rules():
             self.update_exclusion_listbox()
 
+    def analyze_exclusion_rules(self):
+        report = self.exclusion_rules_manager.analyze_rules(self.category_manager)
+        lines = [f"ルール数: {report['rule_count']}",
+                 f"重複: {len(report['duplicates'])} 件",
+                 f"他のルールに含まれる: {len(report['subsumed'])} 件",
+                 f"存在しない項目を含む: {len(report['orphaned'])} 件",
+                 f"成立しない: {len(report['impossible'])} 件"]
+        if report["unreachable_items"]:
+            items = ", ".join(f"{entry['subcategory']}/{entry['item']}" for entry in report["unreachable_items"])
+            lines.append(f"どの有効なシナリオにも現れない項目: {items}")
+        removable = report["rule_count"] - len(report["minimized_rules"])
+        if not removable:
+            messagebox.showinfo("ルールの分析", "\n".join(lines + ["", "取り除けるルールはありません。"]))
+            return
+        lines += ["", f"{removable} 件のルールを取り除いても結果は変わりません。取り除きますか？"]
+        if messagebox.askyesno("ルールの分析", "\n".join(lines)):
+            self.exclusion_rules_manager.minimize_rules(self.category_manager)
+            self.update_exclusion_listbox()
+
     def update_exclusion_listbox(self):
         # Treeviewの内容をクリア
         for i in self.exclusion_tree.get_children():
@@ -259,62 +469,223 @@ class ADASScenarioGeneratorGUI:
         if messagebox.askyesno("確認", f"サブカテゴリ '{subcategory}' を削除してもよろしいですか？"):
             self.category_manager.remove_subcategory(category, subcategory)
             self.update_gui()
-    def create_execution_tab(self):
-        execution_frame = ttk.Frame(self.notebook)
-        self.notebook.add(execution_frame, text="実行")
-
-        self.generate_button = ttk.Button(execution_frame, text="シナリオ生成", command=self.generate_scenarios)
-        self.generate_button.pack(pady=20)
-
-        columns = tuple(list(self.category_manager.categories.keys()) + ["除外理由"])
-        self.tree = ttk.Treeview(execution_frame, columns=columns, show="headings")
+    def create_execution_tab(self, execution_frame):
+        control_frame = ttk.Frame(execution_frame)
+        control_frame.pack(pady=20)
+
+        self.generate_button = ttk.Button(control_frame, text="シナリオ生成", command=self.generate_scenarios)
+        self.generate_button.pack(side=tk.LEFT, padx=5)
+
+        self.cancel_button = ttk.Button(control_frame, text="中断", command=self.cancel_generation, state=tk.DISABLED)
+        self.cancel_button.pack(side=tk.LEFT, padx=5)
+
+        self.hide_excluded_var = tk.BooleanVar(value=False)
+        hide_excluded_check = ttk.Checkbutton(control_frame, text="除外されたシナリオを隠す",
+                                              variable=self.hide_excluded_var, command=self.update_result_rows)
+        hide_excluded_check.pack(side=tk.LEFT, padx=5)
+
+        progress_frame = ttk.Frame(execution_frame)
+        progress_frame.pack(fill=tk.X, padx=10)
+        self.progress_bar = ttk.Progressbar(progress_frame, mode="determinate")
+        self.progress_bar.pack(side=tk.LEFT, fill=tk.X, expand=True)
+        self.progress_label = ttk.Label(progress_frame, text="", width=40)
+        self.progress_label.pack(side=tk.LEFT, padx=5)
+
+        self.result_label = ttk.Label(execution_frame, text="")
+        self.result_label.pack()
+
+        self.result_view = VirtualScenarioView(execution_frame, self.result_columns(), self.get_result_row_values)
+        self.configure_result_columns()
+        self.result_view.pack(fill=tk.BOTH, expand=True, padx=10, pady=10)
+        self.tree = self.result_view.tree
+
+    def result_columns(self):
+        return tuple(list(self.category_manager.categories.keys()) + ["除外理由"])
+
+    def configure_result_columns(self):
+        columns = self.result_columns()
+        if tuple(self.result_view.tree['columns']) != columns:
+            self.result_view.set_columns(columns)
         for category in self.category_manager.categories.keys():
-            self.tree.heading(category, text=category)
-            self.tree.column(category, width=200)
-        self.tree.heading("除外理由", text="除外理由")
-        self.tree.column("除外理由", width=300)
-        self.tree.pack(fill=tk.BOTH, expand=True, padx=10, pady=10)
+            self.result_view.heading(category, category, 200)
+        self.result_view.heading("除外理由", "除外理由", 300)
 
-        scrollbar = ttk.Scrollbar(execution_frame, orient="vertical", command=self.tree.yview)
-        scrollbar.pack(side="right", fill="y")
-        self.tree.configure(yscrollcommand=scrollbar.set)
-    
     def generate_scenarios(self):
-        selected = {category: {subcategory: [item for item, var in items.items() if var.get()] 
-                            for subcategory, items in subcategories.items() if any(var.get() for var in items.values())}
+        # 項目の並びはカテゴリ定義の順にそろえる
+        categories = self.category_manager.categories
+        selected = {category: {subcategory: [item for item in categories[category][subcategory] if item in items]
+                               for subcategory, items in subcategories.items() if items}
                     for category, subcategories in self.selected_items.items()}
 
-        scenarios = self.scenario_generator.generate_scenarios(selected)
-
-        for i in self.tree.get_children():
-            self.tree.delete(i)
+        self.cancel_generation()
+        self.last_selected = None
+        self.result_view.set_rows([])
+        self.progress_bar['value'] = 0
+        self.progress_label.config(text="")
 
         if not any(selected.values()):
-            self.tree.insert("", "end", values=("シナリオを生成するには、", "各カテゴリから少なくとも1つの項目を選択してください。"))
+            self.result_counts = None
+            self.valid_indices = array('Q')
+            self.result_set = None
+            self.result_label.config(text="シナリオを生成するには、各カテゴリから少なくとも1つの項目を選択してください。")
             return
 
-        total_scenarios = 0
-        for scenario in scenarios:
-            is_excluded, applied_rules = self.exclusion_rules_manager.is_excluded_with_rules(scenario)
-            if not is_excluded:
-                scenario_values = []
-                for category in self.category_manager.categories.keys():
-                    if category in scenario:
-                        scenario_values.append(", ".join(scenario[category]))
-                    else:
-                        scenario_values.append("")
-                scenario_values.append("")  # 除外理由用の空の列
-                self.tree.insert("", "end", values=tuple(scenario_values))
-                total_scenarios += 1
+        self.start_generation(selected)
+
+    def start_generation(self, selected):
+        # 生成は別スレッドで行い、結果は poll_generation で少しずつ受け取る
+        self.cancel_generation()
+        self.last_selected = selected
+        self.result_counts = None
+        self.valid_indices = array('Q')
+        self.result_set = None
+        instrumentation.count("gui_generations")
+        self.result_label.config(text="シナリオを生成しています...")
+        # 有効件数が分かるまでは進捗の割合を出せないので、バーを往復させる
+        self.stop_progress_animation()
+        self.progress_bar.config(mode="indeterminate")
+        self.progress_bar.start(50)
+        self.worker = GenerationWorker(self.scenario_generator, selected)
+        self.worker.start()
+        self.generate_button.config(state=tk.DISABLED)
+        self.cancel_button.config(state=tk.NORMAL)
+        self.generation_started = time.perf_counter()
+        self.master.after(20, self.poll_generation, self.worker)
+
+    def cancel_generation(self):
+        if self.worker is not None and self.worker.is_running():
+            self.worker.cancel()
+
+    def poll_generation(self, worker):
+        if worker is not self.worker:
+            return  # 既に新しい生成が開始されている
+
+        finished = False
+        received = False
+        try:
+            while True:
+                message = worker.queue.get_nowait()
+                kind = message[0]
+                if kind == "total":
+                    # 有効件数は後から届く。行の表示には直積の件数と受け取った通し番号だけを使う
+                    self.result_counts = {"total": message[1], "valid": None, "excluded": None}
+                    self.update_result_rows()
+                elif kind == "counts":
+                    self.result_counts = message[1]
+                    self.stop_progress_animation()
+                    self.progress_bar['maximum'] = max(1, self.result_counts["valid"])
+                    self.update_result_rows()
+                elif kind == "batch":
+                    self.valid_indices.extend(message[1])
+                    received = True
+                elif kind == "result_set":
+                    result_set = message[1]
+                    if result_set.rules_version != self.exclusion_rules_manager.version:
+                        # 生成中にルールが変更された
+                        self.start_generation(self.last_selected)
+                        return
+                    self.result_set = result_set
+                elif kind == "done":
+                    finished = True
+                    self.result_label.config(text=self.get_result_summary())
+                    instrumentation.add_time("gui_generate", time.perf_counter() - self.generation_started)
+                elif kind == "cancelled":
+                    finished = True
+                    self.result_label.config(text=f"生成を中断しました。（{len(self.valid_indices)} 件生成済み）")
+                elif kind == "error":
+                    finished = True
+                    self.result_label.config(text="")
+                    messagebox.showerror("エラー", f"シナリオ生成中にエラーが発生しました: {message[1]}")
+        except queue.Empty:
+            pass
+
+        if received or finished:
+            done = len(self.valid_indices)
+            elapsed = max(time.perf_counter() - self.generation_started, 1e-9)
+            valid = self.result_counts["valid"] if self.result_counts else None
+            if valid is None:
+                self.progress_label.config(text=f"{done} 件 ({done / elapsed:,.0f} 件/秒)")
+            else:
+                self.progress_bar['value'] = done
+                self.progress_label.config(text=f"{done} / {valid} 件 ({done / elapsed:,.0f} 件/秒)")
+            if self.hide_excluded_var.get():
+                self.result_view.render()
+
+        if finished:
+            self.stop_progress_animation()
+            self.generate_button.config(state=tk.NORMAL)
+            self.cancel_button.config(state=tk.DISABLED)
+            if self.result_set is not None:
+                self.update_result_rows()
+            if instrumentation.enabled:
+                # 計測が有効な場合は生成1回ごとにレポートを書き出す
+                instrumentation.write_report()
+                instrumentation.reset()
+        else:
+            self.master.after(50, self.poll_generation, worker)
+
+    def stop_progress_animation(self):
+        if str(self.progress_bar['mode']) == "indeterminate":
+            self.progress_bar.stop()
+            self.progress_bar.config(mode="determinate", value=0)
+
+    def get_result_summary(self):
+        total = self.result_counts["total"]
+        valid = self.result_counts["valid"]
+        return f"合計 {valid} 件の有効なシナリオが生成されました。（全 {total} 件、除外 {total - valid} 件）"
+
+    def update_result_rows(self):
+        # 行は表示範囲に入ったときに初めて生成されるので、件数に関係なくすぐに表示できる。
+        # 除外シナリオを隠す場合は、バックグラウンドで求めた有効シナリオの通し番号を使う
+        if self.last_selected is None or self.result_counts is None:
+            return
+        if self.result_set is not None:
+            rows = self.result_set.rows(self.hide_excluded_var.get())
+        else:
+            rows = self.scenario_generator.scenario_rows(self.last_selected, self.hide_excluded_var.get(),
+                                                         self.result_counts, self.valid_indices)
+        self.result_view.set_rows(rows)
+        if (self.worker is None or not self.worker.is_running()) and self.result_counts["valid"] is not None:
+            self.result_label.config(text=self.get_result_summary())
+
+    def on_rules_changed(self, event, rule):
+        # 除外ルールの追加・削除は、影響するシナリオだけを更新して表示に反映する。
+        # 生成中やファイルからの読み込みなど差分で追従できない場合は生成し直す
+        if self.last_selected is None:
+            return
+        if self.result_set is None or (self.worker is not None and self.worker.is_running()):
+            too_large = (self.result_set is None and self.result_counts is not None
+                         and self.result_counts["total"] > MAX_INCREMENTAL_PRODUCT)
+            self.start_generation(self.last_selected)
+            if too_large:
+                # 差分更新用の索引を作らない大きさなので、全体を生成し直す理由を表示する
+                self.result_label.config(text=f"組み合わせ数が {MAX_INCREMENTAL_PRODUCT:,} 件を超えるため、"
+                                              "ルールの変更を差分で反映できません。全体を生成し直しています...")
+            return
+        changed = self.result_set.apply_change(event, rule)
+        if changed is None:
+            self.start_generation(self.last_selected)
+            return
+
+        valid = self.result_set.valid_count()
+        self.result_counts = {"total": self.result_set.total, "valid": valid,
+                              "excluded": self.result_set.total - valid}
+        self.progress_bar['maximum'] = max(1, valid)
+        self.progress_bar['value'] = valid
+        self.progress_label.config(text=f"{valid} / {valid} 件（{len(changed)} 件の状態が変化）")
+        self.result_view.refresh()  # 表示中の行は result_set を直接参照している
+        self.result_label.config(text=self.get_result_summary())
+
+    def get_result_row_values(self, position, scenario):
+        is_excluded, applied_rules = self.exclusion_rules_manager.is_excluded_with_rules(scenario)
+        values = []
+        for category in self.category_manager.categories.keys():
+            if category in scenario:
+                values.append(", ".join(scenario[category]))
             else:
-                excluded_values = []
-                for category in self.category_manager.categories.keys():
-                    if category in scenario:
-                        excluded_values.append(f"{', '.join(scenario[category])}")
-                    else:
-                        excluded_values.append("")
-                excluded_values.append(f"除外理由: {', '.join(applied_rules)}")
-                self.tree.insert("", "end", values=tuple(excluded_values), tags=('excluded',))
-
-        self.tree.tag_configure('excluded', foreground='gray')
-        self.tree.insert("", "end", values=(f"合計 {total_scenarios} 件の有効なシナリオが生成されました。", ""))
\ No newline at end of file
+                values.append("")
+        if is_excluded:
+            values.append(f"除外理由: {', '.join(applied_rules)}")
+            return tuple(values), ('excluded',)
+        values.append("")  # 除外理由用の空の列
+        return tuple(values), ()
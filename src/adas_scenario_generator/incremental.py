@@ -0,0 +1,220 @@
+import itertools
+import operator
+from array import array
+from collections import deque
+
+# これを超える直積では差分更新用の索引を作らない（シナリオごとの該当ルール数だけで 4 バイト × 直積の大きさを使う）。
+# その場合、ルールの追加・削除は差分で反映できず、GUI は状態表示でその旨を伝えて全体を生成し直す
+MAX_INCREMENTAL_PRODUCT = 2000000
+
+class ValidIndexTree:
+    # 直積上の各通し番号が有効かどうかを保持するフェニック木。
+    # 有効件数、k 番目の有効シナリオの通し番号、有効/除外の切り替えをいずれも O(log N) で扱う
+    def __init__(self, flags):
+        size = len(flags)
+        self.size = size
+        self.tree = array('I', [0])
+        self.tree.extend(bytes(flags))
+        # 最下位ビットが step の位置の値を親（位置 + step）に足す処理を、step の小さい順に
+        # スライス単位で行う。ループは map の中（C）で回るので、GUIのスレッドを長く止めない
+        tree = self.tree
+        step = 1
+        while 2 * step <= size:
+            parents = tree[2 * step::2 * step]
+            tree[2 * step::2 * step] = array('I', map(operator.add, parents, tree[step::2 * step]))
+            step *= 2
+        self.step = 1 << (size.bit_length() - 1) if size else 0
+
+    @classmethod
+    def from_indices(cls, size, indices):
+        # 有効な通し番号の列から作る
+        flags = bytearray(size)
+        deque(map(flags.__setitem__, indices, itertools.repeat(1)), maxlen=0)
+        return cls(flags)
+
+    def add(self, index, delta):
+        position = index + 1
+        tree = self.tree
+        while position <= self.size:
+            tree[position] += delta
+            position += position & -position
+
+    def total(self):
+        total = 0
+        position = self.size
+        while position > 0:
+            total += self.tree[position]
+            position -= position & -position
+        return total
+
+    def find(self, rank):
+        # rank 番目（0始まり）の有効シナリオの通し番号
+        position = 0
+        step = self.step
+        tree = self.tree
+        while step:
+            next_position = position + step
+            if next_position <= self.size and tree[next_position] <= rank:
+                position = next_position
+                rank -= tree[next_position]
+            step >>= 1
+        return position
+
+
+class IncrementalResultSet:
+    # 直前の生成結果を、ルールの追加・削除に合わせて差分で更新するための索引。
+    # ルールごとに該当するシナリオの通し番号を、シナリオごとに該当ルール数を保持する。
+    # ルール追加時はそのルールの項目をすべて含むシナリオだけを、削除時はそのルールが
+    # 除外していたシナリオだけを更新する。
+    # valid_indices に生成済みの有効なシナリオの通し番号を渡すと、有効件数の索引をそこから作る
+    def __init__(self, scenario_generator, selected, valid_indices=None):
+        self.scenario_generator = scenario_generator
+        self.exclusion_rules_manager = scenario_generator.exclusion_rules_manager
+        self.rules_version = self.exclusion_rules_manager.version
+        self.item_lists, self.env_count = scenario_generator._scenario_item_lists(selected)
+        self.weights = scenario_generator._radix_weights(self.item_lists)
+        self.total = scenario_generator._product_size(self.item_lists)
+        if self.total > MAX_INCREMENTAL_PRODUCT:
+            raise ValueError(f"組み合わせ数が多すぎるため差分更新できません: {self.total}")
+
+        self.positions_by_item = {}
+        for slot, items in enumerate(self.item_lists):
+            for position, item in enumerate(items):
+                self.positions_by_item.setdefault(item, []).append((slot, position))
+
+        self._rule_positions = {}
+        self._rule_positions_of = None
+        self.match_counts = array('I', bytes(4 * self.total))
+        self.matches_by_rule = {}
+        for rule in self.exclusion_rules_manager.get_rules():
+            self._add_matches(rule)
+        if valid_indices is None:
+            self.valid_tree = ValidIndexTree([count == 0 for count in self.match_counts])
+        else:
+            self.valid_tree = ValidIndexTree.from_indices(self.total, valid_indices)
+
+    def iter_rule_matches(self, rule):
+        # ルールのいずれかの AND 節の項目をすべて含むシナリオの通し番号を昇順で返す
+        matches = set()
+        for conjunction in self._rule_conjunctions(rule):
+            items = list(dict.fromkeys(conjunction))
+            if not all(item in self.positions_by_item for item in items):
+                continue
+            for assignment in itertools.product(*(self.positions_by_item[item] for item in items)):
+                slots = [slot for slot, _ in assignment]
+                if len(set(slots)) != len(slots):
+                    continue
+                base = sum(position * self.weights[slot] for slot, position in assignment)
+                offsets = [[position * weight for position in range(len(slot_items))]
+                           for slot, (slot_items, weight) in enumerate(zip(self.item_lists, self.weights))
+                           if slot not in slots]
+                matches.update(base + sum(combination) for combination in itertools.product(*offsets))
+        return sorted(matches)
+
+    def _rule_conjunctions(self, rule):
+        # 選択に合わせて展開したルールの AND 節（NOT は選択されていないサブカテゴリでも成立する）
+        compiled = self.scenario_generator._compiled_rules(self.item_lists)
+        if self._rule_positions_of is not compiled:
+            self._rule_positions = {}
+            for position, name in enumerate(compiled.rules):
+                self._rule_positions.setdefault(name, position)
+            self._rule_positions_of = compiled
+        position = self._rule_positions.get(rule)
+        if position is None:
+            return []
+        return [compiled.conjunctions[index].split(" * ") for index in compiled.clauses_by_rule[position]]
+
+    def _add_matches(self, rule):
+        if rule in self.matches_by_rule:
+            self.matches_by_rule[rule][1] += 1  # 同じルールが重複して登録されている
+            return []
+        indices = array('Q', self.iter_rule_matches(rule))
+        self.matches_by_rule[rule] = [indices, 1]
+        newly_excluded = []
+        match_counts = self.match_counts
+        for index in indices:
+            if match_counts[index] == 0:
+                newly_excluded.append(index)
+            match_counts[index] += 1
+        return newly_excluded
+
+    def add_rule(self, rule):
+        newly_excluded = self._add_matches(rule)
+        for index in newly_excluded:
+            self.valid_tree.add(index, -1)
+        return newly_excluded
+
+    def remove_rule(self, rule):
+        entry = self.matches_by_rule.get(rule)
+        if entry is None:
+            return []
+        entry[1] -= 1
+        if entry[1] > 0:
+            return []
+        del self.matches_by_rule[rule]
+
+        newly_valid = []
+        match_counts = self.match_counts
+        for index in entry[0]:
+            match_counts[index] -= 1
+            if match_counts[index] == 0:
+                newly_valid.append(index)
+                self.valid_tree.add(index, 1)
+        return newly_valid
+
+    def apply_change(self, event, rule):
+        # ExclusionRulesManager の変更通知を反映し、状態が変わったシナリオの通し番号を返す。
+        # 差分で追従できない変更（ファイルの読み込みなど）の場合は None を返す
+        if event == "added":
+            changed = self.add_rule(rule)
+        elif event == "removed":
+            changed = self.remove_rule(rule)
+        else:
+            return None
+        self.rules_version = self.exclusion_rules_manager.version
+        return changed
+
+    def is_excluded(self, index):
+        return self.match_counts[index] > 0
+
+    def matched_rules(self, index):
+        combination = self.scenario_generator._decode_index(self.item_lists, index, self.weights)
+        return self.exclusion_rules_manager.compile().matching_rules(combination)
+
+    def valid_count(self):
+        return self.valid_tree.total()
+
+    def scenario_at(self, index):
+        combination = self.scenario_generator._decode_index(self.item_lists, index, self.weights)
+        return self.scenario_generator._to_scenario(combination, self.env_count)
+
+    def rows(self, hide_excluded=False):
+        return IncrementalScenarioRows(self, hide_excluded)
+
+
+class IncrementalScenarioRows:
+    # IncrementalResultSet を結果ビューの行データとして参照する。ルールの変更は即座に反映される
+    def __init__(self, result_set, hide_excluded=False):
+        self.result_set = result_set
+        self.hide_excluded = hide_excluded
+
+    @property
+    def total(self):
+        return self.result_set.total
+
+    @property
+    def valid(self):
+        return self.result_set.valid_count()
+
+    def __len__(self):
+        return self.valid if self.hide_excluded else self.total
+
+    def product_index(self, position):
+        if not 0 <= position < len(self):
+            raise IndexError(position)
+        if self.hide_excluded:
+            return self.result_set.valid_tree.find(position)
+        return position
+
+    def __getitem__(self, position):
+        return self.result_set.scenario_at(self.product_index(position))
@@ -0,0 +1,225 @@
+import json
+import os
+import sys
+import threading
+import time
+
+# 性能調査用の計測。既定では無効で、無効の間は計測のための処理をほとんど行わない。
+# 環境変数 ADAS_SCENARIO_INSTRUMENT（またはCLIの --instrument / --profile / --trace-memory）で有効にする:
+#   ADAS_SCENARIO_INSTRUMENT=1               段階ごとの時間、件数、ルールごとの評価回数と該当数
+#   ADAS_SCENARIO_INSTRUMENT=1,profile       さらに1回の実行を cProfile で記録する
+#   ADAS_SCENARIO_INSTRUMENT=1,memory        さらに1回の実行を tracemalloc で記録する
+# レポートは JSON で ADAS_SCENARIO_INSTRUMENT_OUT のファイル（未指定なら標準エラー出力）に書き出す
+
+INSTRUMENT_ENV = "ADAS_SCENARIO_INSTRUMENT"
+INSTRUMENT_OUT_ENV = "ADAS_SCENARIO_INSTRUMENT_OUT"
+PROFILE_TOP = 30
+MEMORY_TOP = 20
+
+class _NullStage:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+_NULL_STAGE = _NullStage()
+
+
+class _Stage:
+    def __init__(self, instrumentation, name):
+        self.instrumentation = instrumentation
+        self.name = name
+
+    def __enter__(self):
+        self.start_time = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.instrumentation.add_time(self.name, time.perf_counter() - self.start_time)
+        return False
+
+
+class InstrumentedRuleMasks(list):
+    # 枝刈りの判定に使うルールのマスクのリスト。any() で走査されたマスクを評価回数として数え、
+    # any() が途中で打ち切られた（そのマスクが成立した）場合は枝刈りとして数える
+    def __init__(self, rule_masks, instrumentation, rule_names):
+        super().__init__(rule_masks)
+        self.instrumentation = instrumentation
+        self.rule_names = rule_names
+
+    def __iter__(self):
+        instrumentation = self.instrumentation
+        for rule_mask in list.__iter__(self):
+            rule = self.rule_names[rule_mask]
+            instrumentation.record_rule(rule, evaluations=1)
+            try:
+                yield rule_mask
+            except GeneratorExit:
+                instrumentation.record_rule(rule, prunes=1)
+                raise
+
+
+class Instrumentation:
+    def __init__(self, enabled=False, profile=False, memory=False, output=None):
+        self.lock = threading.Lock()
+        self.configure(enabled, profile, memory, output)
+
+    @classmethod
+    def from_environment(cls, environ=None):
+        environ = os.environ if environ is None else environ
+        options = {option.strip().lower() for option in environ.get(INSTRUMENT_ENV, "").split(",") if option.strip()}
+        options.discard("0")
+        return cls(bool(options), "profile" in options, "memory" in options, environ.get(INSTRUMENT_OUT_ENV))
+
+    def configure(self, enabled=True, profile=False, memory=False, output=None):
+        self.enabled = enabled or profile or memory
+        self.profile = profile
+        self.memory = memory
+        self.output = output
+        self.captured = False
+        self.reset()
+
+    def reset(self):
+        self.timers = {}
+        self.counters = {}
+        self.rules = {}
+        self.capture_report = {}
+
+    def stage(self, name):
+        if not self.enabled:
+            return _NULL_STAGE
+        return _Stage(self, name)
+
+    def add_time(self, name, seconds):
+        if not self.enabled:
+            return
+        with self.lock:
+            timer = self.timers.setdefault(name, {"calls": 0, "seconds": 0.0, "max_seconds": 0.0})
+            timer["calls"] += 1
+            timer["seconds"] += seconds
+            timer["max_seconds"] = max(timer["max_seconds"], seconds)
+
+    def count(self, name, value=1):
+        if self.enabled:
+            with self.lock:
+                self.counters[name] = self.counters.get(name, 0) + value
+
+    def record_rule(self, rule, evaluations=0, hits=0, prunes=0, seconds=0.0):
+        # 生成スレッドとGUIのスレッドの両方から呼ばれるので、他の記録と同じくロックを取る
+        with self.lock:
+            stats = self.rules.get(rule)
+            if stats is None:
+                stats = self.rules[rule] = {"evaluations": 0, "hits": 0, "prunes": 0, "seconds": 0.0}
+            stats["evaluations"] += evaluations
+            stats["hits"] += hits
+            stats["prunes"] += prunes
+            stats["seconds"] += seconds
+
+    def iter_stage(self, name, iterable, on_finish=None):
+        # ジェネレータの内部で費やされた時間だけを計測する（呼び出し側の処理時間は含めない）。
+        # 最後まで取り出した場合は件数を on_finish に渡す
+        if not self.enabled:
+            return iterable
+        return self._iter_stage(name, iterable, on_finish)
+
+    def _iter_stage(self, name, iterable, on_finish):
+        iterator = iter(iterable)
+        seconds = 0.0
+        produced = 0
+        try:
+            while True:
+                start_time = time.perf_counter()
+                try:
+                    value = next(iterator)
+                except StopIteration:
+                    seconds += time.perf_counter() - start_time
+                    if on_finish is not None:
+                        on_finish(produced)
+                    return
+                seconds += time.perf_counter() - start_time
+                produced += 1
+                yield value
+        finally:
+            self.add_time(name, seconds)
+
+    def wrap_rule_masks(self, compiled, rule_masks):
+        if not self.enabled or not rule_masks:
+            return rule_masks
+        rule_names = {}
+        for index, rule_mask in enumerate(compiled.rule_masks):
+            rule_names.setdefault(rule_mask, compiled.rules[compiled.conjunction_rules[index]])
+        return InstrumentedRuleMasks(rule_masks, self, rule_names)
+
+    def capture(self):
+        # cProfile / tracemalloc による記録は、有効にした後の最初の1回の実行だけで行う
+        if not (self.profile or self.memory) or self.captured:
+            return _NULL_STAGE
+        self.captured = True
+        return _Capture(self)
+
+    def report(self):
+        with self.lock:
+            report = {
+                "timers": {name: dict(timer) for name, timer in self.timers.items()},
+                "counters": dict(self.counters),
+                "rules": {rule: dict(stats) for rule, stats in
+                          sorted(self.rules.items(), key=lambda entry: -entry[1]["evaluations"])}
+            }
+        report.update(self.capture_report)
+        return report
+
+    def write_report(self, output=None):
+        output = output or self.output
+        report = self.report()
+        if output and output != "-":
+            with open(output, "w", encoding="utf-8") as file:
+                json.dump(report, file, ensure_ascii=False, indent=2)
+        else:
+            json.dump(report, sys.stderr, ensure_ascii=False, indent=2)
+            print(file=sys.stderr)
+        return report
+
+
+class _Capture:
+    def __init__(self, instrumentation):
+        self.instrumentation = instrumentation
+
+    def __enter__(self):
+        self.profiler = None
+        if self.instrumentation.profile:
+            import cProfile
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+        if self.instrumentation.memory:
+            import tracemalloc
+            tracemalloc.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        capture_report = self.instrumentation.capture_report
+        if self.profiler is not None:
+            import pstats
+            self.profiler.disable()
+            stats = pstats.Stats(self.profiler)
+            functions = sorted(stats.stats.items(), key=lambda entry: -entry[1][3])[:PROFILE_TOP]
+            capture_report["profile"] = [
+                {"function": f"{filename}:{line}({name})", "calls": calls,
+                 "total_seconds": total_time, "cumulative_seconds": cumulative_time}
+                for (filename, line, name), (_, calls, total_time, cumulative_time, _) in functions
+            ]
+        if self.instrumentation.memory:
+            import tracemalloc
+            snapshot = tracemalloc.take_snapshot()
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            capture_report["memory"] = {
+                "peak_bytes": peak,
+                "top": [{"location": str(stat.traceback), "size_bytes": stat.size, "count": stat.count}
+                        for stat in snapshot.statistics("lineno")[:MEMORY_TOP]]
+            }
+        return False
+
+
+instrumentation = Instrumentation.from_environment()
@@ -0,0 +1,47 @@
+class ItemSearchIndex:
+    # 項目名の部分一致検索に使う n-gram 索引。1文字と連続する2文字ごとに、その文字列を含む
+    # 項目の番号（昇順）を持つ。検索語の n-gram のうち最も該当の少ないものから候補を取り出し、
+    # 実際に検索語を含むかを確認するので、検索の手間は項目の総数ではなく候補の数で決まる。
+    # 大文字・小文字、全角・半角の英数字は区別しない
+    def __init__(self, entries):
+        self.entries = list(entries)  # (サブカテゴリ, 項目) のリスト
+        self.keys = [self.normalize(item) for _, item in self.entries]
+        self.postings = {}
+        for index, key in enumerate(self.keys):
+            for gram in self.grams(key):
+                posting = self.postings.setdefault(gram, [])
+                if not posting or posting[-1] != index:
+                    posting.append(index)
+
+    @classmethod
+    def from_categories(cls, subcategories):
+        return cls((subcategory, item) for subcategory, items in subcategories.items() for item in items)
+
+    @staticmethod
+    def normalize(text):
+        # 全角英数字を半角にそろえる（NFKC 正規化のうち英数字の分だけ）
+        return "".join(chr(ord(char) - 0xFEE0) if "！" <= char <= "～" else char for char in text).casefold()
+
+    @staticmethod
+    def grams(key):
+        if len(key) == 1:
+            return [key]
+        return [key[i:i + 2] for i in range(len(key) - 1)] + list(key)
+
+    def search(self, query, candidates=None):
+        # 検索語を含む項目の番号を昇順で返す。candidates には前回の検索結果を渡せる
+        # （検索語が前回の検索語を含む場合、一致する項目は前回の結果に含まれる）
+        query = self.normalize(query.strip())
+        if not query:
+            return list(range(len(self.entries))) if candidates is None else list(candidates)
+        grams = [query] if len(query) == 1 else [query[i:i + 2] for i in range(len(query) - 1)]
+        postings = [self.postings.get(gram, []) for gram in grams]
+        shortest = min(postings, key=len)
+        if candidates is not None and len(candidates) < len(shortest):
+            return [index for index in candidates if query in self.keys[index]]
+        if candidates is not None:
+            candidate_set = set(candidates)
+            shortest = [index for index in shortest if index in candidate_set]
+        if len(query) <= 2:
+            return list(shortest)
+        return [index for index in shortest if query in self.keys[index]]
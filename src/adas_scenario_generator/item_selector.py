@@ -0,0 +1,143 @@
+import tkinter as tk
+from tkinter import ttk
+from .item_search import ItemSearchIndex
+from .result_view import VirtualScenarioView
+
+CHECKED = "☑"
+UNCHECKED = "☐"
+
+class VirtualItemSelector(ttk.Frame):
+    # 項目数の多いカテゴリ用の項目選択リスト。チェックボックスを項目ごとに作らず、
+    # 見えている行だけを Treeview に表示する（VirtualScenarioView を使う）。
+    # 検索欄に入力した文字列を含む項目だけを表示し、サブカテゴリの行をクリックすると
+    # そのサブカテゴリの（表示中の）項目をまとめて選択・解除する。
+    # 選択状態は selection（サブカテゴリ -> 選択された項目の集合）に直接書き込む。
+    # 検索の索引は初めて検索したときに index_factory で作る（省略時は subcategories から作る）
+    def __init__(self, master, subcategories, selection, index_factory=None):
+        super().__init__(master)
+
+        search_frame = ttk.Frame(self)
+        search_frame.pack(fill=tk.X, padx=5, pady=5)
+        ttk.Label(search_frame, text="検索:").pack(side=tk.LEFT)
+        self.search_var = tk.StringVar()
+        ttk.Entry(search_frame, textvariable=self.search_var).pack(side=tk.LEFT, fill=tk.X, expand=True, padx=5)
+        ttk.Button(search_frame, text="表示中をすべて選択",
+                   command=lambda: self.set_shown(True)).pack(side=tk.LEFT, padx=2)
+        ttk.Button(search_frame, text="表示中をすべて解除",
+                   command=lambda: self.set_shown(False)).pack(side=tk.LEFT, padx=2)
+        self.count_label = ttk.Label(self, text="")
+        self.count_label.pack(anchor=tk.W, padx=5)
+
+        self.view = VirtualScenarioView(self, ("check", "name"), self.get_row_values)
+        self.view.heading("check", "選択", 50)
+        self.view.heading("name", "項目", 400)
+        self.view.tree.tag_configure('subcategory', background='#e8e8e8')
+        self.view.pack(fill=tk.BOTH, expand=True, padx=5, pady=5)
+        self.view.tree.bind("<Button-1>", self.on_click)
+        self.view.tree.bind("<space>", self.on_space)
+
+        self.query = ""
+        self.matches = None
+        self.set_data(subcategories, selection, index_factory)
+        self.search_var.trace_add("write", lambda *args: self.apply_search())
+
+    def set_data(self, subcategories, selection, index_factory=None):
+        # カテゴリの内容が変更されたときに呼ぶ。検索語と選択状態はそのまま残る
+        self.subcategories = subcategories
+        self.selection = selection
+        self.index_factory = index_factory or (lambda: ItemSearchIndex.from_categories(subcategories))
+        self._index = None
+        self.total = sum(len(items) for items in subcategories.values())
+        self.query = ""
+        self.matches = None
+        self.apply_search(keep_position=True)
+
+    @property
+    def index(self):
+        if self._index is None:
+            self._index = self.index_factory()
+        return self._index
+
+    def apply_search(self, keep_position=False):
+        query = self.search_var.get().strip()
+        rows = []
+        if not query:
+            self.matches = None
+            for subcategory, items in self.subcategories.items():
+                rows.append((subcategory, None))
+                rows.extend((subcategory, item) for item in items)
+            self.shown_count = self.total
+        else:
+            # 前回の検索語を含む検索語なら、前回の結果の中だけを探す
+            candidates = self.matches if self.query and self.query in query else None
+            self.matches = self.index.search(query, candidates)
+            entries = self.index.entries
+            last_subcategory = None
+            for index in self.matches:
+                subcategory, item = entries[index]
+                if subcategory != last_subcategory:
+                    rows.append((subcategory, None))
+                    last_subcategory = subcategory
+                rows.append((subcategory, item))
+            self.shown_count = len(self.matches)
+        self.query = query
+        if keep_position:
+            self.view.rows = rows
+            self.view.refresh()
+        else:
+            self.view.set_rows(rows)
+        self.update_count()
+
+    def get_row_values(self, position, row):
+        subcategory, item = row
+        selected = self.selection.get(subcategory, set())
+        if item is None:
+            total = len(self.subcategories.get(subcategory, []))
+            return ("", f"{subcategory}（{len(selected)} / {total} 件選択）"), ('subcategory',)
+        return (CHECKED if item in selected else UNCHECKED, f"    {item}"), ()
+
+    def update_count(self):
+        selected = sum(len(items) for items in self.selection.values())
+        self.count_label.config(text=f"{self.shown_count} / {self.total} 件を表示、{selected} 件選択")
+
+    def shown_items(self, subcategory=None):
+        for row in self.view.rows:
+            if row[1] is not None and (subcategory is None or row[0] == subcategory):
+                yield row
+
+    def set_shown(self, selected, subcategory=None):
+        for row_subcategory, item in self.shown_items(subcategory):
+            items = self.selection.setdefault(row_subcategory, set())
+            if selected:
+                items.add(item)
+            else:
+                items.discard(item)
+        self.view.refresh()
+        self.update_count()
+
+    def toggle(self, position):
+        if not 0 <= position < len(self.view.rows):
+            return
+        subcategory, item = self.view.rows[position]
+        items = self.selection.setdefault(subcategory, set())
+        if item is None:
+            # サブカテゴリの行: 表示中の項目がすべて選択済みなら解除、そうでなければすべて選択
+            self.set_shown(not all(row[1] in items for row in self.shown_items(subcategory)), subcategory)
+            return
+        if item in items:
+            items.discard(item)
+        else:
+            items.add(item)
+        self.view.refresh()
+        self.update_count()
+
+    def on_click(self, event):
+        row = self.view.tree.identify_row(event.y)
+        if row:
+            self.toggle(self.view.first + self.view.tree.index(row))
+
+    def on_space(self, event):
+        focus = self.view.tree.focus()
+        if focus:
+            self.toggle(self.view.first + self.view.tree.index(focus))
+        return "break"
@@ -12,7 +12,7 @@ def main():
     root.geometry("800x600")  # ウィンドウサイズを設定
 
     category_manager = CategoryManager()
-    exclusion_rules_manager = ExclusionRulesManager()
+    exclusion_rules_manager = ExclusionRulesManager(category_manager)
     scenario_generator = ScenarioGenerator(category_manager, exclusion_rules_manager)
     
     app = ADASScenarioGeneratorGUI(root, category_manager, scenario_generator, exclusion_rules_manager)
@@ -0,0 +1,110 @@
+import itertools
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+class NumpyScenarioEngine:
+    # NumPy を用いたシナリオ生成と除外判定。各サブカテゴリの項目を小さな整数コードに変換し、
+    # 直積をブロック単位でコード行列として生成して、すべての除外ルールを真偽値マスクで一括評価する。
+    # 文字列への変換は出力時にのみ行う
+    def __init__(self, scenario_generator, selected, chunk_size=65536):
+        if np is None:
+            raise RuntimeError("NumPyバックエンドを使用するには numpy をインストールしてください。")
+
+        self.scenario_generator = scenario_generator
+        self.item_lists, self.env_count = scenario_generator._scenario_item_lists(selected)
+        self.sizes = [len(items) for items in self.item_lists]
+        self.total = scenario_generator._product_size(self.item_lists)
+        if self.total >= 2 ** 63:
+            raise ValueError("組み合わせ数が大きすぎるため NumPy バックエンドでは扱えません。")
+
+        largest = max(self.sizes, default=1)
+        self.dtype = np.uint8 if largest <= 2 ** 8 else np.uint16 if largest <= 2 ** 16 else np.uint32
+        self.weights = np.array(scenario_generator._radix_weights(self.item_lists), dtype=np.int64)
+        self._compile_rules(scenario_generator._compiled_rules(self.item_lists).conjunctions)
+
+        self.chunk_size = chunk_size
+
+    def _compile_rules(self, rules):
+        # ルールを「関係するサブカテゴリの組」ごとの真偽値の表（決定表）にまとめる。
+        # 例えば場所×速度の2項目ルールはすべて1枚の表に入り、ブロック全体を1回の参照で判定できる。
+        # 同じ項目が複数のサブカテゴリにある場合は、それぞれの位置の組み合わせを登録する
+        positions_by_item = {}
+        for slot, items in enumerate(self.item_lists):
+            for code, item in enumerate(items):
+                positions_by_item.setdefault(item, []).append((slot, code))
+
+        tables = {}
+        self.rules = []
+        for rule in rules:
+            items = list(dict.fromkeys(rule.split(" * ")))
+            if not all(item in positions_by_item for item in items):
+                continue  # 選択されていない項目を含むルールは成立しない
+            self.rules.append(rule)
+            for assignment in itertools.product(*(positions_by_item[item] for item in items)):
+                assignment = sorted(assignment)
+                slots = tuple(slot for slot, _ in assignment)
+                if len(set(slots)) != len(slots):
+                    continue  # 1つのサブカテゴリから2つの項目は選ばれない
+                if slots not in tables:
+                    tables[slots] = np.zeros([self.sizes[slot] for slot in slots], dtype=bool)
+                tables[slots][tuple(code for _, code in assignment)] = True
+
+        self.rule_tables = []
+        for slots, table in tables.items():
+            strides = [int(np.prod(table.shape[i + 1:], dtype=np.int64)) for i in range(len(slots))]
+            self.rule_tables.append((slots, strides, table.ravel()))
+
+    def codes_for_range(self, start, stop):
+        indices = np.arange(start, stop, dtype=np.int64)
+        codes = np.empty((len(indices), len(self.sizes)), dtype=self.dtype)
+        for slot, (size, weight) in enumerate(zip(self.sizes, self.weights)):
+            codes[:, slot] = (indices // weight) % size
+        return codes
+
+    def excluded_mask(self, codes):
+        excluded = np.zeros(len(codes), dtype=bool)
+        for slots, strides, table in self.rule_tables:
+            flat_index = np.zeros(len(codes), dtype=np.int64)
+            for slot, stride in zip(slots, strides):
+                flat_index += codes[:, slot].astype(np.int64) * stride
+            excluded |= table[flat_index]
+        return excluded
+
+    def iter_blocks(self, hide_excluded=True):
+        # (先頭の通し番号, コード行列, 除外マスク) をブロックごとに返す。
+        # hide_excluded=True の場合は有効な行だけのコード行列と、その通し番号を返す
+        for start in range(0, self.total, self.chunk_size):
+            stop = min(self.total, start + self.chunk_size)
+            codes = self.codes_for_range(start, stop)
+            excluded = self.excluded_mask(codes)
+            if hide_excluded:
+                keep = ~excluded
+                yield np.arange(start, stop, dtype=np.int64)[keep], codes[keep], excluded[keep]
+            else:
+                yield np.arange(start, stop, dtype=np.int64), codes, excluded
+
+    def filtered_codes(self):
+        blocks = [codes for _, codes, _ in self.iter_blocks()]
+        if not blocks:
+            return np.zeros((0, len(self.sizes)), dtype=self.dtype)
+        return np.concatenate(blocks)
+
+    def count(self):
+        valid = sum(len(codes) for _, codes, _ in self.iter_blocks())
+        return {"total": self.total, "valid": valid, "excluded": self.total - valid}
+
+    def decode(self, codes):
+        # 列ごとにまとめて文字列へ変換してから行にする
+        columns = [np.asarray(items, dtype=object)[codes[:, slot]].tolist()
+                   for slot, items in enumerate(self.item_lists)]
+        if not columns:
+            return iter([()] * len(codes))
+        return zip(*columns)
+
+    def iter_filtered(self):
+        for _, codes, _ in self.iter_blocks():
+            for combination in self.decode(codes):
+                yield self.scenario_generator._to_scenario(combination, self.env_count)
@@ -0,0 +1,130 @@
+import hashlib
+import json
+import os
+from array import array
+
+CACHE_FORMAT_VERSION = 3
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "adas_scenario_generator")
+
+def normalize_rule(rule):
+    # 項目の順序が異なるだけのルールは同じものとして扱う
+    return " * ".join(sorted(set(rule.split(" * "))))
+
+
+class ScenarioResultCache:
+    # 生成・フィルタ結果のディスクキャッシュ。
+    # キーは「選択されたサブカテゴリと項目（順序込み）」と「結果に影響し得るルール（すべての項目が
+    # 選択に含まれるもの）」のハッシュなので、選択と無関係な項目やルールの変更ではキャッシュは無効にならない。
+    # 各エントリは1行目がJSONのヘッダ（件数とルールごとの除外数）、以降が有効なシナリオの各サブカテゴリでの
+    # 項目の位置の配列（列ごとにバイナリで連結）で、使われた順（更新日時）と合計サイズで古いものから削除する。
+    # ルールごとの除外数はルール名ではなく rule_keys のキー（正規化した AND 節）で保持するので、
+    # 表示名や項目の順序が違っても AND 節が同じルールには同じ値を返せる
+    def __init__(self, cache_dir=None, max_bytes=512 * 1024 * 1024, max_entries=256):
+        self.cache_dir = cache_dir or os.environ.get("ADAS_SCENARIO_CACHE_DIR", DEFAULT_CACHE_DIR)
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+
+    def relevant_rules(self, item_lists, rules):
+        selected_items = {item for items in item_lists for item in items}
+        return sorted({normalize_rule(rule) for rule in rules
+                       if all(item in selected_items for item in rule.split(" * "))})
+
+    def rule_keys(self, item_lists, compiled):
+        # コンパイル済みルールの各ルールについて、結果に影響し得る AND 節を正規化して連結したキー
+        selected_items = {item for items in item_lists for item in items}
+        keys = []
+        for clauses in compiled.clauses_by_rule:
+            conjunctions = {normalize_rule(compiled.conjunctions[index]) for index in clauses}
+            keys.append(" | ".join(sorted(conjunction for conjunction in conjunctions
+                                          if all(item in selected_items for item in conjunction.split(" * ")))))
+        return keys
+
+    def make_key(self, item_lists, env_count, rules):
+        payload = json.dumps({
+            "format": CACHE_FORMAT_VERSION,
+            "env_count": env_count,
+            "item_lists": item_lists,
+            "rules": self.relevant_rules(item_lists, rules)
+        }, ensure_ascii=False, sort_keys=True)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.bin")
+
+    def load(self, key):
+        path = self._path(key)
+        try:
+            with open(path, "rb") as file:
+                header = json.loads(file.readline().decode("utf-8"))
+                valid = header["counts"]["valid"]
+                columns = []
+                for _ in range(header["columns"]):
+                    column = array(header["typecode"])
+                    column.fromfile(file, valid)
+                    columns.append(column)
+                if file.read(1):
+                    return None
+        except (OSError, ValueError, KeyError, EOFError):
+            return None  # 書き込み途中などで壊れたエントリ
+
+        os.utime(path)  # LRU のため最終使用日時を更新する
+        return columns, header["counts"]
+
+    def load_counts(self, key):
+        # ヘッダだけを読み、件数とルールごとの除外数（rule_keys のキー -> 件数）を返す
+        try:
+            with open(self._path(key), "rb") as file:
+                header = json.loads(file.readline().decode("utf-8"))
+            return header["counts"], header.get("per_rule", {})
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def store(self, key, columns, counts, per_rule=None):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        typecode = columns[0].typecode if columns else 'H'
+        if any(len(column) != counts["valid"] or column.typecode != typecode for column in columns):
+            raise ValueError("キャッシュする列の長さまたは型が一致しません。")
+        header = {"typecode": typecode, "columns": len(columns), "counts": counts, "per_rule": per_rule or {}}
+
+        path = self._path(key)
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        with open(temp_path, "wb") as file:
+            file.write(json.dumps(header, ensure_ascii=False).encode("utf-8"))
+            file.write(b"\n")
+            for column in columns:
+                column.tofile(file)
+        os.replace(temp_path, path)
+        self.evict()
+
+    def entries(self):
+        if not os.path.isdir(self.cache_dir):
+            return []
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if name.endswith(".bin"):
+                path = os.path.join(self.cache_dir, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+        entries.sort()
+        return entries
+
+    def evict(self):
+        entries = self.entries()
+        total_size = sum(size for _, size, _ in entries)
+        while entries and (total_size > self.max_bytes or len(entries) > self.max_entries):
+            _, size, path = entries.pop(0)
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total_size -= size
+
+    def clear(self):
+        for _, _, path in self.entries():
+            try:
+                os.remove(path)
+            except OSError:
+                pass
@@ -0,0 +1,86 @@
+import tkinter as tk
+from tkinter import ttk
+from .instrumentation import instrumentation
+
+class VirtualScenarioView(ttk.Frame):
+    # 画面に見えている行だけをTreeviewに挿入する仮想化された結果ビュー。
+    # 行データは len() と添字アクセスを持つオブジェクト（ScenarioRows など）から取得する
+    def __init__(self, master, columns, row_values):
+        super().__init__(master)
+        self.row_values = row_values  # 行番号とシナリオから (値のタプル, タグ) を作る関数
+        self.rows = []
+        self.first = 0
+        self.visible_count = 20
+
+        style = ttk.Style()
+        self.row_height = int(style.lookup("Treeview", "rowheight") or 20)
+
+        self.scrollbar = ttk.Scrollbar(self, orient="vertical", command=self.on_scroll)
+        self.scrollbar.pack(side="right", fill="y")
+
+        self.tree = ttk.Treeview(self, columns=columns, show="headings", height=self.visible_count)
+        self.tree.pack(fill=tk.BOTH, expand=True)
+        self.tree.tag_configure('excluded', foreground='gray')
+
+        self.tree.bind("<Configure>", self.on_resize)
+        self.tree.bind("<MouseWheel>", self.on_mousewheel)
+        self.tree.bind("<Button-4>", lambda event: self.scroll_to(self.first - 3))
+        self.tree.bind("<Button-5>", lambda event: self.scroll_to(self.first + 3))
+
+    def heading(self, column, text, width):
+        self.tree.heading(column, text=text)
+        self.tree.column(column, width=width)
+
+    def set_columns(self, columns):
+        self.tree.configure(columns=columns)
+        self.render()
+
+    def set_rows(self, rows):
+        self.rows = rows
+        self.first = 0
+        self.render()
+
+    def refresh(self):
+        # 行データが変化した場合に、スクロール位置を保ったまま再描画する
+        self.first = min(self.first, max(0, len(self.rows) - self.visible_count))
+        self.render()
+
+    def scroll_to(self, first):
+        last_first = max(0, len(self.rows) - self.visible_count)
+        first = min(max(0, first), last_first)
+        if first != self.first:
+            self.first = first
+            self.render()
+
+    def on_scroll(self, *args):
+        if args[0] == "moveto":
+            self.scroll_to(int(float(args[1]) * len(self.rows)))
+        elif args[0] == "scroll":
+            step = int(args[1])
+            if args[2] == "pages":
+                step *= self.visible_count
+            self.scroll_to(self.first + step)
+
+    def on_mousewheel(self, event):
+        self.scroll_to(self.first - int(event.delta / 120) * 3)
+
+    def on_resize(self, event):
+        # 見出し行の分を差し引いて表示可能な行数を求める
+        visible_count = max(1, event.height // self.row_height - 1)
+        if visible_count != self.visible_count:
+            self.visible_count = visible_count
+            self.render()
+
+    def render(self):
+        with instrumentation.stage("gui_render"):
+            self.tree.delete(*self.tree.get_children())
+            last = min(len(self.rows), self.first + self.visible_count)
+            for position in range(self.first, last):
+                values, tags = self.row_values(position, self.rows[position])
+                self.tree.insert("", "end", values=values, tags=tags)
+        instrumentation.count("rows_rendered", max(0, last - self.first))
+
+        if len(self.rows):
+            self.scrollbar.set(self.first / len(self.rows), last / len(self.rows))
+        else:
+            self.scrollbar.set(0, 1)
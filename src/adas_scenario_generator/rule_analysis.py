@@ -0,0 +1,188 @@
+import time
+
+from .scenario import SCENARIO_CATEGORIES
+from .scenario_generator import ScenarioGenerator
+
+MAX_SUBSET_ITEMS = 12  # これより項目の多い AND 節は部分集合を列挙せずに索引から候補を探す
+
+class RuleSetAnalyzer:
+    # 除外ルールの集合を分析する。ルールは展開後の AND 節（ビットマスク）で比較するので、
+    # 項目の順序が違うだけのルールや、パターンルールと2項目ルールの重なりも検出できる。
+    #   duplicates:        他のルールと同じ AND 節の集合を持つルール
+    #   subsumed:          すべての AND 節が、他のルールのより小さい（または同じ）AND 節に含まれるルール
+    #   orphaned:          カテゴリに存在しない項目を含み、成立し得ないルール
+    #   impossible:        同じサブカテゴリの項目を同時に要求するため成立し得ないルール
+    #   unreachable_items: どの有効なシナリオにも現れない項目（ルールによって常に除外される）
+    # minimized_rules は上記の重複・包含・成立しないルールを取り除いた等価なルール集合
+    def __init__(self, exclusion_rules_manager, category_manager=None):
+        self.exclusion_rules_manager = exclusion_rules_manager
+        self.category_manager = category_manager or exclusion_rules_manager.category_manager
+        self.compiled = exclusion_rules_manager.compile()
+
+        self.clauses_by_rule = [[] for _ in self.compiled.rules]
+        for index, rule_index in enumerate(self.compiled.conjunction_rules):
+            self.clauses_by_rule[rule_index].append(index)
+
+        self.items_by_id = {item_id: item for item, item_id in self.compiled.item_ids.items()}
+        self.subcategories_by_item = {}
+        if self.category_manager is not None:
+            self.subcategories_by_item = {item: set(locations)
+                                          for item, locations in self.category_manager.item_locations.items()}
+
+    def _mask_items(self, mask):
+        items = []
+        while mask:
+            bit = mask & -mask
+            items.append(self.items_by_id[bit.bit_length() - 1])
+            mask ^= bit
+        return items
+
+    def _dead_clause_reason(self, mask):
+        # AND 節が成立し得ない場合に ("orphaned", 存在しない項目) か ("impossible", None) を返す
+        if self.category_manager is None:
+            return None
+        items = self._mask_items(mask)
+        # NOT の展開で使う仮の項目（サブカテゴリが選択されていない）はカテゴリにないが成立し得る
+        items = [item for item in items if item not in self.compiled.absent_items]
+        missing = [item for item in items if item not in self.subcategories_by_item]
+        if missing:
+            return "orphaned", missing
+        used = set()
+        for item in items:
+            subcategories = self.subcategories_by_item[item]
+            if len(subcategories) == 1:
+                subcategory = next(iter(subcategories))
+                if subcategory in used:
+                    return "impossible", None
+                used.add(subcategory)
+        return None
+
+    def _iter_submasks(self, mask):
+        submask = mask
+        while submask:
+            yield submask
+            submask = (submask - 1) & mask
+
+    def _covering_clauses(self, mask, clause_counts):
+        # mask の部分集合になっている（残っている）AND 節のマスクを返す
+        if bin(mask).count("1") <= MAX_SUBSET_ITEMS:
+            return [submask for submask in self._iter_submasks(mask) if clause_counts.get(submask)]
+        candidates = set()
+        for item in self._mask_items(mask):
+            for index in self.compiled.rules_by_item[self.compiled.item_ids[item]]:
+                candidate = self.compiled.rule_masks[index]
+                if candidate & mask == candidate and clause_counts.get(candidate):
+                    candidates.add(candidate)
+        return list(candidates)
+
+    def analyze(self):
+        start_time = time.perf_counter()
+        rules = self.compiled.rules
+        masks = self.compiled.rule_masks
+        removed = set()
+        report = {"rule_count": len(rules), "duplicates": [], "orphaned": [], "impossible": []}
+
+        # 成立し得ないルール（すべての AND 節が成立しない）
+        dead_clauses = set()
+        for rule_index, clauses in enumerate(self.clauses_by_rule):
+            reasons = []
+            for index in clauses:
+                reason = self._dead_clause_reason(masks[index])
+                if reason is not None:
+                    dead_clauses.add(index)
+                    reasons.append(reason)
+            if clauses and len(reasons) == len(clauses):
+                missing = sorted({item for kind, items in reasons if kind == "orphaned" for item in items})
+                if missing:
+                    report["orphaned"].append({"rule": rules[rule_index], "missing_items": missing})
+                else:
+                    report["impossible"].append({"rule": rules[rule_index]})
+                removed.add(rule_index)
+
+        # 重複: 成立し得る AND 節の集合が同じルール
+        first_by_key = {}
+        for rule_index, clauses in enumerate(self.clauses_by_rule):
+            if rule_index in removed:
+                continue
+            key = frozenset(masks[index] for index in clauses if index not in dead_clauses)
+            if key in first_by_key:
+                report["duplicates"].append({"rule": rules[rule_index], "duplicate_of": rules[first_by_key[key]]})
+                removed.add(rule_index)
+            else:
+                first_by_key[key] = rule_index
+
+        # 包含: 残っている他のルールの AND 節だけで同じシナリオが除外されるルール。
+        # 大きい（条件の厳しい）ルールから順に取り除き、取り除いたルールは以後の判定に使わない
+        clause_counts = {}
+        rules_by_clause = {}
+        for rule_index, clauses in enumerate(self.clauses_by_rule):
+            if rule_index not in removed:
+                for index in clauses:
+                    if index not in dead_clauses:
+                        clause_counts[masks[index]] = clause_counts.get(masks[index], 0) + 1
+                        rules_by_clause.setdefault(masks[index], []).append(rule_index)
+
+        order = sorted((rule_index for rule_index in range(len(rules)) if rule_index not in removed),
+                       key=lambda rule_index: (-sum(bin(masks[index]).count("1")
+                                                    for index in self.clauses_by_rule[rule_index]), -rule_index))
+        subsumed = []
+        for rule_index in order:
+            own = [masks[index] for index in self.clauses_by_rule[rule_index] if index not in dead_clauses]
+            for mask in own:
+                clause_counts[mask] -= 1
+            covering = []
+            for mask in own:
+                found = self._covering_clauses(mask, clause_counts)
+                if not found:
+                    break
+                covering.extend(found)
+            else:
+                if own:
+                    covered_by = sorted({other for mask in covering for other in rules_by_clause[mask]
+                                         if other not in removed and other != rule_index})
+                    subsumed.append((rule_index, [rules[other] for other in covered_by]))
+                    removed.add(rule_index)
+                    continue
+            for mask in own:
+                clause_counts[mask] += 1
+
+        report["subsumed"] = [{"rule": rules[rule_index], "subsumed_by": covered_by}
+                              for rule_index, covered_by in sorted(subsumed)]
+        report["minimized_rules"] = [rule for rule_index, rule in enumerate(rules) if rule_index not in removed]
+        report["unreachable_items"] = self.unreachable_items()
+        report["seconds"] = time.perf_counter() - start_time
+        return report
+
+    def unreachable_items(self):
+        # 各項目について、その項目を含む有効なシナリオを1つ探す。見つかったシナリオに含まれる
+        # 項目はすべて到達可能なので、探索は到達可能性が未確定の項目についてだけ行う。
+        # ルールは全体の選択に対して一度だけ各段に変換し、項目ごとにはその段を差し替えて辿る
+        # （ルールはビットマスクで判定するので、段の順序を入れ替えても結果は変わらない）
+        if self.category_manager is None:
+            return []
+        categories = self.category_manager.categories
+        selected = {category: {subcategory: list(items)
+                               for subcategory, items in categories.get(category, {}).items() if items}
+                    for category in SCENARIO_CATEGORIES}
+        scenario_generator = ScenarioGenerator(self.category_manager, self.exclusion_rules_manager)
+        item_lists, _ = scenario_generator._scenario_item_lists(selected)
+        slots = [(category, subcategory) for category in SCENARIO_CATEGORIES for subcategory in selected[category]]
+        levels = scenario_generator._compile_levels(item_lists,
+                                                    value_lists=[range(len(items)) for items in item_lists])
+
+        reachable = set()
+        unreachable = []
+        for slot, items in enumerate(item_lists):
+            for position, item in enumerate(items):
+                if (slot, position) in reachable:
+                    continue
+                # 固定した項目を先頭の段にすると、その項目と両立しない項目が浅い段で打ち切られる
+                order = [slot] + [other for other in range(len(levels)) if other != slot]
+                fixed_levels = [[levels[slot][position]]] + [levels[other] for other in order[1:]]
+                found = next(scenario_generator._iter_levels(fixed_levels), None)
+                if found is None:
+                    category, subcategory = slots[slot]
+                    unreachable.append({"category": category, "subcategory": subcategory, "item": item})
+                    continue
+                reachable.update(zip(order, found))
+        return unreachable
@@ -0,0 +1,324 @@
+import itertools
+
+MAX_CONJUNCTIONS = 10000  # 1つのルールを展開したときの AND 節の上限
+
+# ルール式の表現（JSON形式のバージョン 2.0 でもこの形で保存する）:
+#   {"item": "高速道路"}                          項目を含む
+#   {"item": "高速", "subcategory": "速度"}        指定したサブカテゴリでその項目が選ばれている
+#   {"subcategory": "場所", "in": ["駐車場", "市街地"]}  サブカテゴリの項目がいずれかである
+#   {"and": [...]}, {"or": [...]}, {"not": {...}}
+# テキスト形式では次のように書ける:
+#   高速道路 AND (停止 OR 駐車)
+#   速度 = 高速 AND 場所 ∈ {駐車場, 市街地}
+#   NOT 晴れ AND 高速道路
+# 「*」は AND と同じ意味なので、従来の「高速道路 * 停止」もそのまま解釈できる
+# NOT は「そのサブカテゴリが選択されていない」場合も成立する（項目がない = 含まない）
+
+_KEYWORDS = {"AND": "and", "OR": "or", "NOT": "not", "IN": "in"}
+_SYMBOLS = {"(": "(", ")": ")", "{": "{", "}": "}", ",": ",", "=": "=", "∈": "in", "*": "and", "&": "and",
+            "|": "or", "!": "not"}
+
+
+def _tokenize(text):
+    tokens = []
+    position = 0
+    while position < len(text):
+        char = text[position]
+        if char.isspace():
+            position += 1
+        elif char in _SYMBOLS:
+            tokens.append((_SYMBOLS[char], char))
+            position += 1
+        elif char == '"':
+            end = text.find('"', position + 1)
+            if end < 0:
+                raise ValueError(f"引用符が閉じられていません: {text}")
+            tokens.append(("name", text[position + 1:end]))
+            position = end + 1
+        else:
+            start = position
+            while position < len(text) and not text[position].isspace() \
+                    and text[position] not in _SYMBOLS and text[position] != '"':
+                position += 1
+            word = text[start:position]
+            if word.upper() in _KEYWORDS:
+                tokens.append((_KEYWORDS[word.upper()], word))
+            else:
+                tokens.append(("name", word))
+    return tokens
+
+
+class _Parser:
+    def __init__(self, text):
+        self.text = text
+        self.tokens = _tokenize(text)
+        self.position = 0
+
+    def peek(self):
+        if self.position < len(self.tokens):
+            return self.tokens[self.position][0]
+        return None
+
+    def take(self, kind):
+        if self.peek() != kind:
+            found = self.tokens[self.position][1] if self.position < len(self.tokens) else "（末尾）"
+            raise ValueError(f"ルール式を解析できません（{found} の位置）: {self.text}")
+        token = self.tokens[self.position]
+        self.position += 1
+        return token[1]
+
+    def parse(self):
+        if not self.tokens:
+            raise ValueError("ルール式が空です。")
+        node = self.parse_or()
+        if self.peek() is not None:
+            raise ValueError(f"ルール式を解析できません（{self.tokens[self.position][1]} の位置）: {self.text}")
+        return node
+
+    def parse_or(self):
+        nodes = [self.parse_and()]
+        while self.peek() == "or":
+            self.take("or")
+            nodes.append(self.parse_and())
+        return nodes[0] if len(nodes) == 1 else {"or": nodes}
+
+    def parse_and(self):
+        nodes = [self.parse_not()]
+        while self.peek() == "and":
+            self.take("and")
+            nodes.append(self.parse_not())
+        return nodes[0] if len(nodes) == 1 else {"and": nodes}
+
+    def parse_not(self):
+        if self.peek() == "not":
+            self.take("not")
+            return {"not": self.parse_not()}
+        return self.parse_atom()
+
+    def parse_atom(self):
+        if self.peek() == "(":
+            self.take("(")
+            node = self.parse_or()
+            self.take(")")
+            return node
+        name = self.take("name")
+        if self.peek() == "=":
+            self.take("=")
+            return {"item": self.take("name"), "subcategory": name}
+        if self.peek() == "in":
+            self.take("in")
+            self.take("{")
+            items = [self.take("name")]
+            while self.peek() == ",":
+                self.take(",")
+                items.append(self.take("name"))
+            self.take("}")
+            return {"subcategory": name, "in": items}
+        return {"item": name}
+
+
+def parse_expression(text):
+    return _Parser(text).parse()
+
+
+def validate_expression(node):
+    if not isinstance(node, dict):
+        raise ValueError(f"ルール式の形式が正しくありません: {node!r}")
+    if "and" in node or "or" in node:
+        children = node.get("and", node.get("or"))
+        if not isinstance(children, list) or not children:
+            raise ValueError(f"AND / OR には1つ以上の式が必要です: {node!r}")
+        for child in children:
+            validate_expression(child)
+    elif "not" in node:
+        validate_expression(node["not"])
+    elif "in" in node:
+        if not isinstance(node.get("subcategory"), str) or not isinstance(node["in"], list) or not node["in"]:
+            raise ValueError(f"サブカテゴリの条件が正しくありません: {node!r}")
+    elif not isinstance(node.get("item"), str):
+        raise ValueError(f"ルール式の形式が正しくありません: {node!r}")
+    return node
+
+
+def _format_name(name):
+    if not name or any(char.isspace() or char in _SYMBOLS or char == '"' for char in name) \
+            or name.upper() in _KEYWORDS:
+        return f'"{name}"'
+    return name
+
+
+def format_expression(node, parent=None):
+    # ルール式をテキスト形式に変換する（ルールの表示名として使う）
+    if "and" in node or "or" in node:
+        operator = "and" if "and" in node else "or"
+        text = f" {operator.upper()} ".join(format_expression(child, operator) for child in node[operator])
+        return f"({text})" if parent is not None and parent != operator else text
+    if "not" in node:
+        return f"NOT {format_expression(node['not'], 'not')}"
+    if "in" in node:
+        items = ", ".join(_format_name(item) for item in node["in"])
+        return f"{_format_name(node['subcategory'])} ∈ {{{items}}}"
+    if node.get("subcategory"):
+        return f"{_format_name(node['subcategory'])} = {_format_name(node['item'])}"
+    return _format_name(node["item"])
+
+
+def expression_items(node):
+    # ルール式の中で参照されている項目の集合
+    if "and" in node or "or" in node:
+        return set().union(*(expression_items(child) for child in node.get("and", node.get("or"))))
+    if "not" in node:
+        return expression_items(node["not"])
+    if "in" in node:
+        return set(node["in"])
+    return {node["item"]}
+
+
+def absent_item(key):
+    # 「サブカテゴリが選択されていない」ことを表す仮の項目名。NOT の展開に使い、
+    # 判定時には CompiledRules がシナリオや選択に合わせて補う
+    return f"（{key[0]}/{key[1]} なし）"
+
+
+def needs_categories(node):
+    # NOT やサブカテゴリ指定を含む式は、展開にカテゴリ情報が必要になる
+    if "and" in node or "or" in node:
+        return any(needs_categories(child) for child in node.get("and", node.get("or")))
+    return "not" in node or "subcategory" in node
+
+
+class RuleCompiler:
+    # ルール式を、項目の AND 節の並び（選言標準形）に展開する。展開後の各節は従来の
+    # 「項目1 * 項目2 * ...」形式のルールと同じ扱いになり、ビットマスクでまとめて評価される。
+    # 各サブカテゴリからは1つの項目だけが選ばれるので、NOT は同じサブカテゴリの他の項目の OR に、
+    # サブカテゴリ指定はその項目名に置き換える（項目名がサブカテゴリ間で重複しない前提）。
+    # サブカテゴリが選択されていなければ NOT は成立するので、その場合を表す仮の項目（absent_item）も OR に加える。
+    # 「その他」のように複数のカテゴリにある名前は「環境状況/その他」と書けば区別できる
+    def __init__(self, categories=None):
+        self.subcategory_items = {}  # (カテゴリ, サブカテゴリ) -> 項目のリスト
+        self.subcategories_by_item = {}
+        self.absent_items = {}  # 展開で使った仮の項目 -> (カテゴリ, サブカテゴリ)
+        for category, subcategories in (categories or {}).items():
+            for subcategory, items in subcategories.items():
+                key = (category, subcategory)
+                self.subcategory_items[key] = list(dict.fromkeys(items))
+                for item in self.subcategory_items[key]:
+                    self.subcategories_by_item.setdefault(item, []).append(key)
+        self.has_categories = categories is not None
+
+    def _require_categories(self, node):
+        if not self.has_categories:
+            raise ValueError(f"NOT やサブカテゴリ指定を含むルールにはカテゴリ情報が必要です: "
+                             f"{format_expression(node)}")
+
+    def _subcategory_keys(self, subcategory):
+        keys = [key for key in self.subcategory_items
+                if subcategory == key[1] or subcategory == f"{key[0]}/{key[1]}"]
+        if not keys:
+            raise ValueError(f"サブカテゴリ '{subcategory}' は存在しません。")
+        return keys
+
+    def _subcategory_choices(self, keys, items, negated):
+        # 肯定: いずれかのサブカテゴリで items のどれかが選ばれている
+        # 否定: すべてのサブカテゴリで items 以外が選ばれているか、そのサブカテゴリが選択されていない
+        if not negated:
+            result = [[item] for item in dict.fromkeys(item for key in keys for item in self.subcategory_items[key])
+                      if item in items]
+            self._check_unambiguous(keys, result)
+            return result
+
+        result = [[]]
+        for key in keys:
+            absent = absent_item(key)
+            self.absent_items[absent] = key
+            result = self._and(result, [[item] for item in self.subcategory_items[key] if item not in items]
+                               + [[absent]])
+        # 選択されていないかどうかはサブカテゴリの項目の有無で判定するので、否定する項目も含めて
+        # keys のサブカテゴリのすべての項目が他のサブカテゴリの項目と区別できる必要がある
+        self._check_unambiguous(keys, [[item for key in keys for item in self.subcategory_items[key]]])
+        return result
+
+    def _check_unambiguous(self, keys, conjunctions):
+        # 展開後の節は項目名だけで判定されるため、keys 以外のサブカテゴリにも同じ名前の項目があると
+        # 指定していないサブカテゴリの項目にも一致してしまう。その場合は展開せずエラーにする
+        keys = set(keys)
+        for item in dict.fromkeys(item for conjunction in conjunctions for item in conjunction):
+            others = [key for key in self.subcategories_by_item.get(item, []) if key not in keys]
+            if others:
+                raise ValueError(f"項目 '{item}' は他のサブカテゴリ（"
+                                 f"{', '.join('/'.join(key) for key in others)}）にもあるため、"
+                                 f"サブカテゴリを限定した条件や NOT を使うルールでは区別できません。")
+
+    def _leaf(self, node, negated):
+        if "in" in node:
+            self._require_categories(node)
+            return self._subcategory_choices(self._subcategory_keys(node["subcategory"]), node["in"], negated)
+        if node.get("subcategory"):
+            self._require_categories(node)
+            return self._subcategory_choices(self._subcategory_keys(node["subcategory"]), [node["item"]], negated)
+        if not negated:
+            return [[node["item"]]]
+
+        # 項目を含まない = その項目があるすべてのサブカテゴリで他の項目が選ばれている
+        self._require_categories(node)
+        return self._subcategory_choices(self.subcategories_by_item.get(node["item"], []), [node["item"]], True)
+
+    def _and(self, left, right):
+        result = [a + b for a, b in itertools.product(left, right)]
+        if len(result) > MAX_CONJUNCTIONS:
+            raise ValueError(f"ルールの展開結果が大きすぎます（{len(result)} 節）。")
+        return result
+
+    def _expand(self, node, negated=False):
+        # NOT はド・モルガンの法則で葉まで押し下げる
+        if "not" in node:
+            return self._expand(node["not"], not negated)
+        if "and" in node or "or" in node:
+            operator = "and" if "and" in node else "or"
+            if negated:
+                operator = "or" if operator == "and" else "and"
+            parts = [self._expand(child, negated) for child in node.get("and", node.get("or"))]
+            if operator == "or":
+                return [conjunction for part in parts for conjunction in part]
+            result = parts[0]
+            for part in parts[1:]:
+                result = self._and(result, part)
+            return result
+        return self._leaf(node, negated)
+
+    def _is_possible(self, items):
+        # 1つのサブカテゴリにしかない項目が同じサブカテゴリから2つ要求される節は成立しない
+        if not self.has_categories:
+            return True
+        used = set()
+        for item in items:
+            subcategories = self.subcategories_by_item.get(item, [])
+            if item in self.absent_items:
+                subcategories = [self.absent_items[item]]
+            if len(subcategories) == 1:
+                if subcategories[0] in used:
+                    return False
+                used.add(subcategories[0])
+        return True
+
+    def compile(self, node):
+        # 項目のタプルのリストを返す。他の節を含む（より条件の厳しい）節は取り除く
+        conjunctions = []
+        for conjunction in self._expand(node):
+            items = tuple(dict.fromkeys(conjunction))
+            if self._is_possible(items):
+                conjunctions.append(items)
+        conjunctions.sort(key=len)
+        result = []
+        seen = set()
+        for items in conjunctions:
+            item_set = frozenset(items)
+            if any(frozenset(subset) in seen
+                   for size in range(1, len(items) + 1)
+                   for subset in itertools.combinations(items, size)):
+                continue
+            seen.add(item_set)
+            result.append(items)
+        if () in result:
+            raise ValueError(f"このルールはすべてのシナリオを除外します: {format_expression(node)}")
+        return result
@@ -0,0 +1,125 @@
+from array import array
+
+SCENARIO_CATEGORIES = ("環境状況", "車両状況")
+
+class ScenarioLayout:
+    # シナリオの並び（環境状況のサブカテゴリ数）と項目IDの対応表。同じ選択から作られた
+    # シナリオはすべてこのオブジェクトを共有する
+    __slots__ = ("item_names", "env_count")
+
+    def __init__(self, item_names, env_count):
+        self.item_names = item_names
+        self.env_count = env_count
+
+
+class Scenario:
+    # サブカテゴリごとに項目IDを1つだけ持つ軽量なシナリオ。
+    # 従来の {"環境状況": (...), "車両状況": (...)} と同じように参照できる
+    __slots__ = ("layout", "ids")
+
+    def __init__(self, layout, ids):
+        self.layout = layout
+        self.ids = ids
+
+    def __getitem__(self, category):
+        names = self.layout.item_names
+        env_count = self.layout.env_count
+        if category == "環境状況":
+            return tuple(names[item_id] for item_id in self.ids[:env_count])
+        if category == "車両状況":
+            return tuple(names[item_id] for item_id in self.ids[env_count:])
+        raise KeyError(category)
+
+    def get(self, category, default=None):
+        try:
+            return self[category]
+        except KeyError:
+            return default
+
+    def keys(self):
+        return SCENARIO_CATEGORIES
+
+    def values(self):
+        return [self[category] for category in SCENARIO_CATEGORIES]
+
+    def items(self):
+        return [(category, self[category]) for category in SCENARIO_CATEGORIES]
+
+    def __iter__(self):
+        return iter(SCENARIO_CATEGORIES)
+
+    def __len__(self):
+        return len(SCENARIO_CATEGORIES)
+
+    def __contains__(self, category):
+        return category in SCENARIO_CATEGORIES
+
+    def to_dict(self):
+        return dict(self.items())
+
+    def __eq__(self, other):
+        if isinstance(other, Scenario):
+            if other.layout.item_names is self.layout.item_names:
+                return self.ids == other.ids and self.layout.env_count == other.layout.env_count
+            return self.to_dict() == other.to_dict()
+        if isinstance(other, dict):
+            return self.to_dict() == other
+        return NotImplemented
+
+    def __hash__(self):
+        # 等価判定は対応表が異なる場合も項目名で行うので、ハッシュも項目IDではなく項目名から求める
+        names = self.layout.item_names
+        return hash((self.layout.env_count, tuple(names[item_id] for item_id in self.ids)))
+
+    def __repr__(self):
+        return f"Scenario({self.to_dict()!r})"
+
+
+class ScenarioBatch:
+    # 列指向のシナリオ集合。サブカテゴリごとに項目IDを配列で保持するため、
+    # 1シナリオあたり数バイト（サブカテゴリ数 × 2 バイト程度）で済む
+    def __init__(self, layout, column_count, typecode='H'):
+        self.layout = layout
+        self.columns = [array(typecode) for _ in range(column_count)]
+        self.length = 0
+
+    def append(self, ids):
+        for column, item_id in zip(self.columns, ids):
+            column.append(item_id)
+        self.length += 1
+
+    def extend(self, rows):
+        # 行を列に並べ替えてまとめて追加する（ループは zip と array.extend の中で回る）
+        rows = list(rows)
+        for column, ids in zip(self.columns, zip(*rows)):
+            column.extend(ids)
+        self.length += len(rows)
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, position):
+        if position < 0:
+            position += len(self)
+        if not 0 <= position < len(self):
+            raise IndexError(position)
+        return Scenario(self.layout, tuple(column[position] for column in self.columns))
+
+    def __iter__(self):
+        layout = self.layout
+        if not self.columns:
+            for _ in range(self.length):
+                yield Scenario(layout, ())
+            return
+        for ids in zip(*self.columns):
+            yield Scenario(layout, ids)
+
+    def rows(self):
+        # 項目名のタプルとして1件ずつ返す（出力用）
+        if not self.columns:
+            return iter([()] * self.length)
+        names = self.layout.item_names
+        return zip(*(map(names.__getitem__, column) for column in self.columns))
+
+    def nbytes(self):
+        return sum(column.itemsize * len(column) for column in self.columns)
@@ -0,0 +1,198 @@
+from .category_manager import CategoryManager
+from .exclusion_rules import CompiledRules, ExclusionRulesManager
+from .scenario import SCENARIO_CATEGORIES
+from .scenario_generator import ScenarioGenerator
+
+# 2つの版（カテゴリ・ルール・選択の組）の間で、有効なシナリオの集合がどう変わったかを求める。
+#   added:          新しい版で増えた項目を含む、新しい版で有効なシナリオ
+#   removed:        古い版にしかない項目を含む、古い版で有効だったシナリオ
+#   newly_excluded: 両方の版にある項目だけからなり、ルールの変更で除外されるようになったシナリオ
+#   newly_allowed:  両方の版にある項目だけからなり、ルールの変更で除外されなくなったシナリオ
+# 件数は直積を列挙せずに計数の動的計画法で求め、シナリオの列挙は変更された項目を含む部分直積と、
+# 追加・削除された AND 節を含むシナリオだけを辿るので、手間は直積全体ではなく変更の大きさで決まる
+CHANGE_KINDS = ("removed", "newly_excluded", "newly_allowed", "added")
+
+class _FixedRules:
+    # 指定した AND 節だけからなるルール集合。ScenarioGenerator の探索と計数に渡す
+    def __init__(self, conjunctions):
+        conjunctions = list(conjunctions)
+        self.compiled = CompiledRules([" * ".join(items) for items in conjunctions],
+                                      [[list(items)] for items in conjunctions])
+
+    def compile(self):
+        return self.compiled
+
+
+class ScenarioSnapshot:
+    # 比較する版のカテゴリ・ルール・選択。selected を省略した場合はすべての項目を選択する
+    def __init__(self, category_manager, exclusion_rules_manager, selected=None):
+        self.category_manager = category_manager
+        self.exclusion_rules_manager = exclusion_rules_manager
+        if selected is None:
+            selected = {category: {subcategory: list(items)
+                                   for subcategory, items in category_manager.categories.get(category, {}).items()
+                                   if items}
+                        for category in SCENARIO_CATEGORIES}
+        self.selected = selected
+        self.slots = [(category, subcategory) for category in SCENARIO_CATEGORIES
+                      for subcategory in selected.get(category, {}) if selected[category][subcategory]]
+        self.items_by_slot = {slot: list(selected[slot[0]][slot[1]]) for slot in self.slots}
+
+        # ルールは展開後の AND 節（項目の集合）で比較する。項目の順序やルールの書き方が違っても同じ扱いになる。
+        # NOT を含むルールは、この版の選択に合わせて展開したものを使う
+        compiled = exclusion_rules_manager.compile().for_item_lists([self.items_by_slot[slot] for slot in self.slots])
+        self.rules = list(compiled.rules)
+        self.conjunctions = {}
+        for conjunction in compiled.conjunctions:
+            items = tuple(conjunction.split(" * "))
+            self.conjunctions.setdefault(frozenset(items), items)
+
+    @classmethod
+    def from_files(cls, category_file, rule_file=None, selected=None):
+        category_manager = CategoryManager.from_file(category_file)
+        exclusion_rules_manager = ExclusionRulesManager(category_manager)
+        if rule_file:
+            exclusion_rules_manager.load_rules_from(rule_file)
+        return cls(category_manager, exclusion_rules_manager, selected)
+
+
+class ScenarioDiff:
+    def __init__(self, old, new):
+        self.old = old
+        self.new = new
+        # 変更されたシナリオの各列に対応するサブカテゴリ（新しい版の並び、古い版にしかないものは末尾）
+        self.slots = list(new.slots) + [slot for slot in old.slots if slot not in new.slots]
+        self.same_slots = set(old.slots) == set(new.slots)
+
+        self.added_conjunctions = [items for key, items in new.conjunctions.items() if key not in old.conjunctions]
+        self.removed_conjunctions = [items for key, items in old.conjunctions.items() if key not in new.conjunctions]
+        self.old_generator = self._generator(old, old.conjunctions.values())
+        self.new_generator = self._generator(new, new.conjunctions.values())
+
+        if self.same_slots:
+            # 古い版の項目も新しい版のサブカテゴリの並びにそろえる
+            self.old_lists = [old.items_by_slot[slot] for slot in new.slots]
+            self.new_lists = [new.items_by_slot[slot] for slot in new.slots]
+            self.common_lists = []
+            for old_items, new_items in zip(self.old_lists, self.new_lists):
+                old_set = set(old_items)
+                self.common_lists.append([item for item in new_items if item in old_set])
+        else:
+            self.old_lists = [old.items_by_slot[slot] for slot in old.slots]
+            self.new_lists = [new.items_by_slot[slot] for slot in new.slots]
+            self.common_lists = None
+
+    def _generator(self, snapshot, conjunctions):
+        return ScenarioGenerator(snapshot.category_manager, _FixedRules(conjunctions))
+
+    def _count_valid(self, scenario_generator, item_lists):
+        compiled = scenario_generator.exclusion_rules_manager.compile()
+        return scenario_generator._count_valid(item_lists, compiled, compiled.rule_masks)
+
+    def _changed_items(self, lists):
+        changed = []
+        for slot, items, common in zip(self.new.slots, lists, self.common_lists):
+            common_set = set(common)
+            changed.extend({"category": slot[0], "subcategory": slot[1], "item": item}
+                           for item in items if item not in common_set)
+        return changed
+
+    def summary(self):
+        old_valid = self._count_valid(self.old_generator, self.old_lists)
+        new_valid = self._count_valid(self.new_generator, self.new_lists)
+        old_rules = set(self.old.rules)
+        new_rules = set(self.new.rules)
+        summary = {
+            "old": {"total": self.old_generator._product_size(self.old_lists), "valid": old_valid},
+            "new": {"total": self.new_generator._product_size(self.new_lists), "valid": new_valid},
+            "added_rules": [rule for rule in self.new.rules if rule not in old_rules],
+            "removed_rules": [rule for rule in self.old.rules if rule not in new_rules],
+            "added_conjunctions": [" * ".join(items) for items in self.added_conjunctions],
+            "removed_conjunctions": [" * ".join(items) for items in self.removed_conjunctions],
+            "added_slots": [list(slot) for slot in self.new.slots if slot not in self.old.slots],
+            "removed_slots": [list(slot) for slot in self.old.slots if slot not in self.new.slots]
+        }
+        if not self.same_slots:
+            # サブカテゴリの構成が変わった場合、同じシナリオは存在しない
+            summary.update(added=new_valid, removed=old_valid, newly_excluded=0, newly_allowed=0,
+                           added_items=[], removed_items=[])
+            return summary
+
+        both_generator = self._generator(self.new, list(self.old.conjunctions.values()) + self.added_conjunctions)
+        common_old_valid = self._count_valid(self.old_generator, self.common_lists)
+        common_new_valid = self._count_valid(self.new_generator, self.common_lists)
+        common_both_valid = self._count_valid(both_generator, self.common_lists)
+        summary.update(
+            added=new_valid - common_new_valid,
+            removed=old_valid - common_old_valid,
+            newly_excluded=common_old_valid - common_both_valid,
+            newly_allowed=common_new_valid - common_both_valid,
+            added_items=self._changed_items(self.new_lists),
+            removed_items=self._changed_items(self.old_lists)
+        )
+        return summary
+
+    def iter_changes(self):
+        # (変更の種類, slots の並びの項目のタプル) を順に返す。その版にないサブカテゴリの列は None
+        if not self.same_slots:
+            positions = [self.slots.index(slot) for slot in self.old.slots]
+            for combination in self.old_generator._iter_pruned(self.old_lists):
+                row = [None] * len(self.slots)
+                for position, item in zip(positions, combination):
+                    row[position] = item
+                yield "removed", tuple(row)
+            padding = (None,) * (len(self.slots) - len(self.new.slots))
+            for combination in self.new_generator._iter_pruned(self.new_lists):
+                yield "added", combination + padding
+            return
+
+        for combination in self._iter_outside_common(self.old_generator, self.old_lists):
+            yield "removed", combination
+        # 追加された AND 節を含み、古いルールで有効だったシナリオ
+        for combination in self._iter_containing(self.old_generator, self.added_conjunctions):
+            yield "newly_excluded", combination
+        # 削除された AND 節を含み、新しいルールで有効なシナリオ
+        for combination in self._iter_containing(self.new_generator, self.removed_conjunctions):
+            yield "newly_allowed", combination
+        for combination in self._iter_outside_common(self.new_generator, self.new_lists):
+            yield "added", combination
+
+    def _iter_outside_common(self, scenario_generator, item_lists):
+        # 共通の項目だけではない（どこかのサブカテゴリで変更された項目を選んだ）有効なシナリオ。
+        # k 番目のサブカテゴリで初めて変更された項目を選ぶ部分直積に分けて辿るので、重複しない
+        for slot, (items, common) in enumerate(zip(item_lists, self.common_lists)):
+            common_set = set(common)
+            changed = [item for item in items if item not in common_set]
+            if not changed:
+                continue
+            block = self.common_lists[:slot] + [changed] + item_lists[slot + 1:]
+            yield from scenario_generator._iter_pruned(block)
+
+    def _iter_containing(self, scenario_generator, conjunctions):
+        # 共通の項目からなり、conjunctions のいずれかの項目をすべて含む有効なシナリオ（重複なし）
+        slots_by_item = {}
+        for slot, items in enumerate(self.common_lists):
+            for item in items:
+                slots_by_item.setdefault(item, []).append(slot)
+        seen = set()
+        for items in conjunctions:
+            if not all(item in slots_by_item for item in items):
+                continue
+            for assignment in self._assignments(items, slots_by_item):
+                block = list(self.common_lists)
+                for item, slot in zip(items, assignment):
+                    block[slot] = [item]
+                for combination in scenario_generator._iter_pruned(block):
+                    if combination not in seen:
+                        seen.add(combination)
+                        yield combination
+
+    def _assignments(self, items, slots_by_item, used=()):
+        # 各項目を異なるサブカテゴリに割り当てる方法（同じ名前の項目が複数のサブカテゴリにある場合に複数になる）
+        if not items:
+            yield ()
+            return
+        for slot in slots_by_item[items[0]]:
+            if slot not in used:
+                for rest in self._assignments(items[1:], slots_by_item, used + (slot,)):
+                    yield (slot,) + rest
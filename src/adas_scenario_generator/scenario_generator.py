@@ -1,39 +1,795 @@
 import itertools
+import random
+from array import array
+from collections import defaultdict, deque
+
+from .covering_array import CoveringArrayBuilder
+from .exclusion_rules import ExclusionRulesManager
+from .instrumentation import instrumentation
+from .scenario import Scenario, ScenarioBatch, ScenarioLayout
+
+MAX_TAIL_PRODUCT = 1 << 20  # 計数で末尾側の直積をビット集合で表す組み合わせ数の上限
+
+# 整数の1のビットの数（int.bit_count がない Python では文字列にして数える）
+_popcount = getattr(int, "bit_count", None) or (lambda value: bin(value).count("1"))
+_NO_EFFECT = (0, frozenset(), 0)  # ルールに現れない項目を選んだときの状態の変化
 
 class ScenarioGenerator:
-    def __init__(self, category_manager, exclusion_rules_manager):
+    def __init__(self, category_manager, exclusion_rules_manager, result_cache=None):
         self.category_manager = category_manager
         self.exclusion_rules_manager = exclusion_rules_manager
+        self.result_cache = result_cache  # ScenarioResultCache（省略時はキャッシュしない）
 
-    def generate_scenarios(self, selected):
-        env_scenarios = list(itertools.product(*(
-            selected["環境状況"][subcategory] 
-            for subcategory in selected["環境状況"] 
-            if selected["環境状況"][subcategory]
-        )))
-        
-        vehicle_scenarios = list(itertools.product(*(
-            selected["車両状況"][subcategory] 
-            for subcategory in selected["車両状況"] 
-            if selected["車両状況"][subcategory]
-        )))
-
-        scenarios = []
-        for env, vehicle in itertools.product(env_scenarios, vehicle_scenarios):
-            scenario = {
-                "環境状況": env,
-                "車両状況": vehicle
-            }
-            scenarios.append(scenario)
+    def _selected_item_lists(self, selected, category):
+        return [
+            selected[category][subcategory]
+            for subcategory in selected[category]
+            if selected[category][subcategory]
+        ]
 
-        return scenarios
+    def _scenario_item_lists(self, selected):
+        env_items = self._selected_item_lists(selected, "環境状況")
+        vehicle_items = self._selected_item_lists(selected, "車両状況")
+        return env_items + vehicle_items, len(env_items)
 
-    def filter_scenarios(self, scenarios):
+    def _compiled_rules(self, item_lists):
+        # 選択に合わせたコンパイル済みルール（NOT の「サブカテゴリが選択されていない」場合を畳み込んだもの）
+        return self.exclusion_rules_manager.compile().for_item_lists(item_lists)
+
+    def _to_scenario(self, combination, env_count):
+        return {
+            "環境状況": combination[:env_count],
+            "車両状況": combination[env_count:]
+        }
+
+    def iter_scenarios(self, selected):
+        # 直積をリスト化せず、1件ずつ生成する
+        env_items = self._selected_item_lists(selected, "環境状況")
+        vehicle_items = self._selected_item_lists(selected, "車両状況")
+
+        for env in itertools.product(*env_items):
+            for vehicle in itertools.product(*vehicle_items):
+                yield {
+                    "環境状況": env,
+                    "車両状況": vehicle
+                }
+
+    def iter_filtered(self, selected, workers=1, backend="python"):
+        if backend == "numpy":
+            yield from self.numpy_engine(selected).iter_filtered()
+            return
+        if backend != "python":
+            raise ValueError(f"サポートされていないバックエンドです: {backend}")
+
+        item_lists, env_count = self._scenario_item_lists(selected)
+
+        if self.result_cache is not None and item_lists:
+            columns, _ = self.cached_results(selected, workers)
+            combinations = _decode_columns(item_lists, columns)
+        elif workers > 1 and item_lists:
+            # ワーカーはサブカテゴリごとの項目の位置の列を返すので、行は C のループで組み立てる
+            combinations = itertools.chain.from_iterable(
+                _decode_columns(item_lists, columns)
+                for columns in self._iter_shards(item_lists, workers, _run_shard_columns))
+        else:
+            combinations = self._iter_pruned(item_lists)
+
+        combinations = instrumentation.iter_stage("enumerate_filtered", combinations,
+                                                  lambda valid: self._count_filtered(item_lists, valid))
+        for combination in combinations:
+            yield self._to_scenario(combination, env_count)
+
+    def _count_filtered(self, item_lists, valid):
+        total = self._product_size(item_lists)
+        instrumentation.count("scenarios_generated", total)
+        instrumentation.count("scenarios_valid", valid)
+        instrumentation.count("scenarios_excluded", total - valid)
+
+    def cached_results(self, selected, workers=1):
+        # 有効なシナリオの各サブカテゴリでの項目の位置の配列（列）と件数（total / valid / excluded）を返す。
+        # 同じ選択・同じ関連ルールの結果がキャッシュにあれば、生成を行わずにそれを使う
+        # キーにはパターンルールを展開した AND 節を使う。件数は列挙の結果から求まり、
+        # ルールごとの除外数は count_scenarios がキャッシュから返せるよう、列挙とあわせて数えて保存する
+        item_lists, env_count = self._scenario_item_lists(selected)
+        compiled = self._compiled_rules(item_lists)
+        key = self.result_cache.make_key(item_lists, env_count, compiled.conjunctions)
+        cached = self.result_cache.load(key)
+        if cached is None:
+            typecode = _position_typecode(item_lists)
+            if workers > 1:
+                columns = [array(typecode) for _ in item_lists]
+                for shard_columns in self._iter_shards(item_lists, workers, _run_shard_columns):
+                    for column, shard_column in zip(columns, shard_columns):
+                        column.extend(shard_column)
+            else:
+                columns = _to_columns(self._iter_pruned_positions(item_lists), len(item_lists), typecode)
+            total = self._product_size(item_lists)
+            valid = len(columns[0]) if columns else total
+            counts = {"total": total, "valid": valid, "excluded": total - valid}
+            per_rule = self._count_per_rule(item_lists, compiled, total)
+            rule_keys = self.result_cache.rule_keys(item_lists, compiled)
+            self.result_cache.store(key, columns, counts,
+                                    {rule_key: per_rule[rule] for rule, rule_key in zip(compiled.rules, rule_keys)})
+            cached = (columns, counts)
+        return cached
+
+    def iter_compact(self, selected):
+        # 有効なシナリオを、項目IDだけを持つ Scenario として1件ずつ返す
+        item_lists, env_count = self._scenario_item_lists(selected)
+        layout = ScenarioLayout(self.category_manager.item_names, env_count)
+        id_lists = [[self.category_manager.intern_item(item) for item in items] for items in item_lists]
+        for ids in self._iter_pruned(item_lists, value_lists=id_lists):
+            yield Scenario(layout, ids)
+
+    def generate_batch(self, selected):
+        # 有効なシナリオを列指向の ScenarioBatch にまとめて返す
+        (batch,) = self.iter_batches(selected, batch_size=None)
+        return batch
+
+    def iter_batches(self, selected, batch_size=65536):
+        # 有効なシナリオを batch_size 件ずつの ScenarioBatch として返す（出力用）。
+        # batch_size が None の場合は全件を1つにまとめる（有効なシナリオがなくても空の1つを返す）
+        item_lists, env_count = self._scenario_item_lists(selected)
+        id_lists = [[self.category_manager.intern_item(item) for item in items] for items in item_lists]
+        layout = ScenarioLayout(self.category_manager.item_names, env_count)
+        typecode = 'H' if len(self.category_manager.item_names) <= 0xFFFF else 'I'
+        ids = instrumentation.iter_stage("enumerate_filtered", self._iter_pruned(item_lists, value_lists=id_lists),
+                                         lambda valid: self._count_filtered(item_lists, valid))
+        while True:
+            batch = ScenarioBatch(layout, len(item_lists), typecode)
+            batch.extend(itertools.islice(ids, batch_size))
+            if batch or batch_size is None:
+                yield batch
+            if len(batch) != batch_size:
+                return
+
+    def numpy_engine(self, selected, chunk_size=65536):
+        from .numpy_backend import NumpyScenarioEngine  # numpy の読み込みは実際に使うときまで遅らせる
+
+        return NumpyScenarioEngine(self, selected, chunk_size)
+
+    def iter_filtered_indices(self, selected, workers=1):
+        item_lists, env_count = self._scenario_item_lists(selected)
+        if workers > 1:
+            indices = self._iter_pruned_parallel(item_lists, workers)
+        else:
+            indices = self._iter_pruned(item_lists, as_index=True)
+        return instrumentation.iter_stage("enumerate_filtered", indices,
+                                          lambda valid: self._count_filtered(item_lists, valid))
+
+    def _shard_prefixes(self, item_lists, workers):
+        # 先頭のサブカテゴリから順に、シャード数がワーカー数の4倍以上になるまで分割する。
+        # 各シャードは直積上の連続した通し番号の範囲に対応する
+        depth = 0
+        shard_count = 1
+        while depth < len(item_lists) and shard_count < workers * 4:
+            shard_count *= len(item_lists[depth])
+            depth += 1
+        return itertools.product(*(range(len(items)) for items in item_lists[:depth]))
+
+    def _iter_pruned_parallel(self, item_lists, workers):
+        for indices in self._iter_shards(item_lists, workers, _run_shard):
+            yield from indices
+
+    def _iter_shards(self, item_lists, workers, run_shard):
+        # シャードをプロセスプールで並列に処理し、各シャードの結果（run_shard の戻り値）を
+        # 直積の順序どおりに返す。コンパイル済みルールはワーカーごとに一度だけ初期化時に渡す
+        from concurrent.futures import ProcessPoolExecutor
+
+        shards = self._shard_prefixes(item_lists, workers)
+        executor = ProcessPoolExecutor(max_workers=workers, initializer=_init_shard_worker,
+                                       initargs=(list(self._compiled_rules(item_lists).conjunctions), item_lists))
+        try:
+            pending = deque(executor.submit(run_shard, prefix)
+                            for prefix in itertools.islice(shards, workers * 2))
+            while pending:
+                result = pending.popleft().result()
+                for prefix in itertools.islice(shards, 1):
+                    pending.append(executor.submit(run_shard, prefix))
+                yield result
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+    def _compile_levels(self, item_lists, as_index=False, value_lists=None):
+        # 各項目を (返す値, ビット, 判定するルール) に変換する。返す値は通常は項目名で、
+        # as_index=True なら通し番号への寄与分、value_lists を渡した場合はその値
+        compiled = self._compiled_rules(item_lists)
+        available_mask = 0
+        for items in item_lists:
+            available_mask |= compiled.items_mask(items)
+        if as_index:
+            value_lists = [[position * weight for position in range(len(items))]
+                           for items, weight in zip(item_lists, self._radix_weights(item_lists))]
+        elif value_lists is None:
+            value_lists = item_lists
         return [
-            scenario for scenario in scenarios 
-            if not self.exclusion_rules_manager.is_excluded(scenario)
+            [(value, compiled.item_bit(item),
+              instrumentation.wrap_rule_masks(compiled, compiled.rule_masks_for(item, available_mask)))
+             for item, value in zip(items, values)]
+            for items, values in zip(item_lists, value_lists)
         ]
 
-    def generate_and_filter_scenarios(self, selected):
-        scenarios = self.generate_scenarios(selected)
-        return self.filter_scenarios(scenarios)
\ No newline at end of file
+    def _iter_pruned_positions(self, item_lists, prefix=()):
+        # 有効な組み合わせを、各サブカテゴリでの項目の位置のタプルとして返す
+        return self._iter_pruned(item_lists, prefix=prefix,
+                                 value_lists=[range(len(items)) for items in item_lists])
+
+    def _radix_weights(self, item_lists):
+        # 直積の通し番号を混合基数で表したときの各サブカテゴリの重み（最後が最下位）
+        weights = []
+        weight = 1
+        for items in reversed(item_lists):
+            weights.append(weight)
+            weight *= len(items)
+        weights.reverse()
+        return weights
+
+    def _decode_index(self, item_lists, index, weights=None):
+        if weights is None:
+            weights = self._radix_weights(item_lists)
+        combination = []
+        for items, weight in zip(item_lists, weights):
+            position, index = divmod(index, weight)
+            combination.append(items[position])
+        return tuple(combination)
+
+    def _iter_pruned(self, item_lists, as_index=False, prefix=(), value_lists=None):
+        # サブカテゴリ順に深さ優先で直積を辿り、選択済みの項目だけで
+        # 成立する除外ルールが現れた時点でその部分木を丸ごと打ち切る。
+        # as_index=True の場合は組み合わせの代わりに直積上の通し番号を返す。
+        # prefix を指定すると、先頭のサブカテゴリをその位置の項目に固定して辿る
+        if not item_lists:
+            yield 0 if as_index else ()
+            return
+
+        levels = self._compile_levels(item_lists, as_index, value_lists)
+        for depth, position in enumerate(prefix):
+            levels[depth] = [levels[depth][position]]
+        yield from self._iter_levels(levels, as_index)
+
+    def _iter_levels(self, levels, as_index=False):
+        # _compile_levels で変換済みの各段を辿り、有効な組み合わせの値を返す。
+        # 段を差し替えれば、コンパイルし直さずに一部のサブカテゴリを固定して辿れる
+        depth = len(levels)
+        chosen = []
+        masks = [0]
+        stack = [iter(levels[0])]
+
+        while stack:
+            mask = masks[-1]
+            is_leaf = len(stack) == depth
+            for item, bit, rule_masks in stack[-1]:
+                item_mask = mask | bit
+                if rule_masks and any(rule_mask & item_mask == rule_mask for rule_mask in rule_masks):
+                    continue
+                if is_leaf:
+                    yield sum(chosen) + item if as_index else tuple(chosen) + (item,)
+                else:
+                    chosen.append(item)
+                    masks.append(item_mask)
+                    stack.append(iter(levels[len(stack)]))
+                    break
+            else:
+                stack.pop()
+                masks.pop()
+                if chosen:
+                    chosen.pop()
+
+    def count_scenarios(self, selected, per_rule=True):
+        with instrumentation.stage("count_scenarios"):
+            return self._count_scenarios(selected, per_rule)
+
+    def _count_scenarios(self, selected, per_rule):
+        item_lists, env_count = self._scenario_item_lists(selected)
+        compiled = self._compiled_rules(item_lists)
+        if self.result_cache is not None and item_lists:
+            counts = self._cached_counts(item_lists, env_count, compiled, per_rule)
+            if counts is not None:
+                return counts
+
+        total = self._product_size(item_lists)
+        valid = self._count_valid(item_lists, compiled, compiled.rule_masks)
+        counts = {
+            "total": total,
+            "valid": valid,
+            "excluded": total - valid
+        }
+        if per_rule:
+            counts["per_rule"] = self._count_per_rule(item_lists, compiled, total)
+        return counts
+
+    def _cached_counts(self, item_lists, env_count, compiled, per_rule):
+        # 生成結果のキャッシュにある件数を返す。ルールごとの除外数は、すべてのルールの値がある場合だけ使う
+        cached = self.result_cache.load_counts(self.result_cache.make_key(item_lists, env_count, compiled.conjunctions))
+        if cached is None:
+            return None
+        counts, cached_per_rule = cached
+        counts = dict(counts)
+        if per_rule:
+            rule_keys = self.result_cache.rule_keys(item_lists, compiled)
+            if not all(rule_key in cached_per_rule for rule_key in rule_keys):
+                return None
+            counts["per_rule"] = {rule: cached_per_rule[rule_key] for rule, rule_key in zip(compiled.rules, rule_keys)}
+        return counts
+
+    def _count_per_rule(self, item_lists, compiled, total):
+        # ルールごとに、そのルールだけで除外されるシナリオの件数を数える。
+        # AND 節が1つで、各項目がそれぞれ別の1つのサブカテゴリにしかないルールは、
+        # 除外数が「それらのサブカテゴリを除いた直積の大きさ」になるので動的計画法を使わない
+        slots_by_bit = defaultdict(list)
+        for slot, items in enumerate(item_lists):
+            for item in items:
+                slots_by_bit[compiled.item_bit(item)].append(slot)
+
+        per_rule = {}
+        counter = ValidScenarioCounter(item_lists, compiled)
+        for index, rule in enumerate(compiled.rules):
+            masks = compiled.masks_for_rule(index)
+            matched = None
+            if len(masks) == 1:
+                matched = self._count_single_clause(item_lists, masks[0], slots_by_bit, total)
+            if matched is None:
+                matched = total - counter.count(masks)
+            per_rule[rule] = matched
+        return per_rule
+
+    def _count_single_clause(self, item_lists, mask, slots_by_bit, total):
+        # AND 節 mask を含むシナリオの件数。項目が複数のサブカテゴリにある場合は None を返す
+        used = set()
+        matched = total
+        while mask:
+            bit = mask & -mask
+            mask ^= bit
+            slots = slots_by_bit.get(bit)
+            if not slots:
+                return 0  # 選択されていない項目を含む
+            if len(slots) > 1:
+                return None
+            if slots[0] in used:
+                return 0  # 同じサブカテゴリの2つの項目は同時に選ばれない
+            used.add(slots[0])
+            matched //= len(item_lists[slots[0]])
+        return matched
+
+    def _product_size(self, item_lists):
+        total = 1
+        for items in item_lists:
+            total *= len(items)
+        return total
+
+    def _count_valid(self, item_lists, compiled, rule_masks):
+        return ValidScenarioCounter(item_lists, compiled).count(rule_masks)
+
+    def scenario_at(self, selected, index):
+        item_lists, env_count = self._scenario_item_lists(selected)
+        if not 0 <= index < self._product_size(item_lists):
+            raise IndexError(f"シナリオ番号が範囲外です: {index}")
+        return self._to_scenario(self._decode_index(item_lists, index), env_count)
+
+    def index_of(self, selected, scenario):
+        item_lists, env_count = self._scenario_item_lists(selected)
+        combination = tuple(scenario["環境状況"]) + tuple(scenario["車両状況"])
+        if len(combination) != len(item_lists) or len(scenario["環境状況"]) != env_count:
+            raise ValueError("シナリオが選択されたサブカテゴリと一致しません。")
+
+        index = 0
+        for items, item in zip(item_lists, combination):
+            if item not in items:
+                raise ValueError(f"選択されていない項目です: {item}")
+            index = index * len(items) + items.index(item)
+        return index
+
+    def valid_scenario_at(self, selected, rank):
+        # 有効なシナリオだけを iter_filtered の順に並べたときの rank 番目を返す
+        item_lists, env_count = self._scenario_item_lists(selected)
+        ranker = ValidScenarioRanker(self, item_lists)
+        return self._to_scenario(ranker.unrank(rank), env_count)
+
+    def sample(self, selected, n, seed=None):
+        # 有効なシナリオから重複なしで一様に n 件抽出する。有効件数の中から順位を抽出し、
+        # 計数の動的計画法で順位をシナリオに戻すため、直積の大きさによらず O(n) で済む
+        item_lists, env_count = self._scenario_item_lists(selected)
+        ranker = ValidScenarioRanker(self, item_lists)
+        valid = ranker.count()
+        if n > valid:
+            raise ValueError(f"有効なシナリオは {valid} 件しかありません。")
+
+        rng = random.Random(seed)
+        return [self._to_scenario(ranker.unrank(rank), env_count)
+                for rank in rng.sample(range(valid), n)]
+
+    def generate_covering_scenarios(self, selected, strength=2, seed=None):
+        # 全組み合わせの代わりに、除外ルールを満たしつつ有効な t 項目の組をすべて含む
+        # 少数のシナリオ（t-wise 被覆配列）を生成する
+        item_lists, env_count = self._scenario_item_lists(selected)
+        builder = CoveringArrayBuilder(self, item_lists, strength, seed)
+        return [self._to_scenario(combination, env_count) for combination in builder.build_combinations()]
+
+    def generate_scenarios(self, selected):
+        with instrumentation.stage("generate_scenarios"):
+            scenarios = list(self.iter_scenarios(selected))
+        instrumentation.count("scenarios_generated", len(scenarios))
+        return scenarios
+
+    def filter_scenarios(self, scenarios):
+        with instrumentation.stage("filter_scenarios"):
+            return [
+                scenario for scenario in scenarios
+                if not self.exclusion_rules_manager.is_excluded(scenario)
+            ]
+
+    def generate_and_filter_scenarios(self, selected, workers=1, backend="python"):
+        return list(self.iter_filtered(selected, workers, backend))
+
+    def scenario_rows(self, selected, hide_excluded=False, counts=None, valid_indices=None):
+        return ScenarioRows(self, selected, hide_excluded, counts, valid_indices)
+
+
+_shard_worker_state = {}
+
+def _init_shard_worker(rules, item_lists):
+    exclusion_rules_manager = ExclusionRulesManager()
+    exclusion_rules_manager.rules = rules
+    exclusion_rules_manager.compile()
+    _shard_worker_state["scenario_generator"] = ScenarioGenerator(None, exclusion_rules_manager)
+    _shard_worker_state["item_lists"] = item_lists
+
+
+def _run_shard(prefix):
+    scenario_generator = _shard_worker_state["scenario_generator"]
+    item_lists = _shard_worker_state["item_lists"]
+    return array('Q', scenario_generator._iter_pruned(item_lists, as_index=True, prefix=prefix))
+
+
+def _run_shard_columns(prefix):
+    # 項目名ではなく位置の列を返すので、親プロセスへの受け渡しは配列のコピーだけで済む
+    scenario_generator = _shard_worker_state["scenario_generator"]
+    item_lists = _shard_worker_state["item_lists"]
+    return _to_columns(scenario_generator._iter_pruned_positions(item_lists, prefix),
+                       len(item_lists), _position_typecode(item_lists))
+
+
+def _position_typecode(item_lists):
+    return 'H' if all(len(items) <= 0x10000 for items in item_lists) else 'I'
+
+
+def _to_columns(rows, column_count, typecode, block_size=65536):
+    # 位置のタプルの列を、サブカテゴリごとの位置の配列（列）にまとめる
+    columns = [array(typecode) for _ in range(column_count)]
+    while True:
+        block = list(itertools.islice(rows, block_size))
+        if not block:
+            return columns
+        for column, values in zip(columns, zip(*block)):
+            column.extend(values)
+
+
+def _decode_columns(item_lists, columns):
+    # 位置の列から項目のタプルを1件ずつ作る。ループは map と zip の中（C）で回る
+    return zip(*(map(items.__getitem__, column) for items, column in zip(item_lists, columns)))
+
+
+class ValidScenarioCounter:
+    # 有効なシナリオの件数を数える。末尾側のサブカテゴリの直積（MAX_TAIL_PRODUCT 以下）は、その中での
+    # 通し番号をビット位置とする整数（ビット集合）で表し、ルールに該当する組み合わせを AND / OR でまとめて求める。
+    # 先頭側のサブカテゴリは動的計画法で辿り、状態は次の組とする。
+    #   forbidden: 先頭側の残りのサブカテゴリで選ぶと除外になる項目のマスク
+    #   pending:   先頭側の項目が残っている、2項目以上残ったルールの残り項目のマスクの集合
+    #   killed:    ここまでの選び方で除外が確定した末尾側の組み合わせのビット集合
+    # 末尾側の項目だけが残ったルールは killed に畳み込むので、状態の数は末尾側の項目の禁止の
+    # 組み合わせではなく、先頭側の選び方で除外される末尾側の組み合わせの違いだけで決まる
+    def __init__(self, item_lists, compiled, tail_limit=None):
+        if tail_limit is None:
+            tail_limit = MAX_TAIL_PRODUCT
+        self.item_lists = item_lists
+        self.compiled = compiled
+        self.slot_masks = [compiled.items_mask(items) for items in item_lists]
+        self.available_mask = 0
+        for slot_mask in self.slot_masks:
+            self.available_mask |= slot_mask
+
+        # 末尾側の直積が tail_limit を超えない範囲で、できるだけ多くのサブカテゴリを末尾側にする
+        split = len(item_lists)
+        tail_size = 1
+        while split > 0 and tail_size * len(item_lists[split - 1]) <= tail_limit:
+            split -= 1
+            tail_size *= len(item_lists[split])
+        self.split = split
+        self.tail_size = tail_size
+        self.tail_weights = []
+        self.tail_mask = 0
+        self.tail_positions = defaultdict(list)  # 項目のビット -> [(末尾側のサブカテゴリ, 位置)]
+        weight = tail_size
+        for slot in range(split, len(item_lists)):
+            weight //= len(item_lists[slot])
+            self.tail_weights.append(weight)
+            self.tail_mask |= self.slot_masks[slot]
+            for position, item in enumerate(item_lists[slot]):
+                self.tail_positions[compiled.item_bit(item)].append((slot - split, position))
+        self._contains = {}
+        self._slot_patterns = {}
+
+    def _contains_item(self, bit):
+        # 末尾側の組み合わせのうち、項目（ビット bit）を含むもののビット集合
+        if bit not in self._contains:
+            contains = 0
+            for slot, position in self.tail_positions.get(bit, ()):
+                contains |= self._slot_pattern(slot) << (position * self.tail_weights[slot])
+            self._contains[bit] = contains
+        return self._contains[bit]
+
+    def _slot_pattern(self, slot):
+        # 末尾側のサブカテゴリ slot で先頭の項目が選ばれている組み合わせのビット集合
+        # （長さ weight の1の並びが、周期 weight * 項目数 で繰り返される）
+        if slot not in self._slot_patterns:
+            weight = self.tail_weights[slot]
+            period = weight * len(self.item_lists[self.split + slot])
+            repeat = ((1 << self.tail_size) - 1) // ((1 << period) - 1)
+            self._slot_patterns[slot] = repeat * ((1 << weight) - 1)
+        return self._slot_patterns[slot]
+
+    def _matching_tail(self, mask):
+        # mask の項目をすべて含む末尾側の組み合わせのビット集合
+        matching = (1 << self.tail_size) - 1
+        while mask and matching:
+            bit = mask & -mask
+            mask ^= bit
+            matching &= self._contains_item(bit)
+        return matching
+
+    def prepare(self, rule_masks):
+        # rule_masks を数えるための先頭側の各段と、末尾側の有効な組み合わせを求める
+        rule_masks = [rule_mask for rule_mask in rule_masks if rule_mask & self.available_mask == rule_mask]
+        self.valid_tail = (1 << self.tail_size) - 1
+        checks_by_bit = defaultdict(list)
+        for rule_mask in rule_masks:
+            if rule_mask & self.tail_mask == rule_mask:
+                self.valid_tail &= ~self._matching_tail(rule_mask)
+            rest = rule_mask
+            while rest:
+                bit = rest & -rest
+                rest ^= bit
+                checks_by_bit[bit].append(rule_mask)
+        self.valid_count = _popcount(self.valid_tail)
+        self._killed = {}
+        self._moved = {}
+
+        # 各段は (残りの項目のマスク, 先頭側の残りの項目のマスク, [(ビット, 効果)])。効果はその項目を選んだときに
+        # 状態に加わる (forbidden, pending, killed) で、その項目だけで成立するルールがある場合は None。
+        # どのルールにも現れない項目はビットを 0 とし、禁止されることもない
+        self.levels = []
+        head_future = 0
+        for slot in reversed(range(self.split)):
+            level = (head_future | self.tail_mask, head_future, [])
+            for item in self.item_lists[slot]:
+                bit = self.compiled.item_bit(item)
+                if bit not in checks_by_bit:
+                    bit = 0
+                level[2].append((bit, self._effect(bit, checks_by_bit.get(bit, ()), level)))
+            self.levels.append(level)
+            head_future |= self.slot_masks[slot]
+        self.levels.reverse()
+
+    def _effect(self, bit, checks, level):
+        future_mask, head_future, _ = level
+        forbidden = 0
+        pending = set()
+        killed = 0
+        for rest in checks:
+            rest &= ~bit
+            if not rest:
+                return None
+            if rest & future_mask != rest:
+                continue
+            if not rest & head_future:
+                killed |= self._kill(rest)
+            elif rest & (rest - 1):
+                pending.add(rest)
+            else:
+                forbidden |= rest
+        return forbidden, frozenset(pending), killed
+
+    def _kill(self, rest):
+        # 残り項目 rest がすべて末尾側で選ばれると除外になる、有効な末尾側の組み合わせ
+        killed = self._killed.get(rest)
+        if killed is None:
+            killed = self._killed[rest] = self._matching_tail(rest) & self.valid_tail
+        return killed
+
+    def initial_state(self):
+        return (0, frozenset(), 0)
+
+    def advance(self, state, bit, effect, level):
+        # 先頭側の項目（ビット bit）を選んだ後の状態。ルールが成立した場合は None を返す
+        forbidden, pending, killed = state
+        if effect is None or bit & forbidden:
+            return None
+        future_mask, head_future, _ = level
+        add_forbidden, add_pending, add_killed = effect
+        next_forbidden = forbidden & head_future | add_forbidden
+        killed |= add_killed
+        moved = forbidden & future_mask & ~head_future
+        if moved:
+            # 先頭側ではもう選ばれない禁止項目は、末尾側でその項目を含む組み合わせの除外になる
+            killed |= self._moved_killed(moved)
+        if not pending:
+            return (next_forbidden, add_pending, killed)
+
+        next_pending = set(add_pending)
+        for rest in pending:
+            rest &= ~bit
+            if not rest:
+                return None
+            if rest & future_mask != rest:
+                continue
+            if not rest & head_future:
+                killed |= self._kill(rest)
+            elif rest & (rest - 1):
+                next_pending.add(rest)
+            else:
+                next_forbidden |= rest
+        return (next_forbidden, frozenset(next_pending), killed)
+
+    def _moved_killed(self, moved):
+        killed = self._moved.get(moved)
+        if killed is None:
+            killed = 0
+            rest = moved
+            while rest:
+                bit = rest & -rest
+                rest ^= bit
+                killed |= self._kill(bit)
+            self._moved[moved] = killed
+        return killed
+
+    def completions(self, state):
+        # 先頭側をすべて選んだ状態から作れる有効なシナリオの件数
+        return self.valid_count - _popcount(state[2])
+
+    def count(self, rule_masks):
+        # 先頭側の段ごとに、同じ状態に至る組み合わせの件数をまとめて数える。
+        # 最後の段では状態を作らず、そのまま末尾側の件数を足し合わせる
+        self.prepare(rule_masks)
+        if not self.levels:
+            return self.valid_count
+        states = {self.initial_state(): 1}
+        for depth, level in enumerate(self.levels):
+            entries = level[2]
+            free_count = sum(1 for bit, _ in entries if not bit)
+            constrained = [(bit, effect) for bit, effect in entries if bit]
+            is_last = depth == len(self.levels) - 1
+            next_states = defaultdict(int)
+            total = 0
+            for state, count in states.items():
+                if free_count:
+                    next_state = self.advance(state, 0, _NO_EFFECT, level)
+                    if is_last:
+                        total += count * free_count * self.completions(next_state)
+                    else:
+                        next_states[next_state] += count * free_count
+                for bit, effect in constrained:
+                    next_state = self.advance(state, bit, effect, level)
+                    if next_state is None:
+                        continue
+                    if is_last:
+                        total += count * self.completions(next_state)
+                    else:
+                        next_states[next_state] += count
+            states = next_states
+        return total
+
+    def nth_tail(self, state, rank):
+        # 状態から選べる有効な末尾側の組み合わせのうち rank 番目（通し番号の順）の項目のタプル
+        remaining = self.valid_tail & ~state[2]
+        low = 0
+        high = self.tail_size
+        while high - low > 1:
+            middle = (low + high) // 2
+            if _popcount(remaining & ((1 << middle) - 1)) > rank:
+                high = middle
+            else:
+                low = middle
+        combination = []
+        for slot, weight in enumerate(self.tail_weights):
+            position, low = divmod(low, weight)
+            combination.append(self.item_lists[self.split + slot][position])
+        return tuple(combination)
+
+
+class ValidScenarioRanker:
+    # 有効なシナリオの順位とシナリオを相互に変換する。先頭側の各状態から作れる有効な組み合わせの
+    # 件数をメモ化して順位を上位のサブカテゴリから決め、末尾側はビット集合の中で rank 番目を探す
+    def __init__(self, scenario_generator, item_lists):
+        compiled = scenario_generator._compiled_rules(item_lists)
+        self.item_lists = item_lists
+        self.counter = ValidScenarioCounter(item_lists, compiled)
+        self.counter.prepare(compiled.rule_masks)
+        self.memo = {}
+
+    def completions(self, depth, state):
+        counter = self.counter
+        if depth == len(counter.levels):
+            return counter.completions(state)
+        key = (depth, state)
+        if key in self.memo:
+            return self.memo[key]
+
+        level = counter.levels[depth]
+        total = 0
+        free_total = None
+        for bit, effect in level[2]:
+            if not bit:
+                if free_total is None:
+                    free_total = self.completions(depth + 1, counter.advance(state, 0, effect, level))
+                total += free_total
+                continue
+            next_state = counter.advance(state, bit, effect, level)
+            if next_state is not None:
+                total += self.completions(depth + 1, next_state)
+        self.memo[key] = total
+        return total
+
+    def count(self):
+        return self.completions(0, self.counter.initial_state())
+
+    def unrank(self, rank):
+        if not 0 <= rank < self.count():
+            raise IndexError(f"有効なシナリオの番号が範囲外です: {rank}")
+
+        counter = self.counter
+        state = counter.initial_state()
+        combination = []
+        for depth, (items, level) in enumerate(zip(self.item_lists, counter.levels)):
+            for item, (bit, effect) in zip(items, level[2]):
+                next_state = counter.advance(state, bit, effect, level)
+                if next_state is None:
+                    continue
+                completions = self.completions(depth + 1, next_state)
+                if rank < completions:
+                    combination.append(item)
+                    state = next_state
+                    break
+                rank -= completions
+        return tuple(combination) + counter.nth_tail(state, rank)
+
+
+class ScenarioRows:
+    # 表示用の行データ。全件を保持せず、要求された行だけを通し番号から復元する。
+    # 除外シナリオを隠す場合は、有効なシナリオの通し番号を必要な分だけ順に求めて保持する。
+    # valid_indices を渡した場合は、その配列（バックグラウンドで追記される）をそのまま使う
+    def __init__(self, scenario_generator, selected, hide_excluded=False, counts=None, valid_indices=None):
+        self.scenario_generator = scenario_generator
+        self.hide_excluded = hide_excluded
+        self.item_lists, self.env_count = scenario_generator._scenario_item_lists(selected)
+
+        if counts is None:
+            counts = scenario_generator.count_scenarios(selected, per_rule=False)
+        self.total = counts["total"]
+        self.valid = counts["valid"]
+
+        if valid_indices is not None:
+            self._indices = valid_indices
+            self._pending = None
+        else:
+            self._indices = array('Q')
+            self._pending = scenario_generator._iter_pruned(self.item_lists, as_index=True) if hide_excluded else None
+
+    def __len__(self):
+        if not self.hide_excluded:
+            return self.total
+        if self._pending is None:
+            return len(self._indices)
+        return self.valid
+
+    def product_index(self, position):
+        if not 0 <= position < len(self):
+            raise IndexError(position)
+        if not self.hide_excluded:
+            return position
+        if position >= len(self._indices):
+            self._indices.extend(itertools.islice(self._pending, position + 1 - len(self._indices)))
+        return self._indices[position]
+
+    def __getitem__(self, position):
+        combination = self.scenario_generator._decode_index(self.item_lists, self.product_index(position))
+        return self.scenario_generator._to_scenario(combination, self.env_count)
@@ -0,0 +1,109 @@
+import codecs
+import csv
+import json
+import os
+
+WRITER_FORMATS = ("csv", "jsonl", "parquet")
+
+def column_name(column):
+    category, subcategory = column
+    return category if subcategory is None else f"{category}/{subcategory}"
+
+
+class CsvScenarioWriter:
+    def __init__(self, file_path, columns):
+        self.columns = columns
+        self.file = codecs.open(file_path, 'w', 'utf-8-sig')
+        self.writer = csv.writer(self.file)
+        self.writer.writerow([column_name(column) for column in columns])
+
+    def write_rows(self, rows):
+        self.writer.writerows(rows)
+
+    def write_batch(self, batch):
+        self.write_rows(batch.rows())
+
+    def close(self):
+        self.file.close()
+
+
+class JsonlScenarioWriter:
+    def __init__(self, file_path, columns):
+        self.columns = columns
+        self.file = codecs.open(file_path, 'w', 'utf-8')
+
+    def write_rows(self, rows):
+        for row in rows:
+            record = {}
+            for (category, subcategory), value in zip(self.columns, row):
+                if subcategory is None:
+                    record[category] = value
+                else:
+                    record.setdefault(category, {})[subcategory] = value
+            self.file.write(json.dumps(record, ensure_ascii=False))
+            self.file.write("\n")
+
+    def write_batch(self, batch):
+        self.write_rows(batch.rows())
+
+    def close(self):
+        self.file.close()
+
+
+class ParquetScenarioWriter:
+    # 列指向形式での出力。pyarrow がインストールされている場合のみ使用できる
+    def __init__(self, file_path, columns):
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise RuntimeError("Parquet形式で出力するには pyarrow をインストールしてください。")
+        self.pyarrow = pyarrow
+        self.columns = columns
+        self.names = [column_name(column) for column in columns]
+        schema = pyarrow.schema([(name, pyarrow.dictionary(pyarrow.int32(), pyarrow.string()))
+                                 for name in self.names])
+        self.writer = pyarrow.parquet.ParquetWriter(file_path, schema)
+        self.dictionary = None  # (項目名の対応表, その pyarrow 配列)
+
+    def write_rows(self, rows):
+        rows = list(rows)
+        if not rows:
+            return
+        arrays = [self.pyarrow.array([row[i] for row in rows]).dictionary_encode()
+                  for i in range(len(self.names))]
+        self.writer.write_table(self.pyarrow.Table.from_arrays(arrays, names=self.names))
+
+    def write_batch(self, batch):
+        # ScenarioBatch の項目IDの列をそのまま辞書の添字にするので、項目名の列を作らない
+        if not len(batch):
+            return
+        item_names = batch.layout.item_names
+        if self.dictionary is None or self.dictionary[0] is not item_names or len(self.dictionary[1]) != len(item_names):
+            self.dictionary = (item_names, self.pyarrow.array(item_names, type=self.pyarrow.string()))
+        arrays = [self.pyarrow.DictionaryArray.from_arrays(self.pyarrow.array(column, type=self.pyarrow.int32()),
+                                                           self.dictionary[1])
+                  for column in batch.columns]
+        self.writer.write_table(self.pyarrow.Table.from_arrays(arrays, names=self.names))
+
+    def close(self):
+        self.writer.close()
+
+
+def guess_format(file_path):
+    extension = os.path.splitext(file_path)[1].lower().lstrip(".")
+    if extension in ("json", "ndjson"):
+        return "jsonl"
+    return extension if extension in WRITER_FORMATS else "csv"
+
+
+def open_writer(file_path, columns, output_format=None):
+    # columns は (カテゴリ, サブカテゴリ) のリスト。サブカテゴリが None の列は付加情報として扱う
+    output_format = output_format or guess_format(file_path)
+    if output_format == "csv":
+        return CsvScenarioWriter(file_path, columns)
+    if output_format == "jsonl":
+        return JsonlScenarioWriter(file_path, columns)
+    if output_format == "parquet":
+        return ParquetScenarioWriter(file_path, columns)
+    raise ValueError(f"サポートされていない出力形式です: {output_format}")
@@ -0,0 +1,128 @@
+import json
+import os
+import random
+import tempfile
+import time
+import unittest
+
+from adas_scenario_generator.category_manager import CategoryManager
+
+CATEGORIES = {
+    "環境状況": {"場所": ["市街地", "高速道路"], "その他": ["夜間", "霧"]},
+    "車両状況": {"速度": ["停止", "高速"], "その他": ["霧", "牽引"]}
+}
+
+
+class CategoryManagerIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        category_file = os.path.join(self.temp_dir.name, "categories.json")
+        with open(category_file, "w", encoding="utf-8") as file:
+            json.dump(CATEGORIES, file, ensure_ascii=False)
+        self.category_manager = CategoryManager.from_file(category_file)
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def assert_index_in_sync(self):
+        # 索引が categories から作り直したものと一致することを確かめる
+        category_manager = self.category_manager
+        expected_sets = {}
+        expected_locations = {}
+        for category, subcategories in category_manager.categories.items():
+            for subcategory, items in subcategories.items():
+                expected_sets[(category, subcategory)] = list(items)
+                for item in items:
+                    expected_locations.setdefault(item, []).append((category, subcategory))
+        self.assertEqual({key: list(item_set) for key, item_set in category_manager.item_sets.items()},
+                         expected_sets)
+        # 読み込み後に追加した場所は末尾に並ぶので、順序は比べない
+        self.assertEqual({item: sorted(locations) for item, locations in category_manager.item_locations.items()},
+                         {item: sorted(locations) for item, locations in expected_locations.items()})
+        self.assertEqual(category_manager.get_all_items(),
+                         [item for subcategories in category_manager.categories.values()
+                          for items in subcategories.values() for item in items])
+        for item, locations in expected_locations.items():
+            self.assertIn(category_manager.find_item(item), locations)
+            self.assertEqual(category_manager.get_item_name(category_manager.get_item_id(item)), item)
+
+    def test_index_after_loading(self):
+        self.assert_index_in_sync()
+        self.assertEqual(sorted(self.category_manager.get_item_locations("霧")),
+                         [("環境状況", "その他"), ("車両状況", "その他")])
+        self.assertTrue(self.category_manager.has_item("車両状況", "速度", "高速"))
+        self.assertFalse(self.category_manager.has_item("車両状況", "速度", "夜間"))
+
+    def test_index_stays_in_sync_with_random_edits(self):
+        category_manager = self.category_manager
+        rng = random.Random(0)
+        names = ["霧", "高速", "新項目", "停止"]
+        for _ in range(2000):
+            category = rng.choice(list(category_manager.categories) + ["追加カテゴリ"])
+            subcategory = rng.choice(["場所", "速度", "その他", "追加"])
+            item = rng.choice(names)
+            operation = rng.randrange(6)
+            version = category_manager.version
+            before = json.dumps(category_manager.categories, ensure_ascii=False)
+            if operation == 0:
+                category_manager.add_category(category)
+            elif operation == 1:
+                category_manager.add_subcategory(category, subcategory)
+            elif operation in (2, 3):
+                category_manager.add_item(category, subcategory, item)
+            elif operation == 4:
+                category_manager.remove_item(category, subcategory, item)
+            elif rng.random() < 0.2:
+                category_manager.remove_subcategory(category, subcategory)
+            elif rng.random() < 0.05:
+                category_manager.remove_category(category)
+            self.assert_index_in_sync()
+            # 内容が変わったときだけ version が増える
+            changed = json.dumps(category_manager.categories, ensure_ascii=False) != before
+            self.assertEqual(category_manager.version != version, changed)
+
+    def test_assigning_categories_rebuilds_index(self):
+        category_manager = self.category_manager
+        item_id = category_manager.get_item_id("霧")
+        category_manager.categories = {"環境状況": {"天候": ["雨", "雨", "霧"]}}
+        self.assertEqual(category_manager.categories["環境状況"]["天候"], ["雨", "霧"])  # 重複はまとめる
+        self.assertEqual(category_manager.get_item_id("霧"), item_id)  # IDは再利用しない
+        self.assert_index_in_sync()
+
+    def test_assigning_categories_does_not_modify_input(self):
+        categories = {"環境状況": {"天候": ["雨", "雨", "霧"]}}
+        self.category_manager.categories = categories
+        self.assertEqual(categories, {"環境状況": {"天候": ["雨", "雨", "霧"]}})
+        self.category_manager.add_item("環境状況", "天候", "雪")
+        self.category_manager.remove_item("環境状況", "天候", "雨")
+        self.assertEqual(categories, {"環境状況": {"天候": ["雨", "雨", "霧"]}})
+        self.assertEqual(self.category_manager.categories["環境状況"]["天候"], ["霧", "雪"])
+
+    def test_remove_many_items(self):
+        # 削除はリストを走査しないので、大きなサブカテゴリから末尾側の項目を続けて削除しても時間が伸びない
+        category_manager = self.category_manager
+        items = [f"項目{i}" for i in range(50000)]
+        category_manager.categories = {"環境状況": {"場所": items}}
+        start = time.perf_counter()
+        for item in reversed(items[1000:]):
+            category_manager.remove_item("環境状況", "場所", item)
+        self.assertLess(time.perf_counter() - start, 2.0)
+        self.assertEqual(category_manager.categories["環境状況"]["場所"], items[:1000])
+        self.assert_index_in_sync()
+
+    def test_search_index_is_reused_until_changed(self):
+        category_manager = self.category_manager
+        index = category_manager.search_index("環境状況")
+        self.assertIs(category_manager.search_index("環境状況"), index)
+        self.assertEqual([index.entries[position] for position in index.search("高速")], [("場所", "高速道路")])
+
+        category_manager.add_item("環境状況", "場所", "高速道路（渋滞）")
+        changed = category_manager.search_index("環境状況")
+        self.assertIsNot(changed, index)
+        self.assertEqual([changed.entries[position] for position in changed.search("高速")],
+                         [("場所", "高速道路"), ("場所", "高速道路（渋滞）")])
+        self.assertIs(category_manager.search_index("環境状況"), changed)
+
+
+if __name__ == "__main__":
+    unittest.main()
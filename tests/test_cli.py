@@ -0,0 +1,214 @@
+import codecs
+import contextlib
+import csv
+import io
+import itertools
+import json
+import os
+import tempfile
+import unittest
+
+from adas_scenario_generator import cli
+from adas_scenario_generator.category_manager import CategoryManager
+from adas_scenario_generator.exclusion_rules import ExclusionRulesManager
+from adas_scenario_generator.scenario_generator import ScenarioGenerator
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+CATEGORIES = {
+    "環境状況": {"場所": ["市街地", "高速道路", "駐車場"], "天候": ["晴れ", "雨"]},
+    "車両状況": {"速度": ["停止", "高速"], "車線": ["左", "右"]}
+}
+RULES = [("高速道路", "停止"), ("駐車場", "高速"), ("雨", "右")]
+
+
+class CliTest(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.category_file = self.path("categories.json")
+        with open(self.category_file, "w", encoding="utf-8") as file:
+            json.dump(CATEGORIES, file, ensure_ascii=False)
+        self.rule_file = self.write_rules("rules.json", RULES)
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def path(self, name):
+        return os.path.join(self.temp_dir.name, name)
+
+    def write_rules(self, name, rules):
+        exclusion_rules_manager = ExclusionRulesManager()
+        for rule in rules:
+            exclusion_rules_manager.add_rule(*rule)
+        path = self.path(name)
+        exclusion_rules_manager.save_rules_to(path)
+        return path
+
+    def run_cli(self, *argv):
+        stdout = io.StringIO()
+        stderr = io.StringIO()
+        with contextlib.redirect_stdout(stdout), contextlib.redirect_stderr(stderr):
+            code = cli.main(list(argv))
+        return code, stdout.getvalue(), stderr.getvalue()
+
+    def common(self, *selections, rules=True):
+        argv = ["--categories", self.category_file]
+        if rules:
+            argv += ["--rules", self.rule_file]
+        for selection in selections:
+            argv += ["--select", selection]
+        return argv
+
+    def expected_rows(self, selected, include_excluded=False):
+        category_manager = CategoryManager.from_file(self.category_file)
+        exclusion_rules_manager = ExclusionRulesManager.from_file(self.rule_file, category_manager)
+        compiled = exclusion_rules_manager.compile()
+        item_lists = [items for category in cli.SCENARIO_CATEGORIES for items in selected[category].values() if items]
+        rows = []
+        for combination in itertools.product(*item_lists):
+            matched = compiled.matching_rules(combination)
+            if include_excluded:
+                rows.append(combination + (", ".join(matched),))
+            elif not matched:
+                rows.append(combination)
+        return rows
+
+    def read_csv(self, path):
+        with codecs.open(path, "r", "utf-8-sig") as file:
+            rows = list(csv.reader(file))
+        return rows[0], [tuple(row) for row in rows[1:]]
+
+    def test_parse_selection(self):
+        selected = cli.parse_selection(CATEGORIES, [])
+        self.assertEqual(selected, {category: {subcategory: list(items) for subcategory, items in subcategories.items()}
+                                    for category, subcategories in CATEGORIES.items()})
+        selected = cli.parse_selection(CATEGORIES, ["環境状況/場所=駐車場,市街地", "環境状況/場所=市街地", "車両状況"])
+        self.assertEqual(selected, {"環境状況": {"場所": ["市街地", "駐車場"]},
+                                    "車両状況": {"速度": ["停止", "高速"], "車線": ["左", "右"]}})
+        for selection in ("その他", "環境状況/時間帯", "環境状況/場所=山道"):
+            with self.assertRaises(ValueError):
+                cli.parse_selection(CATEGORIES, [selection])
+
+    def test_check_generate_options(self):
+        parser = cli.build_parser()
+        valid = [[], ["--workers", "2"], ["--cache-dir", "cache"], ["--workers", "2", "--cache-dir", "cache"],
+                 ["--backend", "numpy"], ["--include-excluded"]]
+        invalid = [["--workers", "0"], ["--include-excluded", "--workers", "2"],
+                   ["--include-excluded", "--cache-dir", "cache"], ["--include-excluded", "--backend", "numpy"],
+                   ["--backend", "numpy", "--workers", "2"], ["--backend", "numpy", "--cache-dir", "cache"]]
+        for options in valid:
+            cli.check_generate_options(parser.parse_args(["generate", "--out", "out.csv"] + options))
+        for options in invalid:
+            with self.assertRaises(ValueError, msg=options):
+                cli.check_generate_options(parser.parse_args(["generate", "--out", "out.csv"] + options))
+        code, _, stderr = self.run_cli("generate", "--out", self.path("out.csv"), "--include-excluded",
+                                       "--workers", "2", *self.common())
+        self.assertEqual(code, 1)
+        self.assertIn("--workers", stderr)
+
+    def test_generate(self):
+        selected = cli.parse_selection(CATEGORIES, ["環境状況", "車両状況/速度"])
+        expected = self.expected_rows(selected)
+        code, _, _ = self.run_cli("generate", "--out", self.path("out.csv"), *self.common("環境状況", "車両状況/速度"))
+        self.assertEqual(code, 0)
+        header, rows = self.read_csv(self.path("out.csv"))
+        self.assertEqual(header, ["環境状況/場所", "環境状況/天候", "車両状況/速度"])
+        self.assertEqual(rows, expected)
+
+        code, _, _ = self.run_cli("generate", "--out", self.path("out.jsonl"), *self.common("環境状況", "車両状況/速度"))
+        self.assertEqual(code, 0)
+        with open(self.path("out.jsonl"), encoding="utf-8") as file:
+            records = [json.loads(line) for line in file]
+        self.assertEqual([(record["環境状況"]["場所"], record["環境状況"]["天候"], record["車両状況"]["速度"])
+                          for record in records], expected)
+
+    def test_generate_options_give_the_same_rows(self):
+        selected = cli.parse_selection(CATEGORIES, [])
+        expected = self.expected_rows(selected)
+        option_sets = [["--batch-size", "3"], ["--cache-dir", self.path("cache")], ["--cache-dir", self.path("cache")]]
+        if numpy is not None:
+            option_sets.append(["--backend", "numpy"])
+        for options in option_sets:
+            code, _, _ = self.run_cli("generate", "--out", self.path("out.csv"), *options, *self.common())
+            self.assertEqual(code, 0, options)
+            self.assertEqual(self.read_csv(self.path("out.csv"))[1], expected, options)
+
+        code, _, _ = self.run_cli("generate", "--out", self.path("all.csv"), "--include-excluded", *self.common())
+        self.assertEqual(code, 0)
+        header, rows = self.read_csv(self.path("all.csv"))
+        self.assertEqual(header[-1], "除外理由")
+        self.assertEqual(rows, self.expected_rows(selected, include_excluded=True))
+
+    def test_count(self):
+        code, stdout, _ = self.run_cli("count", "--per-rule", *self.common("環境状況/場所=高速道路,駐車場", "車両状況"))
+        self.assertEqual(code, 0)
+        counts = json.loads(stdout)
+        category_manager = CategoryManager.from_file(self.category_file)
+        exclusion_rules_manager = ExclusionRulesManager.from_file(self.rule_file, category_manager)
+        selected = cli.parse_selection(category_manager.categories, ["環境状況/場所=高速道路,駐車場", "車両状況"])
+        self.assertEqual(counts, ScenarioGenerator(category_manager, exclusion_rules_manager).count_scenarios(selected))
+        self.assertEqual(counts["valid"], len(self.expected_rows(selected)))
+
+        code, stdout, _ = self.run_cli("count", *self.common())
+        self.assertNotIn("per_rule", json.loads(stdout))
+
+    def test_cover(self):
+        code, _, _ = self.run_cli("cover", "--out", self.path("cover.csv"), "--seed", "1", *self.common())
+        self.assertEqual(code, 0)
+        valid = set(self.expected_rows(cli.parse_selection(CATEGORIES, [])))
+        _, rows = self.read_csv(self.path("cover.csv"))
+        self.assertTrue(rows and set(rows) <= valid)
+        required = {(slots, tuple(row[slot] for slot in slots)) for row in valid
+                    for slots in itertools.combinations(range(4), 2)}
+        covered = {(slots, tuple(row[slot] for slot in slots)) for row in rows
+                   for slots in itertools.combinations(range(4), 2)}
+        self.assertEqual(required, covered)
+
+        code, stdout, _ = self.run_cli("cover", "--benchmark", "--strength", "2", *self.common())
+        self.assertEqual(code, 0)
+        self.assertTrue(json.loads(stdout))
+
+        code, _, stderr = self.run_cli("cover", *self.common())
+        self.assertEqual(code, 1)
+        self.assertIn("--out", stderr)
+
+    def test_analyze_rules(self):
+        rule_file = self.write_rules("duplicated.json", RULES + [("停止", "高速道路"), ("市街地", "駐車場")])
+        minimized_file = self.path("minimized.json")
+        code, stdout, _ = self.run_cli("analyze-rules", "--categories", self.category_file, "--rules", rule_file,
+                                       "--minimized-out", minimized_file)
+        self.assertEqual(code, 0)
+        report = json.loads(stdout)
+        self.assertEqual(report["duplicates"], [{"rule": "停止 * 高速道路", "duplicate_of": "高速道路 * 停止"}])
+        self.assertEqual(report["impossible"], [{"rule": "市街地 * 駐車場"}])
+        self.assertEqual(ExclusionRulesManager.from_file(minimized_file).get_rules(), report["minimized_rules"])
+
+    def test_diff(self):
+        new_rule_file = self.write_rules("new_rules.json", RULES[1:] + [("晴れ", "左")])
+        code, stdout, _ = self.run_cli("diff", "--old-rules", self.rule_file, "--rules", new_rule_file,
+                                       "--categories", self.category_file, "--out", self.path("diff.csv"))
+        self.assertEqual(code, 0)
+        summary = json.loads(stdout)
+        old = set(self.expected_rows(cli.parse_selection(CATEGORIES, [])))
+        self.rule_file = new_rule_file
+        new = set(self.expected_rows(cli.parse_selection(CATEGORIES, [])))
+        self.assertEqual((summary["newly_excluded"], summary["newly_allowed"]), (len(old - new), len(new - old)))
+        self.assertEqual((summary["added"], summary["removed"]), (0, 0))
+        header, rows = self.read_csv(self.path("diff.csv"))
+        self.assertEqual(header[0], "変更")
+        self.assertEqual(sorted(rows), sorted([("newly_excluded",) + row for row in old - new] +
+                                              [("newly_allowed",) + row for row in new - old]))
+
+    def test_errors(self):
+        code, _, stderr = self.run_cli("count", *self.common("その他"))
+        self.assertEqual(code, 1)
+        self.assertIn("カテゴリが見つかりません", stderr)
+        code, _, stderr = self.run_cli("count", "--categories", self.path("missing.json"))
+        self.assertEqual(code, 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
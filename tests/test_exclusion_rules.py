@@ -0,0 +1,239 @@
+import itertools
+import json
+import os
+import random
+import tempfile
+import unittest
+
+from adas_scenario_generator.category_manager import CategoryManager
+from adas_scenario_generator.exclusion_rules import ExclusionRulesManager
+from adas_scenario_generator.rule_compiler import format_expression, parse_expression
+from adas_scenario_generator.scenario_generator import ScenarioGenerator
+
+# 項目名はサブカテゴリ間で重複しない。サブカテゴリ名「その他」は両方のカテゴリにある
+CATEGORIES = {
+    "環境状況": {"天候": ["晴れ", "雨", "霧"], "場所": ["市街地", "高速道路", "駐車場"], "その他": ["夜間", "昼間"]},
+    "車両状況": {"速度": ["停止", "低速", "高速"], "その他": ["牽引", "単独"]}
+}
+KEYS = [(category, subcategory) for category, subcategories in CATEGORIES.items() for subcategory in subcategories]
+
+
+def subcategory_keys(name):
+    return [key for key in KEYS if name in (key[1], f"{key[0]}/{key[1]}")]
+
+
+def evaluate(node, chosen):
+    # ルール式を直接評価する（chosen は (カテゴリ, サブカテゴリ) -> 選ばれた項目）。
+    # 選択されていないサブカテゴリは chosen になく、その項目は含まれないものとして扱う
+    if "and" in node:
+        return all(evaluate(child, chosen) for child in node["and"])
+    if "or" in node:
+        return any(evaluate(child, chosen) for child in node["or"])
+    if "not" in node:
+        return not evaluate(node["not"], chosen)
+    if "in" in node:
+        return any(chosen.get(key) in node["in"] for key in subcategory_keys(node["subcategory"]))
+    if node.get("subcategory"):
+        return any(chosen.get(key) == node["item"] for key in subcategory_keys(node["subcategory"]))
+    return node["item"] in chosen.values()
+
+
+def random_expression(rng, depth=0):
+    kind = rng.randrange(6 if depth < 2 else 3)
+    key = rng.choice(KEYS)
+    items = CATEGORIES[key[0]][key[1]]
+    name = key[1] if key[1] != "その他" or rng.random() < 0.3 else f"{key[0]}/{key[1]}"
+    if kind == 0:
+        return {"item": rng.choice(items)}
+    if kind == 1:
+        return {"item": rng.choice(items), "subcategory": name}
+    if kind == 2:
+        return {"subcategory": name, "in": rng.sample(items, rng.randint(1, len(items)))}
+    if kind == 3:
+        return {"not": random_expression(rng, depth + 1)}
+    operator = "and" if kind == 4 else "or"
+    return {operator: [random_expression(rng, depth + 1) for _ in range(rng.randint(2, 3))]}
+
+
+class ExclusionRulesTest(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.category_manager = self.make_category_manager(CATEGORIES)
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def make_category_manager(self, categories):
+        category_file = os.path.join(self.temp_dir.name, "categories.json")
+        with open(category_file, "w", encoding="utf-8") as file:
+            json.dump(categories, file, ensure_ascii=False)
+        return CategoryManager.from_file(category_file)
+
+    def write_json(self, name, data):
+        path = os.path.join(self.temp_dir.name, name)
+        with open(path, "w", encoding="utf-8") as file:
+            json.dump(data, file, ensure_ascii=False)
+        return path
+
+    def test_parse_expression(self):
+        self.assertEqual(parse_expression("高速道路 AND (停止 OR 駐車)"),
+                         {"and": [{"item": "高速道路"}, {"or": [{"item": "停止"}, {"item": "駐車"}]}]})
+        self.assertEqual(parse_expression("速度 = 高速 AND 場所 ∈ {駐車場, 市街地}"),
+                         {"and": [{"item": "高速", "subcategory": "速度"},
+                                  {"subcategory": "場所", "in": ["駐車場", "市街地"]}]})
+        self.assertEqual(parse_expression("NOT 晴れ AND 高速道路"),
+                         {"and": [{"not": {"item": "晴れ"}}, {"item": "高速道路"}]})
+        self.assertEqual(parse_expression("高速道路 * 停止"), parse_expression("高速道路 AND 停止"))
+        self.assertEqual(parse_expression('"AND" and 場所 in {"a b"}'),
+                         {"and": [{"item": "AND"}, {"subcategory": "場所", "in": ["a b"]}]})
+        for text in ("", "(晴れ AND 雨", "晴れ AND", '"晴れ', "場所 ∈ {}", "晴れ 雨"):
+            with self.assertRaises(ValueError, msg=text):
+                parse_expression(text)
+
+    def test_format_expression_round_trip(self):
+        rng = random.Random(0)
+        for _ in range(300):
+            node = random_expression(rng)
+            self.assertEqual(parse_expression(format_expression(node)), self.flatten(node))
+
+    def flatten(self, node):
+        # パーサは同じ演算子の入れ子を1段にまとめる
+        for operator in ("and", "or"):
+            if operator in node:
+                children = []
+                for child in map(self.flatten, node[operator]):
+                    children.extend(child[operator] if operator in child else [child])
+                return {operator: children}
+        if "not" in node:
+            return {"not": self.flatten(node["not"])}
+        return node
+
+    def test_compiled_rules_match_direct_evaluation(self):
+        rng = random.Random(1)
+        scenarios = [dict(zip(KEYS, combination))
+                     for combination in itertools.product(*(CATEGORIES[key[0]][key[1]] for key in KEYS))]
+        compiled_count = 0
+        for _ in range(300):
+            node = random_expression(rng)
+            exclusion_rules_manager = ExclusionRulesManager(self.category_manager)
+            try:
+                rule = exclusion_rules_manager.add_pattern_rule(node)
+            except ValueError:
+                continue  # 条件が1つだけのルールや、すべてのシナリオを除外するルール
+            compiled_count += 1
+            for chosen in scenarios:
+                scenario = {"環境状況": tuple(chosen[key] for key in KEYS[:3]),
+                            "車両状況": tuple(chosen[key] for key in KEYS[3:])}
+                self.assertEqual(exclusion_rules_manager.is_excluded(scenario), evaluate(node, chosen),
+                                 (rule, chosen))
+        self.assertGreater(compiled_count, 100)
+
+    def test_not_is_true_for_unselected_subcategory(self):
+        exclusion_rules_manager = ExclusionRulesManager(self.category_manager)
+        exclusion_rules_manager.add_pattern_rule("NOT 高速道路 AND 停止")
+        scenario_generator = ScenarioGenerator(self.category_manager, exclusion_rules_manager)
+        selected = {"環境状況": {"天候": ["晴れ"]}, "車両状況": {"速度": ["停止", "高速"]}}
+        self.assertEqual(list(scenario_generator.iter_filtered(selected)),
+                         [{"環境状況": ("晴れ",), "車両状況": ("高速",)}])
+        self.assertTrue(exclusion_rules_manager.is_excluded({"環境状況": ("晴れ",), "車両状況": ("停止",)}))
+        self.assertEqual(scenario_generator.count_scenarios(selected)["valid"], 1)
+
+    def test_generation_matches_direct_evaluation_on_partial_selections(self):
+        rng = random.Random(2)
+        checked = 0
+        while checked < 150:
+            node = random_expression(rng)
+            exclusion_rules_manager = ExclusionRulesManager(self.category_manager)
+            try:
+                exclusion_rules_manager.add_pattern_rule(node)
+            except ValueError:
+                continue
+            # 一部のサブカテゴリだけを、一部の項目で選択する
+            keys = [key for key in KEYS if rng.random() < 0.6]
+            selected = {category: {} for category in CATEGORIES}
+            for category, subcategory in keys:
+                items = CATEGORIES[category][subcategory]
+                selected[category][subcategory] = rng.sample(items, rng.randint(1, len(items)))
+            selected_keys = [(category, subcategory) for category in CATEGORIES for subcategory in selected[category]]
+            expected = [combination for combination in itertools.product(
+                            *(selected[category][subcategory] for category, subcategory in selected_keys))
+                        if not evaluate(node, dict(zip(selected_keys, combination)))]
+
+            scenario_generator = ScenarioGenerator(self.category_manager, exclusion_rules_manager)
+            scenarios = list(scenario_generator.iter_filtered(selected))
+            self.assertEqual([scenario["環境状況"] + scenario["車両状況"] for scenario in scenarios], expected,
+                             (format_expression(node), selected))
+            self.assertEqual(scenario_generator.count_scenarios(selected)["valid"], len(expected))
+            for scenario in scenarios:
+                self.assertFalse(exclusion_rules_manager.is_excluded(scenario))
+            checked += 1
+
+    def test_qualified_rule_with_ambiguous_item_is_rejected(self):
+        categories = json.loads(json.dumps(CATEGORIES))
+        categories["環境状況"]["その他"].append("高速")
+        exclusion_rules_manager = ExclusionRulesManager(self.make_category_manager(categories))
+        for text in ("速度 = 高速 AND 場所 = 市街地", "速度 ∈ {高速, 低速} AND 雨", "NOT 低速 AND 雨"):
+            with self.assertRaises(ValueError, msg=text):
+                exclusion_rules_manager.add_pattern_rule(text)
+        # 項目名だけのルールはどのサブカテゴリの項目にも一致するので、そのまま使える
+        exclusion_rules_manager.add_pattern_rule("高速 AND 市街地")
+
+    def test_rule_excluding_everything_is_rejected(self):
+        exclusion_rules_manager = ExclusionRulesManager(self.category_manager)
+        with self.assertRaises(ValueError):
+            exclusion_rules_manager.add_pattern_rule("NOT 雪 OR 晴れ")  # 雪 はどのサブカテゴリにもない
+
+    def test_save_and_load_round_trip(self):
+        exclusion_rules_manager = ExclusionRulesManager(self.category_manager)
+        exclusion_rules_manager.add_rule("高速道路", "停止", "高速道路で停止")
+        exclusion_rules_manager.add_pattern_rule("速度 = 高速 AND 場所 ∈ {駐車場, 市街地}", "駐車場・市街地で高速")
+        exclusion_rules_manager.add_pattern_rule("NOT 晴れ AND 高速道路 AND 環境状況/その他 = 夜間")
+        exclusion_rules_manager.add_pattern_rule("霧 * 牽引")
+        path = os.path.join(self.temp_dir.name, "rules.json")
+        exclusion_rules_manager.save_rules_to(path)
+
+        with open(path, encoding="utf-8") as file:
+            data = json.load(file)
+        self.assertEqual(data["version"], "2.0")
+        self.assertEqual(data["rules"][0]["items"], ["高速道路", "停止"])
+        self.assertIn("expression", data["rules"][1])
+
+        loaded = ExclusionRulesManager.from_file(path, self.category_manager)
+        self.assertEqual(loaded.rules, exclusion_rules_manager.rules)
+        self.assertEqual(loaded.rule_expressions, exclusion_rules_manager.rule_expressions)
+        self.assertEqual([loaded.get_rule_description(rule) for rule in loaded.rules],
+                         [exclusion_rules_manager.get_rule_description(rule) for rule in loaded.rules])
+        self.assertEqual(loaded.compile().conjunctions, exclusion_rules_manager.compile().conjunctions)
+
+    def test_load_version_1(self):
+        path = self.write_json("rules_v1.json", {"version": "1.0", "rules": [
+            {"id": 1, "items": ["高速道路", "停止"], "description": "高速道路で停止"},
+            {"id": 2, "items": ["霧", "高速", "牽引"]}]})
+        exclusion_rules_manager = ExclusionRulesManager.from_file(path, self.category_manager)
+        self.assertEqual(exclusion_rules_manager.rules, ["高速道路 * 停止", "霧 * 高速 * 牽引"])
+        self.assertEqual(exclusion_rules_manager.get_rule_description("高速道路 * 停止"), "高速道路で停止")
+        self.assertTrue(exclusion_rules_manager.is_excluded({"環境状況": ("晴れ", "高速道路", "昼間"),
+                                                             "車両状況": ("停止", "単独")}))
+
+        # 1.0 のファイルを保存し直すと 2.0 になり、同じルールとして読み込める
+        saved = os.path.join(self.temp_dir.name, "rules_v2.json")
+        exclusion_rules_manager.save_rules_to(saved)
+        self.assertEqual(ExclusionRulesManager.from_file(saved).rules, exclusion_rules_manager.rules)
+
+    def test_load_invalid_files(self):
+        invalid = [
+            {"version": "3.0", "rules": []},
+            {"version": "1.0", "rules": [{"id": 1, "expression": {"item": "晴れ"}}]},  # 1.0 では式を使えない
+            {"version": "2.0", "rules": [{"id": 1, "items": []}]},
+            {"version": "2.0", "rules": [{"id": 1, "items": [1, 2]}]},
+            {"version": "2.0", "rules": [{"id": 1, "expression": {"and": []}}]},
+            {"rules": "not a list"},
+        ]
+        for position, data in enumerate(invalid):
+            path = self.write_json(f"invalid_{position}.json", data)
+            with self.assertRaises(ValueError, msg=data):
+                ExclusionRulesManager.from_file(path, self.category_manager)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,118 @@
+import json
+import os
+import queue
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+from adas_scenario_generator.category_manager import CategoryManager
+from adas_scenario_generator.exclusion_rules import ExclusionRulesManager
+from adas_scenario_generator.generation_worker import GenerationWorker
+from adas_scenario_generator.incremental import IncrementalResultSet
+from adas_scenario_generator.scenario_generator import ScenarioGenerator
+
+CATEGORIES = {
+    "環境状況": {"場所": ["市街地", "高速道路", "駐車場"], "天候": ["晴れ", "雨", "雪"]},
+    "車両状況": {"速度": ["停止", "低速", "高速"], "車線": ["左", "中央", "右"]}
+}
+RULES = [("高速道路", "停止"), ("駐車場", "高速"), ("雪", "高速")]
+
+
+def drain(worker, timeout=10):
+    # 完了・中断・エラーのいずれかのメッセージまでを受け取る
+    messages = []
+    while True:
+        message = worker.queue.get(timeout=timeout)
+        messages.append(message)
+        if message[0] in ("done", "cancelled", "error"):
+            return messages
+
+
+class GenerationWorkerTest(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        category_file = os.path.join(self.temp_dir.name, "categories.json")
+        with open(category_file, "w", encoding="utf-8") as file:
+            json.dump(CATEGORIES, file, ensure_ascii=False)
+        category_manager = CategoryManager.from_file(category_file)
+        exclusion_rules_manager = ExclusionRulesManager(category_manager)
+        for rule in RULES:
+            exclusion_rules_manager.add_rule(*rule)
+        self.scenario_generator = ScenarioGenerator(category_manager, exclusion_rules_manager)
+        self.selected = {category: {subcategory: list(items) for subcategory, items in subcategories.items()}
+                         for category, subcategories in CATEGORIES.items()}
+        self.expected = list(self.scenario_generator.iter_filtered_indices(self.selected))
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_batches_counts_and_done(self):
+        worker = GenerationWorker(self.scenario_generator, self.selected, batch_size=7)
+        worker.start()
+        messages = drain(worker)
+        kinds = [kind for kind, _ in messages]
+
+        self.assertEqual(messages[0], ("total", 81))
+        self.assertEqual(kinds[-1], "done")
+        self.assertEqual(kinds.count("counts"), 1)
+        counts = dict(messages)["counts"]
+        self.assertEqual(counts, {"total": 81, "valid": len(self.expected), "excluded": 81 - len(self.expected)})
+
+        batches = [indices for kind, indices in messages if kind == "batch"]
+        self.assertTrue(all(len(batch) <= 7 for batch in batches))
+        self.assertEqual([index for batch in batches for index in batch], self.expected)
+        result_set = dict(messages)["result_set"]
+        self.assertIsInstance(result_set, IncrementalResultSet)
+        self.assertEqual(result_set.valid_count(), len(self.expected))
+
+    def test_streams_before_counting_finishes(self):
+        # 計数が終わらなくても、生成した結果は先に届く
+        release = threading.Event()
+        count_scenarios = self.scenario_generator.count_scenarios
+
+        def blocked_count(selected, per_rule=True):
+            release.wait(10)
+            return count_scenarios(selected, per_rule)
+
+        worker = GenerationWorker(self.scenario_generator, self.selected, batch_size=5)
+        with mock.patch.object(self.scenario_generator, "count_scenarios", side_effect=blocked_count):
+            worker.start()
+            self.assertEqual(worker.queue.get(timeout=10)[0], "total")
+            self.assertEqual(worker.queue.get(timeout=10)[0], "batch")
+            messages = drain(worker)
+            release.set()
+        self.assertEqual([kind for kind, _ in messages].count("counts"), 1)
+        self.assertEqual(dict(messages)["counts"]["valid"], len(self.expected))
+        self.assertEqual(messages[-1][0], "done")
+
+    def test_cancel_inside_loop(self):
+        worker = GenerationWorker(self.scenario_generator, self.selected, batch_size=1000)
+        iter_filtered_indices = self.scenario_generator.iter_filtered_indices
+
+        def cancelled_after_three(selected):
+            for position, index in enumerate(iter_filtered_indices(selected)):
+                if position == 3:
+                    worker.cancel()
+                yield index
+
+        with mock.patch.object(self.scenario_generator, "iter_filtered_indices", side_effect=cancelled_after_three):
+            worker.run()
+        messages = drain(worker)
+        kinds = [kind for kind, _ in messages]
+        self.assertEqual(kinds[-1], "cancelled")
+        self.assertNotIn("batch", kinds)  # 1回目の送信（1000件）より前に中断された
+        self.assertNotIn("result_set", kinds)
+        self.assertNotIn("done", kinds)
+
+    def test_error(self):
+        worker = GenerationWorker(self.scenario_generator, self.selected)
+        with mock.patch.object(self.scenario_generator, "iter_filtered_indices", side_effect=RuntimeError("失敗")):
+            worker.run()
+        self.assertEqual(drain(worker)[-1], ("error", "失敗"))
+        with self.assertRaises(queue.Empty):
+            worker.queue.get(timeout=0.1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,119 @@
+import json
+import os
+import random
+import tempfile
+import unittest
+from unittest import mock
+
+from adas_scenario_generator import incremental
+from adas_scenario_generator.category_manager import CategoryManager
+from adas_scenario_generator.exclusion_rules import ExclusionRulesManager
+from adas_scenario_generator.incremental import IncrementalResultSet, ValidIndexTree
+from adas_scenario_generator.scenario import SCENARIO_CATEGORIES
+from adas_scenario_generator.scenario_generator import ScenarioGenerator
+
+
+class ValidIndexTreeTest(unittest.TestCase):
+    def test_matches_flags(self):
+        rng = random.Random(0)
+        for size in (0, 1, 2, 7, 64, 100):
+            flags = [rng.random() < 0.5 for _ in range(size)]
+            tree = ValidIndexTree(flags)
+            for _ in range(50):
+                valid = [index for index, flag in enumerate(flags) if flag]
+                self.assertEqual(tree.total(), len(valid))
+                self.assertEqual([tree.find(rank) for rank in range(len(valid))], valid)
+                if size:
+                    index = rng.randrange(size)
+                    tree.add(index, -1 if flags[index] else 1)
+                    flags[index] = not flags[index]
+            self.assertEqual(ValidIndexTree.from_indices(size, valid).tree, ValidIndexTree(
+                [index in set(valid) for index in range(size)]).tree)
+
+
+class IncrementalResultSetTest(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def make_case(self, seed):
+        rng = random.Random(seed)
+        pool = [f"項目{i}" for i in range(8)]
+        categories = {category: {f"{category}{j}": rng.sample(pool, rng.randint(1, 4))
+                                 for j in range(rng.randint(1, 3))}
+                      for category in SCENARIO_CATEGORIES}
+        category_file = os.path.join(self.temp_dir.name, "categories.json")
+        with open(category_file, "w", encoding="utf-8") as file:
+            json.dump(categories, file, ensure_ascii=False)
+        category_manager = CategoryManager.from_file(category_file)
+        exclusion_rules_manager = ExclusionRulesManager(category_manager)
+        selected = {category: {subcategory: [item for item in items if rng.random() < 0.8]
+                               for subcategory, items in subcategories.items()}
+                    for category, subcategories in categories.items()}
+        subcategory_names = [subcategory for subcategories in categories.values() for subcategory in subcategories]
+        expressions = [" * ".join(rng.sample(pool, 2)) for _ in range(6)]
+        expressions += [" AND ".join(rng.sample(pool, 3)) for _ in range(3)]
+        expressions += [f"NOT {rng.choice(pool)} AND {rng.choice(pool)}" for _ in range(3)]
+        expressions += [f"{rng.choice(subcategory_names)} = {rng.choice(pool)} AND {rng.choice(pool)}"
+                        for _ in range(2)]
+        return rng, ScenarioGenerator(category_manager, exclusion_rules_manager), selected, expressions
+
+    def add(self, exclusion_rules_manager, expression):
+        if " * " in expression:
+            exclusion_rules_manager.add_rule(*expression.split(" * "))
+            return expression
+        try:
+            return exclusion_rules_manager.add_pattern_rule(expression)
+        except ValueError:
+            return None  # 展開できない（曖昧な NOT など）ルールは使わない
+
+    def assert_matches_regeneration(self, result_set, scenario_generator, selected, seed):
+        expected = list(scenario_generator.iter_filtered_indices(selected))
+        self.assertEqual(result_set.valid_count(), len(expected), seed)
+        rows = result_set.rows(hide_excluded=True)
+        self.assertEqual([rows.product_index(position) for position in range(len(rows))], expected, seed)
+        self.assertEqual([index for index in range(result_set.total) if not result_set.is_excluded(index)],
+                         expected, seed)
+        all_rows = result_set.rows()
+        self.assertEqual(len(all_rows), result_set.total)
+        for index in range(result_set.total):
+            self.assertEqual(all_rows[index], scenario_generator.scenario_at(selected, index), seed)
+            self.assertEqual(bool(result_set.matched_rules(index)), result_set.is_excluded(index), (seed, index))
+
+    def test_rule_changes_match_full_regeneration(self):
+        for seed in range(40):
+            rng, scenario_generator, selected, expressions = self.make_case(seed)
+            exclusion_rules_manager = scenario_generator.exclusion_rules_manager
+            for expression in expressions[:3]:
+                self.add(exclusion_rules_manager, expression)
+            valid_indices = list(scenario_generator.iter_filtered_indices(selected)) if seed % 2 else None
+            result_set = IncrementalResultSet(scenario_generator, selected, valid_indices)
+            exclusion_rules_manager.add_listener(result_set.apply_change)
+            self.assert_matches_regeneration(result_set, scenario_generator, selected, seed)
+
+            for _ in range(12):
+                rules = exclusion_rules_manager.get_rules()
+                if rules and rng.random() < 0.4:
+                    exclusion_rules_manager.remove_rule(rng.choice(rules))
+                else:
+                    self.add(exclusion_rules_manager, rng.choice(expressions))
+                self.assertEqual(result_set.rules_version, exclusion_rules_manager.version, seed)
+                self.assert_matches_regeneration(result_set, scenario_generator, selected, seed)
+
+    def test_reset_is_not_applied(self):
+        _, scenario_generator, selected, _ = self.make_case(0)
+        result_set = IncrementalResultSet(scenario_generator, selected)
+        self.assertIsNone(result_set.apply_change("reset", None))
+
+    def test_refuses_large_products(self):
+        _, scenario_generator, selected, _ = self.make_case(1)
+        total = IncrementalResultSet(scenario_generator, selected).total
+        with mock.patch.object(incremental, "MAX_INCREMENTAL_PRODUCT", total - 1):
+            with self.assertRaises(ValueError):
+                IncrementalResultSet(scenario_generator, selected)
+
+
+if __name__ == "__main__":
+    unittest.main()
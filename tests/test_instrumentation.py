@@ -0,0 +1,159 @@
+import itertools
+import json
+import os
+import random
+import tempfile
+import threading
+import unittest
+
+from adas_scenario_generator.category_manager import CategoryManager
+from adas_scenario_generator.exclusion_rules import ExclusionRulesManager
+from adas_scenario_generator.instrumentation import Instrumentation, instrumentation
+from adas_scenario_generator.scenario_generator import ScenarioGenerator
+
+CATEGORIES = {
+    "環境状況": {"場所": ["市街地", "高速道路", "駐車場"], "天候": ["晴れ", "雨"]},
+    "車両状況": {"速度": ["停止", "低速", "高速"], "車線": ["左", "右"]}
+}
+RULES = [("高速道路", "停止"), ("駐車場", "高速"), ("雨", "右"), ("高速道路", "雨")]
+
+
+class InstrumentationTest(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        category_file = os.path.join(self.temp_dir.name, "categories.json")
+        with open(category_file, "w", encoding="utf-8") as file:
+            json.dump(CATEGORIES, file, ensure_ascii=False)
+        self.category_manager = CategoryManager.from_file(category_file)
+        self.exclusion_rules_manager = ExclusionRulesManager(self.category_manager)
+        for rule in RULES:
+            self.exclusion_rules_manager.add_rule(*rule)
+        self.selected = {category: {subcategory: list(items) for subcategory, items in subcategories.items()}
+                         for category, subcategories in CATEGORIES.items()}
+        instrumentation.configure(True)
+
+    def tearDown(self):
+        instrumentation.configure(False)
+        self.temp_dir.cleanup()
+
+    def scenarios(self):
+        for location, weather, speed, lane in itertools.product(
+                *[items for subcategories in CATEGORIES.values() for items in subcategories.values()]):
+            yield {"環境状況": (location, weather), "車両状況": (speed, lane)}
+
+    def test_rule_stats_match_brute_force(self):
+        # 項目を1つでも含むルールはシナリオごとに1回だけ評価され、すべての項目を含む場合に該当する
+        evaluations = {" * ".join(rule): 0 for rule in RULES}
+        hits = dict(evaluations)
+        excluded = 0
+        for scenario in self.scenarios():
+            items = set(scenario["環境状況"] + scenario["車両状況"])
+            expected = [" * ".join(rule) for rule in RULES if set(rule) <= items]
+            self.assertEqual(self.exclusion_rules_manager.is_excluded_with_rules(scenario),
+                             (bool(expected), expected))
+            for rule in RULES:
+                evaluations[" * ".join(rule)] += bool(set(rule) & items)
+                hits[" * ".join(rule)] += set(rule) <= items
+            excluded += bool(expected)
+
+        report = instrumentation.report()
+        self.assertEqual({rule: stats["evaluations"] for rule, stats in report["rules"].items()}, evaluations)
+        self.assertEqual({rule: stats["hits"] for rule, stats in report["rules"].items()}, hits)
+        self.assertEqual(report["counters"], {"rule_evaluations": sum(evaluations.values()),
+                                              "scenarios_checked": 36, "scenarios_excluded": excluded})
+
+    def test_is_excluded_stops_at_first_hit(self):
+        scenario = {"環境状況": ("高速道路", "雨"), "車両状況": ("停止", "右")}
+        self.assertTrue(self.exclusion_rules_manager.is_excluded(scenario))
+        report = instrumentation.report()
+        self.assertEqual(sum(stats["hits"] for stats in report["rules"].values()), 1)
+        self.assertEqual(report["counters"]["rule_evaluations"],
+                         sum(stats["evaluations"] for stats in report["rules"].values()))
+        self.assertLessEqual(report["counters"]["rule_evaluations"], len(RULES))
+
+        instrumentation.reset()
+        self.assertFalse(self.exclusion_rules_manager.is_excluded({"環境状況": ("市街地", "晴れ"),
+                                                                   "車両状況": ("低速", "左")}))
+        self.assertEqual(instrumentation.report()["counters"],
+                         {"rule_evaluations": 0, "scenarios_checked": 1})
+
+    def test_generation_counters(self):
+        scenario_generator = ScenarioGenerator(self.category_manager, self.exclusion_rules_manager)
+        indices = list(scenario_generator.iter_filtered_indices(self.selected))
+        expected_valid = sum(not self.exclusion_rules_manager.compile().matching_rules(
+            scenario["環境状況"] + scenario["車両状況"]) for scenario in self.scenarios())
+        self.assertEqual(len(indices), expected_valid)
+        report = instrumentation.report()
+        self.assertEqual(report["counters"], {"scenarios_generated": 36, "scenarios_valid": expected_valid,
+                                              "scenarios_excluded": 36 - expected_valid})
+        self.assertEqual(report["timers"]["enumerate_filtered"]["calls"], 1)
+        self.assertGreater(sum(stats["prunes"] for stats in report["rules"].values()), 0)
+
+        instrumentation.configure(False)
+        self.assertEqual(list(scenario_generator.iter_filtered_indices(self.selected)), indices)
+        self.assertEqual(instrumentation.report()["counters"], {})
+
+    def test_concurrent_records(self):
+        threads_count = 8
+        repeat = 2000
+
+        def record():
+            for _ in range(repeat):
+                instrumentation.record_rule("A * B", evaluations=1, hits=1, prunes=1, seconds=0.5)
+                instrumentation.count("calls")
+                instrumentation.add_time("stage", 0.25)
+
+        threads = [threading.Thread(target=record) for _ in range(threads_count)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        report = instrumentation.report()
+        total = threads_count * repeat
+        self.assertEqual(report["rules"]["A * B"], {"evaluations": total, "hits": total, "prunes": total,
+                                                    "seconds": total * 0.5})
+        self.assertEqual(report["counters"], {"calls": total})
+        self.assertEqual(report["timers"]["stage"], {"calls": total, "seconds": total * 0.25, "max_seconds": 0.25})
+
+    def test_iter_stage(self):
+        finished = []
+        self.assertEqual(list(instrumentation.iter_stage("stage", range(5), finished.append)), list(range(5)))
+        self.assertEqual(finished, [5])
+        # 途中で打ち切った場合は on_finish を呼ばないが、時間は記録する
+        iterator = instrumentation.iter_stage("stage", range(5), finished.append)
+        next(iterator)
+        iterator.close()
+        self.assertEqual(finished, [5])
+        self.assertEqual(instrumentation.report()["timers"]["stage"]["calls"], 2)
+
+        instrumentation.configure(False)
+        values = range(3)
+        self.assertIs(instrumentation.iter_stage("stage", values), values)
+
+    def test_write_report(self):
+        rng = random.Random(0)
+        for _ in range(10):
+            instrumentation.record_rule(rng.choice(["A * B", "C * D"]), evaluations=1)
+        output = os.path.join(self.temp_dir.name, "report.json")
+        report = instrumentation.write_report(output)
+        with open(output, encoding="utf-8") as file:
+            self.assertEqual(json.load(file), report)
+        evaluations = [stats["evaluations"] for stats in report["rules"].values()]
+        self.assertEqual(evaluations, sorted(evaluations, reverse=True))
+        self.assertEqual(sum(evaluations), 10)
+
+    def test_from_environment(self):
+        cases = [({}, (False, False, False, None)),
+                 ({"ADAS_SCENARIO_INSTRUMENT": "0"}, (False, False, False, None)),
+                 ({"ADAS_SCENARIO_INSTRUMENT": "1"}, (True, False, False, None)),
+                 ({"ADAS_SCENARIO_INSTRUMENT": "1, Profile", "ADAS_SCENARIO_INSTRUMENT_OUT": "out.json"},
+                  (True, True, False, "out.json")),
+                 ({"ADAS_SCENARIO_INSTRUMENT": "memory"}, (True, False, True, None))]
+        for environ, expected in cases:
+            configured = Instrumentation.from_environment(environ)
+            self.assertEqual((configured.enabled, configured.profile, configured.memory, configured.output),
+                             expected, environ)
+
+
+if __name__ == "__main__":
+    unittest.main()
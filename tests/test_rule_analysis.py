@@ -0,0 +1,119 @@
+import itertools
+import json
+import os
+import random
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+from adas_scenario_generator.benchmark import scaled_categories, synthetic_rules
+from adas_scenario_generator.category_manager import CategoryManager
+from adas_scenario_generator.exclusion_rules import ExclusionRulesManager
+from adas_scenario_generator.rule_analysis import RuleSetAnalyzer
+from adas_scenario_generator.scenario import SCENARIO_CATEGORIES
+from adas_scenario_generator.scenario_generator import ScenarioGenerator
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data")
+CATEGORIES = {
+    "環境状況": {"場所": ["市街地", "高速道路", "駐車場"], "天候": ["晴れ", "雨"]},
+    "車両状況": {"速度": ["停止", "高速"]}
+}
+
+
+def valid_rows(category_manager, exclusion_rules_manager):
+    # すべてのサブカテゴリを選択したときの有効なシナリオを、直積をすべて列挙して求める
+    compiled = exclusion_rules_manager.compile()
+    item_lists = [items for category in SCENARIO_CATEGORIES
+                  for items in category_manager.categories[category].values() if items]
+    return [combination for combination in itertools.product(*item_lists)
+            if not compiled.for_item_lists(item_lists).is_excluded(combination)]
+
+
+class RuleSetAnalyzerTest(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def make_managers(self, categories):
+        category_file = os.path.join(self.temp_dir.name, "categories.json")
+        with open(category_file, "w", encoding="utf-8") as file:
+            json.dump(categories, file, ensure_ascii=False)
+        category_manager = CategoryManager.from_file(category_file)
+        return category_manager, ExclusionRulesManager(category_manager)
+
+    def test_report(self):
+        category_manager, exclusion_rules_manager = self.make_managers(CATEGORIES)
+        exclusion_rules_manager.add_rule("高速道路", "停止")
+        exclusion_rules_manager.add_rule("停止", "高速道路")
+        exclusion_rules_manager.add_pattern_rule("高速道路 AND 停止 AND 雨")
+        exclusion_rules_manager.add_rule("市街地", "存在しない項目")
+        exclusion_rules_manager.add_rule("市街地", "駐車場")
+        exclusion_rules_manager.add_rule("駐車場", "停止")
+        exclusion_rules_manager.add_rule("駐車場", "高速")
+
+        report = RuleSetAnalyzer(exclusion_rules_manager).analyze()
+        self.assertEqual(report["duplicates"], [{"rule": "停止 * 高速道路", "duplicate_of": "高速道路 * 停止"}])
+        self.assertEqual(report["subsumed"], [{"rule": "高速道路 * 停止 * 雨", "subsumed_by": ["高速道路 * 停止"]}])
+        self.assertEqual(report["orphaned"], [{"rule": "市街地 * 存在しない項目", "missing_items": ["存在しない項目"]}])
+        self.assertEqual(report["impossible"], [{"rule": "市街地 * 駐車場"}])
+        self.assertEqual(report["minimized_rules"], ["高速道路 * 停止", "駐車場 * 停止", "駐車場 * 高速"])
+        self.assertEqual(report["unreachable_items"], [{"category": "環境状況", "subcategory": "場所", "item": "駐車場"}])
+
+    def test_matches_brute_force(self):
+        # 最小化したルールは元のルールと同じシナリオを除外し、到達できない項目は有効なシナリオに現れない項目と一致する
+        for seed in range(60):
+            rng = random.Random(seed)
+            pool = [f"項目{i}" for i in range(8)]
+            categories = {category: {f"{category}{j}": rng.sample(pool, rng.randint(1, 3))
+                                     for j in range(rng.randint(1, 3))}
+                          for category in SCENARIO_CATEGORIES}
+            category_manager, exclusion_rules_manager = self.make_managers(categories)
+            for _ in range(rng.randint(0, 10)):
+                if rng.random() < 0.7:
+                    exclusion_rules_manager.add_rule(*rng.sample(pool, 2))
+                else:
+                    exclusion_rules_manager.add_pattern_rule(" AND ".join(rng.sample(pool, 3)))
+            expected = valid_rows(category_manager, exclusion_rules_manager)
+
+            report = RuleSetAnalyzer(exclusion_rules_manager).analyze()
+            minimized_manager = ExclusionRulesManager(category_manager)
+            for rule in report["minimized_rules"]:
+                minimized_manager.add_pattern_rule(exclusion_rules_manager.get_rule_expression(rule))
+            self.assertEqual(valid_rows(category_manager, minimized_manager), expected, seed)
+
+            slots = [(category, subcategory) for category in SCENARIO_CATEGORIES
+                     for subcategory, items in category_manager.categories[category].items() if items]
+            reachable = {(slot, item) for row in expected for slot, item in enumerate(row)}
+            unreachable = [{"category": category, "subcategory": subcategory, "item": item}
+                           for slot, (category, subcategory) in enumerate(slots)
+                           for item in category_manager.categories[category][subcategory]
+                           if (slot, item) not in reachable]
+            self.assertEqual(report["unreachable_items"], unreachable, seed)
+
+    def test_unreachable_items_compiles_levels_once(self):
+        category_manager, exclusion_rules_manager = self.make_managers(CATEGORIES)
+        exclusion_rules_manager.add_rule("駐車場", "停止")
+        exclusion_rules_manager.add_rule("駐車場", "高速")
+        with mock.patch.object(ScenarioGenerator, "_compile_levels", autospec=True,
+                               side_effect=ScenarioGenerator._compile_levels) as compile_levels:
+            unreachable = RuleSetAnalyzer(exclusion_rules_manager).unreachable_items()
+        self.assertEqual(unreachable, [{"category": "環境状況", "subcategory": "場所", "item": "駐車場"}])
+        self.assertEqual(compile_levels.call_count, 1)
+
+    def test_unreachable_items_at_scale(self):
+        # 同梱のカテゴリを4倍にした選択（約 6.6e9 通り）と500件のルールでも、項目ごとの探索は短時間で終わる
+        with open(os.path.join(DATA_DIR, "categories.json"), encoding="utf-8") as file:
+            categories = scaled_categories(json.load(file), 4)
+        category_manager, exclusion_rules_manager = self.make_managers(categories)
+        for first, second in synthetic_rules(categories, 500, 0):
+            exclusion_rules_manager.add_rule(first, second)
+        start = time.perf_counter()
+        RuleSetAnalyzer(exclusion_rules_manager).unreachable_items()
+        self.assertLess(time.perf_counter() - start, 5.0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,116 @@
+import codecs
+import json
+import os
+import tempfile
+import unittest
+
+from adas_scenario_generator.category_manager import CategoryManager
+from adas_scenario_generator.exclusion_rules import ExclusionRulesManager
+from adas_scenario_generator.scenario import Scenario, ScenarioBatch, ScenarioLayout
+from adas_scenario_generator.scenario_generator import ScenarioGenerator
+from adas_scenario_generator.scenario_writer import open_writer
+
+CATEGORIES = {
+    "環境状況": {"場所": ["市街地", "高速道路"], "天候": ["晴れ", "雨"]},
+    "車両状況": {"速度": ["停止", "高速"]}
+}
+
+
+class ScenarioTest(unittest.TestCase):
+    def test_equality_and_hash(self):
+        names = ["市街地", "晴れ", "停止", "雨"]
+        layout = ScenarioLayout(names, 2)
+        scenario = Scenario(layout, (0, 1, 2))
+        as_dict = {"環境状況": ("市街地", "晴れ"), "車両状況": ("停止",)}
+
+        self.assertEqual(scenario, Scenario(layout, (0, 1, 2)))
+        self.assertEqual(scenario, as_dict)
+        self.assertEqual(scenario.to_dict(), as_dict)
+        self.assertNotEqual(scenario, Scenario(layout, (0, 3, 2)))
+        # 環境状況と車両状況の区切りが違えば別のシナリオ
+        self.assertNotEqual(scenario, Scenario(ScenarioLayout(names, 1), (0, 1, 2)))
+        self.assertNotEqual(scenario, ("市街地", "晴れ", "停止"))
+
+        # 対応表が異なっても項目名が同じなら等しく、ハッシュも一致する
+        other = Scenario(ScenarioLayout(["停止", "晴れ", "市街地"], 2), (2, 1, 0))
+        self.assertEqual(scenario, other)
+        self.assertEqual(hash(scenario), hash(other))
+        self.assertEqual(len({scenario, other, Scenario(layout, (0, 1, 2))}), 1)
+        self.assertEqual(len({scenario, Scenario(layout, (0, 3, 2))}), 2)
+
+    def test_mapping_interface(self):
+        scenario = Scenario(ScenarioLayout(["市街地", "晴れ", "停止"], 2), (0, 1, 2))
+        self.assertEqual(list(scenario), ["環境状況", "車両状況"])
+        self.assertEqual(scenario["車両状況"], ("停止",))
+        self.assertEqual(scenario.get("その他", "なし"), "なし")
+        self.assertIn("環境状況", scenario)
+        with self.assertRaises(KeyError):
+            scenario["その他"]
+
+    def test_batch(self):
+        layout = ScenarioLayout(["市街地", "晴れ", "停止", "雨"], 2)
+        batch = ScenarioBatch(layout, 3)
+        batch.append((0, 1, 2))
+        batch.extend([(0, 3, 2), (0, 1, 2)])
+        self.assertEqual(len(batch), 3)
+        self.assertEqual(batch[1], Scenario(layout, (0, 3, 2)))
+        self.assertEqual(batch[-1], batch[0])
+        with self.assertRaises(IndexError):
+            batch[3]
+        self.assertEqual(list(batch.rows()), [("市街地", "晴れ", "停止"), ("市街地", "雨", "停止"),
+                                              ("市街地", "晴れ", "停止")])
+        self.assertEqual(len(set(batch)), 2)
+        self.assertEqual(batch.nbytes(), 3 * 3 * 2)
+
+        empty = ScenarioBatch(layout, 0)
+        empty.extend([(), ()])
+        self.assertEqual(list(empty.rows()), [(), ()])
+
+
+class ScenarioBatchGenerationTest(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        category_file = os.path.join(self.temp_dir.name, "categories.json")
+        with open(category_file, "w", encoding="utf-8") as file:
+            json.dump(CATEGORIES, file, ensure_ascii=False)
+        category_manager = CategoryManager.from_file(category_file)
+        exclusion_rules_manager = ExclusionRulesManager(category_manager)
+        exclusion_rules_manager.add_rule("高速道路", "停止")
+        self.scenario_generator = ScenarioGenerator(category_manager, exclusion_rules_manager)
+        self.selected = {category: {subcategory: list(items) for subcategory, items in subcategories.items()}
+                         for category, subcategories in CATEGORIES.items()}
+        self.expected = list(self.scenario_generator.iter_filtered(self.selected))
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_batches_match_iter_filtered(self):
+        self.assertEqual(list(self.scenario_generator.generate_batch(self.selected)), self.expected)
+        self.assertEqual(list(self.scenario_generator.iter_compact(self.selected)), self.expected)
+        for batch_size in (1, 2, 3, 6, 100):
+            batches = list(self.scenario_generator.iter_batches(self.selected, batch_size))
+            self.assertTrue(all(0 < len(batch) <= batch_size for batch in batches))
+            self.assertEqual([scenario for batch in batches for scenario in batch], self.expected)
+
+    def test_write_batch_matches_write_rows(self):
+        columns = [(category, subcategory) for category, subcategories in CATEGORIES.items()
+                   for subcategory in subcategories]
+        rows = [scenario["環境状況"] + scenario["車両状況"] for scenario in self.expected]
+        for output_format in ("csv", "jsonl"):
+            outputs = []
+            for name in ("rows", "batch"):
+                path = os.path.join(self.temp_dir.name, f"{name}.{output_format}")
+                writer = open_writer(path, columns)
+                if name == "rows":
+                    writer.write_rows(rows)
+                else:
+                    for batch in self.scenario_generator.iter_batches(self.selected, 4):
+                        writer.write_batch(batch)
+                writer.close()
+                with codecs.open(path, "r", "utf-8-sig") as file:
+                    outputs.append(file.read())
+            self.assertEqual(outputs[0], outputs[1], output_format)
+
+
+if __name__ == "__main__":
+    unittest.main()
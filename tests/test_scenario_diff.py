@@ -0,0 +1,113 @@
+import copy
+import itertools
+import json
+import os
+import random
+import tempfile
+import unittest
+
+from adas_scenario_generator.category_manager import CategoryManager
+from adas_scenario_generator.exclusion_rules import ExclusionRulesManager
+from adas_scenario_generator.scenario_diff import CHANGE_KINDS, ScenarioDiff, ScenarioSnapshot
+
+CATEGORIES = {
+    "環境状況": {"場所": ["市街地", "高速道路", "駐車場", "交差点"], "道路形状": ["直線", "カーブ", "坂道"],
+             "天候": ["晴れ", "雨", "雪"]},
+    "車両状況": {"速度": ["停止", "低速", "中速", "高速"], "周辺": ["歩行者", "自転車", "先行車"]}
+}
+PATTERNS = ["高速道路 AND NOT 停止", "速度 ∈ {高速, 中速} AND 雨"]
+
+
+def valid_scenarios(snapshot):
+    # 有効なシナリオを直積をすべて列挙して求める。シナリオは（サブカテゴリ, 項目）の集合で表す
+    item_lists = [snapshot.items_by_slot[slot] for slot in snapshot.slots]
+    compiled = snapshot.exclusion_rules_manager.compile().for_item_lists(item_lists)
+    return {frozenset(zip(snapshot.slots, combination)): not compiled.is_excluded(combination)
+            for combination in itertools.product(*item_lists)}
+
+
+class ScenarioDiffTest(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def make_snapshot(self, name, categories, rules, patterns, selected):
+        category_file = os.path.join(self.temp_dir.name, f"{name}.json")
+        with open(category_file, "w", encoding="utf-8") as file:
+            json.dump(categories, file, ensure_ascii=False)
+        category_manager = CategoryManager.from_file(category_file)
+        exclusion_rules_manager = ExclusionRulesManager(category_manager)
+        for rule in rules:
+            exclusion_rules_manager.add_rule(*rule)
+        for pattern in patterns:
+            exclusion_rules_manager.add_pattern_rule(pattern)
+        return ScenarioSnapshot(category_manager, exclusion_rules_manager, selected)
+
+    def make_case(self, seed):
+        # カテゴリの項目の追加・削除、サブカテゴリの削除、ルールの追加・削除を行った2つの版を作る
+        rng = random.Random(seed)
+        all_items = [item for subcategories in CATEGORIES.values() for items in subcategories.values()
+                     for item in items]
+        rules = [tuple(rng.sample(all_items, 2)) for _ in range(rng.randint(0, 10))]
+        patterns = PATTERNS if rng.random() < 0.5 else []
+        selected = {category: {subcategory: [item for item in items if rng.random() < 0.7]
+                               for subcategory, items in subcategories.items()}
+                    for category, subcategories in CATEGORIES.items()}
+        old = self.make_snapshot("old", CATEGORIES, rules, patterns, selected)
+
+        categories = copy.deepcopy(CATEGORIES)
+        for _ in range(rng.randint(0, 3)):
+            category = rng.choice(list(categories))
+            items = categories[category][rng.choice(list(categories[category]))]
+            if rng.random() < 0.5 and items:
+                items.remove(rng.choice(items))
+            elif f"新項目{len(items)}" not in items:
+                items.append(f"新項目{len(items)}")
+        if rng.random() < 0.15:
+            del categories["環境状況"]["道路形状"]
+        new_rules = [rule for rule in rules if rng.random() < 0.8]
+        new_rules += [tuple(rng.sample(all_items, 2)) for _ in range(rng.randint(0, 4))]
+        new_patterns = patterns if rng.random() < 0.7 else []
+        # 新しい版の選択は、古い版で選択していた項目と追加された項目
+        new_selected = {category: {subcategory: [item for item in items
+                                                 if item in selected[category].get(subcategory, [])
+                                                 or item.startswith("新項目")]
+                                   for subcategory, items in subcategories.items()}
+                        for category, subcategories in categories.items()}
+        new = self.make_snapshot("new", categories, new_rules, new_patterns, new_selected)
+        return old, new
+
+    def test_matches_brute_force(self):
+        for seed in range(40):
+            old, new = self.make_case(seed)
+            diff = ScenarioDiff(old, new)
+            old_valid, new_valid = valid_scenarios(old), valid_scenarios(new)
+
+            expected = set()
+            for scenario, valid in new_valid.items():
+                if scenario not in old_valid:
+                    if valid:
+                        expected.add(("added", scenario))
+                elif old_valid[scenario] and not valid:
+                    expected.add(("newly_excluded", scenario))
+                elif not old_valid[scenario] and valid:
+                    expected.add(("newly_allowed", scenario))
+            expected.update(("removed", scenario) for scenario, valid in old_valid.items()
+                            if valid and scenario not in new_valid)
+
+            changes = [(kind, frozenset((slot, item) for slot, item in zip(diff.slots, row) if item is not None))
+                       for kind, row in diff.iter_changes()]
+            self.assertEqual(len(changes), len(set(changes)), seed)
+            self.assertEqual(set(changes), expected, seed)
+
+            summary = diff.summary()
+            for kind in CHANGE_KINDS:
+                self.assertEqual(summary[kind], sum(1 for change in expected if change[0] == kind), (seed, kind))
+            self.assertEqual(summary["old"], {"total": len(old_valid), "valid": sum(old_valid.values())}, seed)
+            self.assertEqual(summary["new"], {"total": len(new_valid), "valid": sum(new_valid.values())}, seed)
+
+
+if __name__ == "__main__":
+    unittest.main()
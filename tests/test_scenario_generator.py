@@ -0,0 +1,227 @@
+import itertools
+import json
+import os
+import random
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+from adas_scenario_generator import scenario_generator as scenario_generator_module
+from adas_scenario_generator.benchmark import scaled_categories, synthetic_rules
+from adas_scenario_generator.category_manager import CategoryManager
+from adas_scenario_generator.exclusion_rules import ExclusionRulesManager
+from adas_scenario_generator.result_cache import ScenarioResultCache
+from adas_scenario_generator.scenario import SCENARIO_CATEGORIES
+from adas_scenario_generator.scenario_generator import ScenarioGenerator
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data")
+
+
+def random_case(seed):
+    # 小さなカテゴリ・選択・ルールを乱数で作る。同じ名前の項目が複数のサブカテゴリにあることもある
+    rng = random.Random(seed)
+    pool = [f"項目{i}" for i in range(10)]
+    categories = {}
+    for category in SCENARIO_CATEGORIES:
+        categories[category] = {f"{category}{j}": rng.sample(pool, rng.randint(1, 4))
+                                for j in range(rng.randint(1, 3))}
+    selected = {category: {subcategory: [item for item in items if rng.random() < 0.8]
+                           for subcategory, items in subcategories.items()}
+                for category, subcategories in categories.items()}
+    rules = list(dict.fromkeys(tuple(rng.sample(pool, rng.randint(2, 3))) for _ in range(rng.randint(0, 8))))
+    return categories, selected, rules
+
+
+def item_lists_of(selected):
+    return [items for category in SCENARIO_CATEGORIES for items in selected[category].values() if items]
+
+
+def brute_force(selected, rules):
+    # 直積をすべて列挙し、ルールの項目をすべて含む組み合わせを除く
+    return [combination for combination in itertools.product(*item_lists_of(selected))
+            if not any(set(rule) <= set(combination) for rule in rules)]
+
+
+def rows(scenarios):
+    return [tuple(scenario["環境状況"]) + tuple(scenario["車両状況"]) for scenario in scenarios]
+
+
+class ScenarioGeneratorTest(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def make_generator(self, categories, rules, result_cache=None):
+        category_file = os.path.join(self.temp_dir.name, "categories.json")
+        with open(category_file, "w", encoding="utf-8") as file:
+            json.dump(categories, file, ensure_ascii=False)
+        category_manager = CategoryManager.from_file(category_file)
+        exclusion_rules_manager = ExclusionRulesManager(category_manager)
+        for rule in rules:
+            exclusion_rules_manager.add_pattern_rule(" * ".join(rule))
+        return ScenarioGenerator(category_manager, exclusion_rules_manager, result_cache)
+
+    def test_iter_pruned_matches_brute_force(self):
+        for seed in range(80):
+            categories, selected, rules = random_case(seed)
+            scenario_generator = self.make_generator(categories, rules)
+            item_lists = item_lists_of(selected)
+            expected = brute_force(selected, rules)
+            self.assertEqual(list(scenario_generator._iter_pruned(item_lists)), expected, seed)
+
+            product = list(itertools.product(*item_lists))
+            indices = list(scenario_generator._iter_pruned(item_lists, as_index=True))
+            self.assertEqual([product[index] for index in indices], expected, seed)
+
+    def test_iter_filtered_matches_brute_force(self):
+        for seed in range(80):
+            categories, selected, rules = random_case(seed)
+            scenario_generator = self.make_generator(categories, rules)
+            self.assertEqual(rows(scenario_generator.iter_filtered(selected)), brute_force(selected, rules), seed)
+
+    def test_count_scenarios_per_rule(self):
+        for seed in range(80):
+            categories, selected, rules = random_case(seed)
+            scenario_generator = self.make_generator(categories, rules)
+            product = list(itertools.product(*item_lists_of(selected)))
+            counts = scenario_generator.count_scenarios(selected)
+            self.assertEqual(counts["total"], len(product), seed)
+            self.assertEqual(counts["valid"], len(brute_force(selected, rules)), seed)
+            self.assertEqual(counts["excluded"], counts["total"] - counts["valid"], seed)
+            for rule in rules:
+                expected = sum(1 for combination in product if set(rule) <= set(combination))
+                self.assertEqual(counts["per_rule"][" * ".join(rule)], expected, (seed, rule))
+            self.assertNotIn("per_rule", scenario_generator.count_scenarios(selected, per_rule=False))
+
+    def test_parallel_workers_match_serial(self):
+        for seed in range(3):
+            categories, selected, rules = random_case(seed)
+            scenario_generator = self.make_generator(categories, rules)
+            self.assertEqual(rows(scenario_generator.iter_filtered(selected, workers=2)),
+                             brute_force(selected, rules))
+            self.assertEqual(list(scenario_generator.iter_filtered_indices(selected, workers=2)),
+                             list(scenario_generator.iter_filtered_indices(selected)))
+
+    def test_valid_scenario_at_and_sample(self):
+        for seed in range(40):
+            categories, selected, rules = random_case(seed)
+            scenario_generator = self.make_generator(categories, rules)
+            expected = brute_force(selected, rules)
+            for rank, combination in enumerate(expected):
+                self.assertEqual(rows([scenario_generator.valid_scenario_at(selected, rank)]), [combination])
+
+            sample = rows(scenario_generator.sample(selected, len(expected) // 2, seed=seed))
+            self.assertEqual(len(set(sample)), len(expected) // 2)
+            self.assertTrue(set(sample) <= set(expected))
+            with self.assertRaises(ValueError):
+                scenario_generator.sample(selected, len(expected) + 1)
+
+    def test_count_and_rank_with_small_tail_products(self):
+        # 末尾側の直積の上限を小さくして、先頭側の計数と末尾側のビット集合の境界をいろいろな位置で確かめる
+        for tail_limit in (1, 4, 30):
+            with mock.patch.object(scenario_generator_module, "MAX_TAIL_PRODUCT", tail_limit):
+                for seed in range(40):
+                    categories, selected, rules = random_case(seed)
+                    scenario_generator = self.make_generator(categories, rules)
+                    product = list(itertools.product(*item_lists_of(selected)))
+                    expected = brute_force(selected, rules)
+                    counts = scenario_generator.count_scenarios(selected)
+                    self.assertEqual(counts["valid"], len(expected), (tail_limit, seed))
+                    for rule in rules:
+                        matched = sum(1 for combination in product if set(rule) <= set(combination))
+                        self.assertEqual(counts["per_rule"][" * ".join(rule)], matched, (tail_limit, seed, rule))
+                    for rank, combination in enumerate(expected):
+                        self.assertEqual(rows([scenario_generator.valid_scenario_at(selected, rank)]),
+                                         [combination], (tail_limit, seed))
+                    sample = rows(scenario_generator.sample(selected, len(expected), seed=seed))
+                    self.assertEqual(sorted(sample), sorted(expected), (tail_limit, seed))
+
+    def test_count_scales_to_large_products(self):
+        # 同梱のカテゴリを4倍にした直積（約 6.6e9 通り）と500件のルールでも、数え上げずに短時間で数えられる
+        with open(os.path.join(DATA_DIR, "categories.json"), encoding="utf-8") as file:
+            base = json.load(file)
+        categories = scaled_categories({category: base[category] for category in SCENARIO_CATEGORIES}, 4)
+        exclusion_rules_manager = ExclusionRulesManager()
+        for first, second in synthetic_rules(categories, 500, 0):
+            exclusion_rules_manager.add_rule(first, second)
+        scenario_generator = ScenarioGenerator(None, exclusion_rules_manager)
+        selected = {category: {subcategory: list(items) for subcategory, items in subcategories.items()}
+                    for category, subcategories in categories.items()}
+
+        start = time.perf_counter()
+        counts = scenario_generator.count_scenarios(selected, per_rule=False)
+        elapsed = time.perf_counter() - start
+        self.assertGreater(counts["total"], 10 ** 9)
+        self.assertLess(counts["valid"], counts["total"])
+        self.assertLess(elapsed, 15.0)
+
+        item_lists, _ = scenario_generator._scenario_item_lists(selected)
+        counter = scenario_generator_module.ValidScenarioCounter(
+            item_lists, scenario_generator._compiled_rules(item_lists))
+        self.assertLessEqual(counter.tail_size, scenario_generator_module.MAX_TAIL_PRODUCT)
+        self.assertLess(counter.split, len(item_lists))
+
+    def test_covering_scenarios_cover_all_valid_tuples(self):
+        for seed in range(30):
+            categories, selected, rules = random_case(seed)
+            scenario_generator = self.make_generator(categories, rules)
+            valid = brute_force(selected, rules)
+            for strength in (1, 2, 3):
+                covering = rows(scenario_generator.generate_covering_scenarios(selected, strength, seed))
+                self.assertTrue(set(covering) <= set(valid), (seed, strength))
+
+                width = len(item_lists_of(selected))
+                positions = list(itertools.combinations(range(width), min(strength, width)))
+                required = {(slots, tuple(row[slot] for slot in slots)) for row in valid for slots in positions}
+                covered = {(slots, tuple(row[slot] for slot in slots)) for row in covering for slots in positions}
+                self.assertTrue(required <= covered, (seed, strength))
+
+    @unittest.skipIf(numpy is None, "numpy がインストールされていない")
+    def test_numpy_backend_matches_python(self):
+        for seed in range(40):
+            categories, selected, rules = random_case(seed)
+            scenario_generator = self.make_generator(categories, rules)
+            self.assertEqual(rows(scenario_generator.iter_filtered(selected, backend="numpy")),
+                             brute_force(selected, rules), seed)
+
+    def test_result_cache_matches_uncached(self):
+        cache = ScenarioResultCache(os.path.join(self.temp_dir.name, "cache"))
+        for seed in range(20):
+            categories, selected, rules = random_case(seed)
+            scenario_generator = self.make_generator(categories, rules, cache)
+            expected = brute_force(selected, rules)
+            self.assertEqual(rows(scenario_generator.iter_filtered(selected)), expected)  # キャッシュなし
+            self.assertEqual(rows(scenario_generator.iter_filtered(selected)), expected)  # キャッシュあり
+
+    def test_result_cache_serves_per_rule_counts(self):
+        # 生成時に保存したルールごとの除外数を、項目の順序が違う同じルールにも計数せずに返す
+        cache = ScenarioResultCache(os.path.join(self.temp_dir.name, "cache"))
+        for seed in range(20):
+            categories, selected, rules = random_case(seed)
+            if not item_lists_of(selected):
+                continue
+            expected = self.make_generator(categories, rules).count_scenarios(selected)
+            list(self.make_generator(categories, rules, cache).iter_filtered(selected))
+
+            reversed_rules = [tuple(reversed(rule)) for rule in rules]
+            scenario_generator = self.make_generator(categories, reversed_rules, cache)
+            with mock.patch.object(scenario_generator, "_count_per_rule", side_effect=AssertionError), \
+                    mock.patch.object(scenario_generator, "_count_valid", side_effect=AssertionError):
+                counts = scenario_generator.count_scenarios(selected)
+            self.assertEqual({key: counts[key] for key in ("total", "valid", "excluded")},
+                             {key: expected[key] for key in ("total", "valid", "excluded")}, seed)
+            self.assertEqual(counts["per_rule"],
+                             {" * ".join(reversed(rule.split(" * "))): matched
+                              for rule, matched in expected["per_rule"].items()}, seed)
+
+
+if __name__ == "__main__":
+    unittest.main()